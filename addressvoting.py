@@ -0,0 +1,183 @@
+"""
+Estimation of our WAN address and connection type.
+
+Peers tell us, in every introduction request and response, the address that they see us at.  AddressVotes keeps the
+most recent of these votes for each voter and LanMatcher decides which voters are within our LAN, and hence can not
+know our WAN address.  Both are updated in constant time per message.
+"""
+from socket import inet_aton, error as socket_error
+from struct import unpack_from
+
+from .util import get_lan_address_without_netifaces
+
+# LanMatcher forgets all classified hosts when it has more than this many
+LAN_MATCHER_CACHE_SIZE = 4096
+
+# private subnets that are considered to be within our LAN when netifaces is not available
+_PRIVATE_SUBNETS = (("192.168.0.0", 16), ("172.16.0.0", 12), ("10.0.0.0", 8))
+
+
+def _address_to_long(address):
+    return unpack_from(">L", inet_aton(address))[0]
+
+
+class LanMatcher(object):
+
+    """
+    Tells whether a host is within one of our LAN subnets.
+
+    The subnets are grouped by netmask, hence a host is tested using one set lookup per distinct netmask.  The result
+    for each host is cached.
+    """
+
+    def __init__(self, subnets, own_addresses=()):
+        """
+        SUBNETS is a list with (address, netmask) tuples, both as integers.  OWN_ADDRESSES are hosts that are always
+        within our LAN.
+        """
+        networks = {}
+        for address, netmask in subnets:
+            networks.setdefault(netmask, set()).add(address & netmask)
+        self._networks = networks.items()
+        self._own_addresses = frozenset(own_addresses)
+        self._cache = {}
+
+    @classmethod
+    def from_interfaces(cls, interfaces):
+        """
+        Returns a LanMatcher for the Interface instances given by Dispersy._get_interface_addresses.
+        """
+        return cls([(_address_to_long(interface.address), _address_to_long(interface.netmask))
+                    for interface in interfaces])
+
+    @classmethod
+    def without_netifaces(cls):
+        """
+        Returns a LanMatcher for the private subnets and our own address, used when netifaces is not available.
+        """
+        return cls([(_address_to_long(address), (0xffffffff << (32 - bits)) & 0xffffffff)
+                    for address, bits in _PRIVATE_SUBNETS],
+                   [get_lan_address_without_netifaces()])
+
+    def __contains__(self, host):
+        try:
+            return self._cache[host]
+        except KeyError:
+            pass
+
+        if host in self._own_addresses:
+            result = True
+        else:
+            try:
+                l_host = _address_to_long(host)
+            except socket_error:
+                result = False
+            else:
+                result = any(l_host & netmask in addresses for netmask, addresses in self._networks)
+
+        if len(self._cache) >= LAN_MATCHER_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[host] = result
+        return result
+
+
+class AddressVotes(object):
+
+    """
+    The WAN address votes, at most one per voter.
+
+    Besides the voters for each address, a reverse index from voter to address is kept.  For the connection type
+    estimate, the number of distinct voter hosts for each address and the number of addresses that are voted for from
+    more than one host are maintained incrementally.
+    """
+
+    def __init__(self):
+        # address:set(voter) pairs
+        self._votes = {}
+        # voter:address pairs
+        self._voter_votes = {}
+        # address:{host:count} pairs
+        self._hosts = {}
+        # number of addresses with votes from more than one host
+        self._multiple_host_addresses = 0
+
+    def __len__(self):
+        """
+        The number of distinct addresses that are voted for.
+        """
+        return len(self._votes)
+
+    def __contains__(self, address):
+        return address in self._votes
+
+    def get_vote(self, voter):
+        """
+        Returns the address that VOTER voted for, or None.
+        """
+        return self._voter_votes.get(voter)
+
+    def get_voters(self, address):
+        """
+        Returns the voters for ADDRESS.
+        """
+        return frozenset(self._votes.get(address, ()))
+
+    def count(self, address):
+        """
+        Returns the number of votes for ADDRESS.
+        """
+        voters = self._votes.get(address)
+        return len(voters) if voters else 0
+
+    @property
+    def has_multiple_host_address(self):
+        """
+        True when at least one address is voted for by voters on more than one host.
+
+        A symmetric NAT creates a new mapping for each destination host, hence all votes for one address come from a
+        single host.
+        """
+        return self._multiple_host_addresses > 0
+
+    def vote(self, address, voter):
+        """
+        Sets the vote of VOTER to ADDRESS and returns its previous vote, or None.
+        """
+        previous = self._voter_votes.get(voter)
+        if previous != address:
+            if previous is not None:
+                self._remove(previous, voter)
+            self._voter_votes[voter] = address
+            self._votes.setdefault(address, set()).add(voter)
+
+            hosts = self._hosts.setdefault(address, {})
+            host = voter[0]
+            hosts[host] = hosts.get(host, 0) + 1
+            if hosts[host] == 1 and len(hosts) == 2:
+                self._multiple_host_addresses += 1
+        return previous
+
+    def unvote(self, voter):
+        """
+        Removes the vote of VOTER and returns it, or None when VOTER did not vote.
+        """
+        address = self._voter_votes.pop(voter, None)
+        if address is not None:
+            self._remove(address, voter)
+        return address
+
+    def _remove(self, address, voter):
+        voters = self._votes[address]
+        voters.remove(voter)
+        if not voters:
+            del self._votes[address]
+
+        hosts = self._hosts[address]
+        host = voter[0]
+        hosts[host] -= 1
+        if not hosts[host]:
+            del hosts[host]
+            if len(hosts) == 1:
+                self._multiple_host_addresses -= 1
+            elif not hosts:
+                del self._hosts[address]
@@ -26,6 +26,8 @@ class Authentication(MetaObject):
         The implementation of an Authentication policy.
         """
 
+        __slots__ = ()
+
         __metaclass__ = ABCMeta
 
         @abstractproperty
@@ -69,6 +71,8 @@ class NoAuthentication(Authentication):
     """
     class Implementation(Authentication.Implementation):
 
+        __slots__ = ()
+
         @property
         def is_signed(self):
             return True
@@ -103,6 +107,8 @@ class MemberAuthentication(Authentication):
     """
     class Implementation(Authentication.Implementation):
 
+        __slots__ = ("_member", "_signature")
+
         def __init__(self, meta, member, signature=""):
             """
             Initialize a new MemberAuthentication.Implementation instance.
@@ -222,6 +228,8 @@ class DoubleMemberAuthentication(Authentication):
     """
     class Implementation(Authentication.Implementation):
 
+        __slots__ = ("_members", "_signatures")
+
         def __init__(self, meta, members, signatures=[]):
             """
             Initialize a new DoubleMemberAuthentication.Implementation instance.
@@ -296,3 +296,118 @@ class BloomFilter(object):
         hex_ = '%x' % self._filter
         padding = '0' * (self._m_size / 4 - len(hex_))
         return unhexlify(padding + hex_)[::-1]
+
+
+class MembershipFilter(object):
+
+    """
+    An in-memory Bloom filter over arbitrary hashable keys.
+
+    Unlike BloomFilter, a MembershipFilter is never sent to other peers.  The bits are stored in a bytearray, hence
+    adding a key does not copy the filter, and the bit positions are derived from the builtin hash using double
+    hashing.  This makes it suitable for large filters that are updated for every stored message.
+
+    A MembershipFilter is created for N_CAPACITY keys with approximately F_ERROR_RATE chance for false positives.  When
+    more keys are added the error rate increases, is_full tells when the filter should be rebuilt with a larger
+    capacity.
+    """
+
+    def __init__(self, n_capacity, f_error_rate=0.01):
+        assert isinstance(n_capacity, int), type(n_capacity)
+        assert 0 < n_capacity, n_capacity
+        assert isinstance(f_error_rate, float), type(f_error_rate)
+        assert 0.0 < f_error_rate < 1.0, f_error_rate
+        self._n_capacity = n_capacity
+        self._m_size = int(ceil(abs((n_capacity * log(f_error_rate)) / (log(2) ** 2)) / 8.0) * 8)
+        self._k_functions = BloomFilter._get_k_functions(self._m_size, n_capacity)
+        self._bits = bytearray(self._m_size / 8)
+        self._count = 0
+
+    @staticmethod
+    def _hash(key, m_size):
+        """
+        Returns the first bit position and the step between the bit positions for KEY.
+
+        The builtin hash of small integers and tuples thereof is far from uniform, hence it is mixed (using the
+        MurmurHash3 finalizer) before it is split into two 32 bit values.
+        """
+        h = hash(key) & 0xffffffffffffffff
+        h = ((h ^ (h >> 33)) * 0xff51afd7ed558ccd) & 0xffffffffffffffff
+        h = ((h ^ (h >> 33)) * 0xc4ceb9fe1a85ec53) & 0xffffffffffffffff
+        h ^= h >> 33
+        return (h & 0xffffffff) % m_size, (h >> 32) % m_size or 1
+
+    def add(self, key):
+        """
+        Add KEY to the MembershipFilter.
+        """
+        bits = self._bits
+        m_size = self._m_size
+        pos, step = self._hash(key, m_size)
+        for _ in xrange(self._k_functions):
+            bits[pos >> 3] |= 1 << (pos & 7)
+            pos = (pos + step) % m_size
+        self._count += 1
+
+    def add_keys(self, keys):
+        """
+        Add a sequence of KEYS to the MembershipFilter.
+        """
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        bits = self._bits
+        m_size = self._m_size
+        pos, step = self._hash(key, m_size)
+        for _ in xrange(self._k_functions):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+            pos = (pos + step) % m_size
+        return True
+
+    def clear(self):
+        """
+        Set all bits in the filter to zero.
+        """
+        self._bits = bytearray(self._m_size / 8)
+        self._count = 0
+
+    @property
+    def capacity(self):
+        """
+        The number of keys this filter was created for (n).
+        @rtype: int
+        """
+        return self._n_capacity
+
+    @property
+    def count(self):
+        """
+        The number of keys added since the filter was created or cleared.
+        @rtype: int
+        """
+        return self._count
+
+    @property
+    def is_full(self):
+        """
+        True when more keys have been added than the filter was created for.
+        @rtype: bool
+        """
+        return self._count > self._n_capacity
+
+    @property
+    def size(self):
+        """
+        The size of the filter in bits (m).
+        @rtype: int
+        """
+        return self._m_size
+
+    @property
+    def functions(self):
+        """
+        The number of bit positions used for each key (k).
+        """
+        return self._k_functions
@@ -26,11 +26,15 @@ assert isinstance(CANDIDATE_LIFETIME, float)
 
 class Candidate(object):
 
+    # the walker keeps thousands of candidates, hence no per instance __dict__ and logger
+    __slots__ = ("_sock_addr", "_tunnel", "_association")
+
+    _logger = logging.getLogger("Candidate")
+
     def __init__(self, sock_addr, tunnel):
         assert self.is_valid_address(sock_addr), sock_addr
         assert isinstance(tunnel, bool), type(tunnel)
         super(Candidate, self).__init__()
-        self._logger = logging.getLogger(self.__class__.__name__)
 
         self._sock_addr = sock_addr
         self._tunnel = tunnel
@@ -122,6 +126,12 @@ class WalkCandidate(Candidate):
       after the introduction-response message (talking about the candidate) was received.
     """
 
+    __slots__ = ("_lan_address", "_wan_address", "_connection_type", "_last_walk_reply", "_last_walk", "_last_stumble",
+                 "_last_intro", "_last_discovered", "_keep_alive_community", "_previous_property", "_on_life_support",
+                 "_global_time")
+
+    _logger = logging.getLogger("WalkCandidate")
+
     def __init__(self, sock_addr, tunnel, lan_address, wan_address, connection_type):
         assert is_valid_address(sock_addr), sock_addr
         assert isinstance(tunnel, bool), type(tunnel)
@@ -356,6 +366,7 @@ class WalkCandidate(Candidate):
 
 
 class LoopbackCandidate(Candidate):
+    __slots__ = ()
     __loopback_sock_addr = ("localhost", 0)
 
     def __init__(self):
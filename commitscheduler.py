@@ -0,0 +1,113 @@
+"""
+Coalesces database commits.
+
+Messages received from others do not need to be on disk before they are forwarded: after a crash they will be
+obtained again.  Instead of committing after every batch, or only once a minute, Dispersy.store_update_forward reports
+the number of stored rows to the CommitScheduler.  The scheduler commits once the oldest uncommitted row is
+COMMIT_MAX_LATENCY seconds old or COMMIT_MAX_PENDING rows are waiting, whichever comes first, hence many batches, from
+any number of communities, share a single commit.
+
+Messages created by my_member are committed immediately, using CommitScheduler.commit, before they are forwarded.  This
+commit includes every row that was waiting.
+
+A commit that fails, e.g. because the database is locked, is retried after COMMIT_RETRY_DELAY seconds.
+"""
+import logging
+import os
+from sqlite3 import OperationalError
+from time import time
+
+from .taskmanager import TaskManager
+
+# maximum number of seconds between storing a row and committing it
+COMMIT_MAX_LATENCY = 0.05
+# commit as soon as this many rows are waiting
+COMMIT_MAX_PENDING = 1000
+# number of seconds before a failed commit is retried
+COMMIT_RETRY_DELAY = 0.5
+
+
+class CommitScheduler(TaskManager):
+
+    def __init__(self, database, max_latency=COMMIT_MAX_LATENCY, max_pending=COMMIT_MAX_PENDING):
+        assert isinstance(max_latency, float), type(max_latency)
+        assert max_latency >= 0.0, max_latency
+        assert isinstance(max_pending, int), type(max_pending)
+        assert max_pending > 0, max_pending
+        super(CommitScheduler, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._database = database
+        self._max_latency = max_latency
+        self._max_pending = max_pending
+        # number of rows stored since the last commit
+        self._pending = 0
+
+        self.commit_count = 0
+        self.commit_failures = 0
+        self.commit_rows = 0
+        self.commit_duration = 0.0
+        self.commit_duration_max = 0.0
+        # size of the write-ahead log, in bytes, after the last commit
+        self.wal_size = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def commit_duration_average(self):
+        return self.commit_duration / self.commit_count if self.commit_count else 0.0
+
+    def add(self, count=1):
+        """
+        Reports that COUNT rows were stored and must be committed eventually.
+        """
+        assert isinstance(count, int), type(count)
+        assert count > 0, count
+        self._pending += count
+        if self._pending >= self._max_pending:
+            self.commit()
+
+        elif not self.is_pending_task_active("commit"):
+            self.register_task("commit", self._reactor.callLater(self._max_latency, self.commit))
+
+    def commit(self):
+        """
+        Commits the database now.
+
+        Returns False when the commit is postponed because it is called within a 'with database' block, the commit is
+        performed when that block is left.  Also returns False when the commit failed, it is retried after
+        COMMIT_RETRY_DELAY seconds.
+        """
+        self.cancel_pending_task("commit")
+        rows, self._pending = self._pending, 0
+
+        start = time()
+        try:
+            result = self._database.commit()
+        except OperationalError as exception:
+            # OperationalError: database is locked
+            self._logger.warning("unable to commit %d rows, retry in %.1fs: %s", rows, COMMIT_RETRY_DELAY, exception)
+            self._pending += rows
+            self.commit_failures += 1
+            self.register_task("commit", self._reactor.callLater(COMMIT_RETRY_DELAY, self.commit))
+            return False
+        duration = time() - start
+        if result is False:
+            return False
+
+        self.commit_count += 1
+        self.commit_rows += rows
+        self.commit_duration += duration
+        self.commit_duration_max = max(self.commit_duration_max, duration)
+        self.wal_size = self._get_wal_size()
+        self._logger.debug("committed %d rows in %.4fs", rows, duration)
+        return True
+
+    def _get_wal_size(self):
+        if self._database.file_path == u":memory:":
+            return 0
+        try:
+            return os.path.getsize(self._database.file_path + u"-wal")
+        except OSError:
+            return 0
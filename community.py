@@ -21,12 +21,12 @@ from twisted.internet.task import LoopingCall, deferLater
 from twisted.python.threadable import isInIOThread
 
 from .authentication import NoAuthentication, MemberAuthentication, DoubleMemberAuthentication
-from .bloomfilter import BloomFilter
+from .bloomfilter import BloomFilter, MembershipFilter
 from .candidate import Candidate, WalkCandidate
 from .conversion import BinaryConversion, DefaultConversion, Conversion
 from .destination import CommunityDestination, CandidateDestination, NHopCommunityDestination
 from .distribution import (SyncDistribution, GlobalTimePruning, LastSyncDistribution, DirectDistribution,
-                           FullSyncDistribution)
+                           FullSyncDistribution, SyncHistoryCache)
 from .exception import ConversionNotFoundException, MetaNotFoundException
 from .member import DummyMember, Member
 from .message import (BatchConfiguration, Message, Packet, DropMessage, DelayMessageByProof,
@@ -38,7 +38,7 @@ from .payload import (AuthorizePayload, RevokePayload, UndoPayload, DestroyCommu
 from .requestcache import RequestCache, SignatureRequestCache, IntroductionRequestCache
 from .resolution import PublicResolution, LinearResolution, DynamicResolution
 from .statistics import CommunityStatistics
-from .taskmanager import TaskManager
+from .taskmanager import TaskManager, CoalescedLoopingCall
 from .timeline import Timeline
 from .util import runtime_duration_warning, attach_runtime_statistics, deprecated, is_valid_address
 
@@ -49,6 +49,12 @@ FAST_WALKER_MAX_NEW_ELIGIBLE_CANDIDATES = 10
 FAST_WALKER_STEPS = 15
 FAST_WALKER_STEP_INTERVAL = 2.0
 PERIODIC_CLEANUP_INTERVAL = 5.0
+STORED_FILTER_MIN_CAPACITY = 1024
+# the number of sync rows that the purge of a hard-killed community visits per reactor iteration
+PURGE_CHUNK_SIZE = 1000
+# stored messages are looked up with at most this many keys per query.  a (member, global time) key uses three of the
+# 999 host parameters that SQLite allows
+SYNC_LOOKUP_CHUNK_SIZE = 300
 TAKE_STEP_INTERVAL = 5
 
 logger = logging.getLogger(__name__)
@@ -178,11 +184,12 @@ class Community(TaskManager):
         assert isInIOThread()
         logger.debug("retrieving all master members owning %s communities", cls.get_classification())
         execute = dispersy.database.execute
-        return [dispersy.get_member(public_key=str(public_key)) if public_key else dispersy.get_member(mid=str(mid))
-                for mid, public_key,
-                in list(execute(u"SELECT m.mid, m.public_key FROM community AS c JOIN member AS m ON m.id = c.master"
-                                u" WHERE c.classification = ?",
-                                (cls.get_classification(),)))]
+        get_by_id = dispersy.member_storage.get_by_id
+        rows = filter(None, [get_by_id(master_id) for master_id,
+                             in list(execute(u"SELECT master FROM community WHERE classification = ?",
+                                             (cls.get_classification(),)))])
+        return [dispersy.get_member(public_key=public_key) if public_key else dispersy.get_member(mid=mid)
+                for mid, public_key, _ in rows]
 
     @classmethod
     def init_community(cls, dispersy, master, my_member, *args, **kargs):
@@ -301,6 +308,8 @@ class Community(TaskManager):
         self._walk_candidates = None
         self._fast_steps_taken = 0
         self._sync_cache = None
+        self._stored_filter = None
+        self._sync_history = SyncHistoryCache(self)
 
     def initialize(self):
         assert isInIOThread()
@@ -311,7 +320,7 @@ class Community(TaskManager):
         # Do not immediately call the periodic cleanup LC to avoid an infinite recursion problem: init_community ->
         # initialize -> invoke_func -> _get_latest_channel_message -> convert_packet_to_message -> get_community ->
         # init_community
-        self.register_task("periodic cleanup", LoopingCall(self._periodically_clean_delayed)).start(PERIODIC_CLEANUP_INTERVAL, now=False)
+        self.register_task("periodic cleanup", CoalescedLoopingCall(self._periodically_clean_delayed)).start(PERIODIC_CLEANUP_INTERVAL, now=False)
 
         try:
             self._database_id, my_member_did, self._database_version = self._dispersy.database.execute(
@@ -442,6 +451,7 @@ class Community(TaskManager):
 
         # check/sanity check the database
         self.dispersy_check_database()
+        self._resume_purge()
         from sys import argv
         if "--sanity-check" in argv:
             try:
@@ -480,14 +490,12 @@ class Community(TaskManager):
         assert not self._master_member.public_key
         self._logger.debug("using dummy master member")
 
-        try:
-            public_key, = self._dispersy.database.execute(u"SELECT public_key FROM member WHERE id = ?", (self._master_member.database_id,)).next()
-        except StopIteration:
-            pass
-        else:
+        row = self._dispersy.member_storage.get_by_id(self._master_member.database_id)
+        if row:
+            _, public_key, _ = row
             if public_key:
                 self._logger.debug("%s found master member", self._cid.encode("HEX"))
-                self._master_member = self._dispersy.get_member(public_key=str(public_key))
+                self._master_member = self._dispersy.get_member(public_key=public_key)
                 assert self._master_member.public_key
                 self.cancel_pending_task("download master member identity")
             else:
@@ -523,7 +531,7 @@ class Community(TaskManager):
                 self._logger.warning("unable to load permissions from database [could not obtain %s]", name)
 
         if mapping:
-            for packet, in list(self._dispersy.database.execute(u"SELECT packet FROM sync WHERE meta_message IN (" + ", ".join("?" for _ in mapping) + ") ORDER BY global_time, packet",
+            for packet, in list(self._dispersy.database.execute(u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message IN (" + ", ".join("?" for _ in mapping) + ") ORDER BY global_time, packet",
                                                                 mapping.keys())):
                 message = self._dispersy.convert_packet_to_message(str(packet), self, verify=False)
                 if message:
@@ -880,10 +888,10 @@ class Community(TaskManager):
     def _select_and_fix(self, request_cache, syncable_messages, global_time, to_select, higher=True):
         assert isinstance(syncable_messages, unicode)
         if higher:
-            data = list(self._dispersy.database.execute(u"SELECT global_time, packet FROM sync WHERE meta_message IN (%s) AND undone = 0 AND global_time > ? ORDER BY global_time ASC LIMIT ?" % (syncable_messages),
+            data = list(self._dispersy.database.execute(u"SELECT global_time, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message IN (%s) AND undone = 0 AND global_time > ? ORDER BY global_time ASC LIMIT ?" % (syncable_messages),
                        (global_time, to_select + 1)))
         else:
-            data = list(self._dispersy.database.execute(u"SELECT global_time, packet FROM sync WHERE meta_message IN (%s) AND undone = 0 AND global_time < ? ORDER BY global_time DESC LIMIT ?" % (syncable_messages),
+            data = list(self._dispersy.database.execute(u"SELECT global_time, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message IN (%s) AND undone = 0 AND global_time < ? ORDER BY global_time DESC LIMIT ?" % (syncable_messages),
                        (global_time, to_select + 1)))
 
         fixed = False
@@ -914,11 +922,11 @@ class Community(TaskManager):
             modulo = int(ceil(self._nrsyncpackets / float(capacity)))
             if modulo > 1:
                 offset = randint(0, modulo - 1)
-                packets = list(str(packet) for packet, in self._dispersy.database.execute(u"SELECT sync.packet FROM sync WHERE meta_message IN (%s) AND sync.undone = 0 AND (sync.global_time + ?) %% ? = 0" % syncable_messages, (offset, modulo)))
+                packets = list(str(packet) for packet, in self._dispersy.database.execute(u"SELECT sync_packet.packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message IN (%s) AND sync.undone = 0 AND (sync.global_time + ?) %% ? = 0" % syncable_messages, (offset, modulo)))
             else:
                 offset = 0
                 modulo = 1
-                packets = list(str(packet) for packet, in self._dispersy.database.execute(u"SELECT sync.packet FROM sync WHERE meta_message IN (%s) AND sync.undone = 0" % syncable_messages))
+                packets = list(str(packet) for packet, in self._dispersy.database.execute(u"SELECT sync_packet.packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message IN (%s) AND sync.undone = 0" % syncable_messages))
 
             bloom.add_keys(packets)
 
@@ -947,6 +955,15 @@ class Community(TaskManager):
         """
         return 10 * 1024
 
+    @property
+    def dispersy_missing_response_limit(self):
+        """
+        The maximum number of bytes to send back per candidate for a batch of dispersy-missing-message,
+        dispersy-missing-identity, or dispersy-missing-proof messages.
+        @rtype: int
+        """
+        return 10 * 1024
+
     @property
     def dispersy_acceptable_global_time_range(self):
         return 10000
@@ -1063,6 +1080,7 @@ class Community(TaskManager):
 
         self.purge_batch_cache()
 
+        self.stop_walking()
         self.cancel_all_pending_tasks()
 
         self._request_cache.clear()
@@ -1084,6 +1102,46 @@ class Community(TaskManager):
         self._logger.debug("claiming a new global time value @%d", self._global_time)
         return self._global_time
 
+    @property
+    def stored_filter(self):
+        """
+        An approximate membership filter with the (member, global_time) of every message in the sync table of this
+        community.
+
+        A key that is not in the filter is certainly not stored, allowing the duplicate checks to skip the database
+        for new messages.  The filter is built from the database when it is first needed and kept up to date by
+        update_stored_filter.
+        @rtype: MembershipFilter
+        """
+        if self._stored_filter is None:
+            keys = list(self._dispersy.database.execute(u"SELECT member, global_time FROM sync WHERE community = ?",
+                                                        (self.database_id,)))
+            self._stored_filter = MembershipFilter(max(STORED_FILTER_MIN_CAPACITY, 2 * len(keys)))
+            self._stored_filter.add_keys(keys)
+            self._logger.debug("stored filter: %d keys; capacity: %d", len(keys), self._stored_filter.capacity)
+        return self._stored_filter
+
+    def update_stored_filter(self, keys):
+        """
+        Add the (member, global_time) KEYS of newly stored messages to the stored filter.
+
+        Once the filter holds more keys than it was created for it is discarded, the next use rebuilds it from the
+        database with a larger capacity.
+        """
+        if self._stored_filter is not None:
+            self._stored_filter.add_keys(keys)
+            if self._stored_filter.is_full:
+                self._stored_filter = None
+
+    @property
+    def sync_history(self):
+        """
+        The cached highest sequence number, highest global time, and global time history for each (member, meta
+        message) in the sync table of this community.
+        @rtype: SyncHistoryCache
+        """
+        return self._sync_history
+
     def update_global_time(self, global_time):
         """
         Increase the local global time if the given GLOBAL_TIME is larger.
@@ -1096,9 +1154,10 @@ class Community(TaskManager):
                 # Check for messages that need to be pruned because the global time changed.
                 for meta in self._meta_messages.itervalues():
                     if isinstance(meta.distribution, SyncDistribution) and isinstance(meta.distribution.pruning, GlobalTimePruning):
-                         self._dispersy.database.execute(
-                            u"DELETE FROM sync WHERE meta_message = ? AND global_time <= ?",
-                            (meta.database_id, self._global_time - meta.distribution.pruning.prune_threshold))
+                        if self._dispersy.database.execute(
+                                u"DELETE FROM sync WHERE meta_message = ? AND global_time <= ?",
+                                (meta.database_id, self._global_time - meta.distribution.pruning.prune_threshold)).rowcount:
+                            self._sync_history.invalidate(meta=meta)
 
     def dispersy_check_database(self):
         """
@@ -1169,10 +1228,9 @@ class Community(TaskManager):
 
         def switch_to_normal_walking():
             """
-            Start walking towards eligible candidates regularly, stopping the fast walker if it's still running.
+            Start walking towards eligible candidates regularly, replacing the fast walker if it's still running.
             """
-            self.cancel_pending_task("take fast steps")
-            self.register_task("take step", LoopingCall(self.take_step)).start(TAKE_STEP_INTERVAL, now=True)
+            self._dispersy.walker_scheduler.schedule(self, self.take_step, TAKE_STEP_INTERVAL)
 
         def take_fast_steps():
             """
@@ -1205,12 +1263,25 @@ class Community(TaskManager):
 
         if self.dispersy_enable_fast_candidate_walker:
             self._fast_steps_taken = 0
-            self.register_task("take fast steps",
-                               LoopingCall(take_fast_steps)
-            ).start(FAST_WALKER_STEP_INTERVAL, now=True)
+            self._dispersy.walker_scheduler.schedule(self, take_fast_steps, FAST_WALKER_STEP_INTERVAL)
         else:
             switch_to_normal_walking()
 
+    def stop_walking(self):
+        """
+        Stop taking walk steps, start_walking resumes them.
+        """
+        self._dispersy.walker_scheduler.unschedule(self)
+
+    def get_walk_priority(self):
+        """
+        Returns the priority of the next walk step of this community, lower values are walked first.
+
+        The WalkerScheduler only uses this when more communities want to take a step than its budget allows.  By default
+        communities that know fewer candidates walk first.
+        """
+        return len(self._candidates)
+
     def take_step(self):
         now = time()
         self._logger.debug("previous sync was %.1f seconds ago",
@@ -2215,7 +2286,7 @@ class Community(TaskManager):
             self._statistics.increase_msg_count(u"success", meta.name, len(messages))
 
             if meta.name == u"dispersy-introduction-response":
-                self._statistics.msg_statistics.walk_success_count += len(messages)
+                self._statistics.msg_statistics.get_counter(u"walk_success").increment(len(messages))
                 self._dispersy._statistics.walk_success_count += len(messages)
 
             elif meta.name == u"dispersy-introduction-request":
@@ -2813,21 +2884,21 @@ class Community(TaskManager):
             if direction == u"ASC":
                 return u"""
  SELECT * FROM
-  (SELECT sync.packet FROM sync    -- """ + meta.name + """
+  (SELECT sync_packet.packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id    -- """ + meta.name + """
    WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
    ORDER BY sync.global_time ASC)"""
 
             if direction == u"DESC":
                 return u"""
  SELECT * FROM
-  (SELECT sync.packet FROM sync    -- """ + meta.name + """
+  (SELECT sync_packet.packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id    -- """ + meta.name + """
    WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
    ORDER BY sync.global_time DESC)"""
 
             if direction == u"RANDOM":
                 return u"""
  SELECT * FROM
-  (SELECT sync.packet FROM sync    -- """ + meta.name + """
+  (SELECT sync_packet.packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id    -- """ + meta.name + """
    WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
    ORDER BY RANDOM())"""
 
@@ -2943,24 +3014,74 @@ class Community(TaskManager):
         self._dispersy._forward([request])
 
     def on_missing_message(self, messages):
-        for message in messages:
+        keys = set((message.payload.member.database_id, global_time)
+                   for message in messages
+                   for global_time in message.payload.global_times)
+        stored = self._get_stored_messages(keys)
 
-            responses = []
-            candidate = message.candidate
+        responses = OrderedDict()
+        for message in messages:
             member_database_id = message.payload.member.database_id
-            for global_time in message.payload.global_times:
-                try:
-                    packet, = self._dispersy._database.execute(u"SELECT packet FROM sync WHERE community = ? AND member = ? AND global_time = ?",
-                                                              (self.database_id, member_database_id, global_time)).next()
-                    responses.append(str(packet))
-                except StopIteration:
-                    pass
+            found = [stored[(member_database_id, global_time)][2]
+                     for global_time in message.payload.global_times
+                     if (member_database_id, global_time) in stored]
 
-            if responses:
-                self._dispersy._send_packets([candidate], responses, self, "-caused by missing-message-")
+            if found:
+                responses.setdefault(message.candidate, []).extend(found)
             else:
                 self._logger.warning('could not find missing messages for candidate %s, global_times %s',
-                                     candidate, message.payload.global_times)
+                                     message.candidate, message.payload.global_times)
+
+        self._send_missing_responses(responses, "-caused by missing-message-")
+
+    def _get_stored_messages(self, keys):
+        """
+        Returns a dictionary with (member database id, global time):(packet id, meta message database id, packet,
+        undone) pairs for the stored messages at KEYS.
+
+        KEYS contains (member database id, global time) tuples.  Only these exact pairs are queried, using the
+        UNIQUE(community, member, global_time) index, with one query per SYNC_LOOKUP_CHUNK_SIZE keys.
+        """
+        keys = sorted(keys)
+        execute = self._dispersy._database.execute
+        stored = {}
+        for index in xrange(0, len(keys), SYNC_LOOKUP_CHUNK_SIZE):
+            chunk = keys[index:index + SYNC_LOOKUP_CHUNK_SIZE]
+            parameters = []
+            for member_id, global_time in chunk:
+                parameters.extend((self.database_id, member_id, global_time))
+
+            for member_id, global_time, packet_id, meta_id, packet, undone in execute(
+                    u"SELECT member, global_time, id, meta_message, packet, undone "
+                    u"FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE " +
+                    u" OR ".join([u"(community = ? AND member = ? AND global_time = ?)"] * len(chunk)), parameters):
+                stored[(member_id, global_time)] = (packet_id, meta_id, str(packet), undone)
+        return stored
+
+    def _send_missing_responses(self, responses, description):
+        """
+        Sends the packets in RESPONSES, a candidate:[packet] dictionary, to each candidate.
+
+        A packet is sent at most once per candidate and no more packets are sent to a candidate once
+        dispersy_missing_response_limit bytes were sent to it.
+        """
+        for candidate, packets in responses.iteritems():
+            assert isinstance(candidate, Candidate), type(candidate)
+            byte_limit = self.dispersy_missing_response_limit
+            unique = set()
+            selected = []
+            for packet in packets:
+                if packet not in unique:
+                    unique.add(packet)
+                    selected.append(packet)
+
+                    byte_limit -= len(packet)
+                    if byte_limit <= 0:
+                        self._logger.debug("Bandwidth throttle.  %d of %d packets for %s", len(selected),
+                                           len(packets), candidate)
+                        break
+
+            self._dispersy._send_packets([candidate], selected, self, description)
 
     def create_identity(self, sign_with_master=False, store=True, update=True):
         """
@@ -3029,20 +3150,27 @@ class Community(TaskManager):
         @type messages: [Message.Implementation]
         """
         meta_id = self.get_meta_message(u"dispersy-identity").database_id
-        sql_member = u"SELECT id FROM member WHERE mid = ? LIMIT 10"
-        sql_packet = u"SELECT packet FROM sync WHERE community = ? AND member = ? AND meta_message = ? LIMIT 1"
-
+        rows = self._dispersy.member_storage.get_many(set(message.payload.mid for message in messages))
+
+        member_ids = sorted(set(row[0] for row in rows.itervalues()))
+        identities = {}
+        for index in xrange(0, len(member_ids), SYNC_LOOKUP_CHUNK_SIZE):
+            chunk = member_ids[index:index + SYNC_LOOKUP_CHUNK_SIZE]
+            for member_id, packet in self._dispersy._database.execute(
+                    u"SELECT member, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id "
+                    u"WHERE community = ? AND meta_message = ? AND member IN (%s)" %
+                    ", ".join("?" * len(chunk)),
+                    [self.database_id, meta_id] + chunk):
+                identities.setdefault(member_id, str(packet))
+
+        responses = OrderedDict()
         for message in messages:
             mid = message.payload.mid
-
-            # we are assuming that no more than 10 members have the same sha1 digest.
-            for member_id in [member_id for member_id, in self._dispersy._database.execute(sql_member, (buffer(mid),))]:
-                packets = [str(packet) for packet, in self._dispersy._database.execute(sql_packet,
-                                                                                       (self.database_id, member_id, meta_id))]
-
-                if packets:
-                    self._logger.debug("responding with %d identity messages", len(packets))
-                    self._dispersy._send_packets([message.candidate], packets, self, "-caused by missing-identity-")
+            row = rows.get(mid)
+            if row:
+                packet = identities.get(row[0])
+                if packet:
+                    responses.setdefault(message.candidate, []).append(packet)
 
                 else:
                     assert not message.payload.mid == self.my_member.mid, "we should always have our own dispersy-identity"
@@ -3050,6 +3178,9 @@ class Community(TaskManager):
                                          " no response is sent [%s, mid:%s, cid:%s]",
                                          mid.encode("HEX"), self.my_member.mid.encode("HEX"), self.cid.encode("HEX"))
 
+        self._logger.debug("responding with %d identity messages", sum(len(packets) for packets in responses.itervalues()))
+        self._send_missing_responses(responses, "-caused by missing-identity-")
+
     def create_missing_sequence(self, candidate, member, message, missing_low, missing_high):
         meta = self.get_meta_message(u"dispersy-missing-sequence")
         request = meta.impl(distribution=(self.global_time,), destination=(candidate,), payload=(member, message, missing_low, missing_high))
@@ -3107,7 +3238,7 @@ class Community(TaskManager):
                                    member_id, message_id, candidate)
                 for range_min, range_max in merge_ranges(sequences):
                     for packet, in self._dispersy._database.execute(
-                            u"SELECT packet FROM sync "
+                            u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id "
                             u"WHERE member = ? AND meta_message = ? AND sequence BETWEEN ? AND ? "
                             u"ORDER BY sequence",
                             (member_id, message_id, range_min, range_max)):
@@ -3153,25 +3284,32 @@ class Community(TaskManager):
         self._dispersy._forward([request])
 
     def on_missing_proof(self, messages):
-        for message in messages:
-            try:
-                packet, = self._dispersy._database.execute(u"SELECT packet FROM sync WHERE community = ? AND member = ? AND global_time = ? LIMIT 1",
-                                                          (self.database_id, message.payload.member.database_id, message.payload.global_time)).next()
+        stored = self._get_stored_messages(set((message.payload.member.database_id, message.payload.global_time)
+                                               for message in messages))
 
-            except StopIteration:
+        # (member database id, global time):(allowed, proofs) pairs, each message is checked only once per batch
+        checked = {}
+        responses = OrderedDict()
+        for message in messages:
+            key = (message.payload.member.database_id, message.payload.global_time)
+            if key not in stored:
                 self._logger.warning("someone asked for proof for a message that we do not have")
+                continue
+
+            if key not in checked:
+                msg = self._dispersy.convert_packet_to_message(stored[key][2], self, verify=False)
+                checked[key] = self.timeline.check(msg)
+            allowed, proofs = checked[key]
+
+            if allowed and proofs:
+                self._logger.debug("we found %d packets containing proof for %s", len(proofs), message.candidate)
+                responses.setdefault(message.candidate, []).extend(proof.packet for proof in proofs)
 
             else:
-                packet = str(packet)
-                msg = self._dispersy.convert_packet_to_message(packet, self, verify=False)
-                allowed, proofs = self.timeline.check(msg)
-                if allowed and proofs:
-                    self._logger.debug("we found %d packets containing proof for %s", len(proofs), message.candidate)
-                    self._dispersy._send_packets([message.candidate], [proof.packet for proof in proofs], self, "-caused by missing-proof-")
+                self._logger.debug("unable to give %s missing proof.  allowed:%s.  proofs:%d packets",
+                                   message.candidate, allowed, len(proofs))
 
-                else:
-                    self._logger.debug("unable to give %s missing proof.  allowed:%s.  proofs:%d packets",
-                                       message.candidate, allowed, len(proofs))
+        self._send_missing_responses(responses, "-caused by missing-proof-")
 
     def create_authorize(self, permission_triplets, sign_with_master=False, store=True, update=True, forward=True):
         """
@@ -3372,15 +3510,11 @@ class Community(TaskManager):
                 # already undone.  refuse to undo again but return the previous undo message
                 self._logger.error("you are attempting to undo the same message twice. "
                                    "trying to return the previous undo message")
-                undo_own_meta = self.get_meta_message(u"dispersy-undo-own")
-                undo_other_meta = self.get_meta_message(u"dispersy-undo-other")
-                for packet_id, message_id, packet in self._dispersy._database.execute(
-                        u"SELECT id, meta_message, packet FROM sync WHERE community = ? AND member = ? AND meta_message IN (?, ?)",
-                        (self.database_id, message.authentication.member.database_id, undo_own_meta.database_id, undo_other_meta.database_id)):
-                    self._logger.debug("checking: %s", message_id)
-                    msg = Packet(undo_own_meta if undo_own_meta.database_id == message_id else undo_other_meta, str(packet), packet_id).load_message()
-                    if message.distribution.global_time == msg.payload.global_time:
-                        return msg
+                msg = self._get_undo_message(undone, message.authentication.member, message.distribution.global_time,
+                                             [self.get_meta_message(u"dispersy-undo-own"),
+                                              self.get_meta_message(u"dispersy-undo-other")])
+                if msg:
+                    return msg
 
                 # TODO(emilon): Review this statement
                 # Could not find the undo message that caused the sync.undone to be True.  The undone was probably
@@ -3412,20 +3546,23 @@ class Community(TaskManager):
         assert all(message.name in (u"dispersy-undo-own", u"dispersy-undo-other") for message in messages)
 
         dependencies = {}
+        targets = self._get_stored_messages(set((message.payload.member.database_id, message.payload.global_time)
+                                                for message in messages))
+        metas = dict((meta.database_id, meta) for meta in self.get_meta_messages())
 
         for message in messages:
+            target = targets.get((message.payload.member.database_id, message.payload.global_time))
+
             if message.payload.packet is None:
                 # obtain the packet that we are attempting to undo
-                try:
-                    packet_id, message_name, packet_data = self._dispersy._database.execute(u"SELECT sync.id, meta_message.name, sync.packet FROM sync JOIN meta_message ON meta_message.id = sync.meta_message WHERE sync.community = ? AND sync.member = ? AND sync.global_time = ?",
-                                                                                           (self.database_id, message.payload.member.database_id, message.payload.global_time)).next()
-                except StopIteration:
+                if target is None:
                     delay = DelayMessageByMissingMessage(message, message.payload.member, message.payload.global_time)
                     dependencies[message.authentication.member.public_key] = (message.distribution.sequence_number, delay)
                     yield delay
                     continue
 
-                message.payload.packet = Packet(self.get_meta_message(message_name), str(packet_data), packet_id)
+                packet_id, meta_id, packet_data, _ = target
+                message.payload.packet = Packet(metas[meta_id], packet_data, packet_id)
 
             # ensure that the message in the payload allows undo
             if not message.payload.packet.meta.undo_callback:
@@ -3453,47 +3590,38 @@ class Community(TaskManager):
                 yield consequence.duplicate(message)
                 continue
 
-            try:
-                undone, = self._dispersy._database.execute(u"SELECT undone FROM sync WHERE id = ?", (message.payload.packet.packet_id,)).next()
-            except StopIteration:
-                assert False, "The conversion ensures that the packet exists in the DB.  Hence this should never occur"
-                undone = 0
+            assert target, "The conversion ensures that the packet exists in the DB.  Hence this should never occur"
+            undone = target[3] if target else 0
 
             if undone and message.name == u"dispersy-undo-own":
                 # look for other packets we received that undid this packet
                 member = message.authentication.member
-                undo_own_meta = self.get_meta_message(u"dispersy-undo-own")
-                for packet_id, packet in self._dispersy._database.execute(
-                        u"SELECT id, packet FROM sync WHERE community = ? AND member = ? AND meta_message = ?",
-                        (self.database_id, member.database_id, undo_own_meta.database_id)):
-
-                    db_msg = Packet(undo_own_meta, str(packet), packet_id).load_message()
-                    if message.payload.global_time == db_msg.payload.global_time:
-                        # we've found another packet which undid this packet
-                        if member == self.my_member:
-                            self._logger.exception("We created a duplicate undo-own message")
-                        else:
-                            self._logger.warning("Someone else created a duplicate undo-own message")
-
-                        # Reply to this peer with a higher (or equally) ranked message in case we have one
-                        if db_msg.packet <= message.packet:
-                            message.payload.process_undo = False
-                            yield message
-                            # the sender apparently does not have the lower dispersy-undo message, lets give it back
-                            self._dispersy._send_packets([message.candidate], [db_msg.packet], self, db_msg.name)
-
-                            yield DispersyDuplicatedUndo(db_msg, message)
-                            break
-                        else:
-                            # The new message is binary lower. As we cannot delete the old one, what we do
-                            # instead, is we store both and mark the message we already have as undone by the new one.
-                            # To accomplish this, we yield a DispersyDuplicatedUndo so on_undo() can mark the other
-                            # message as undone by the newly reveived message.
-                            yield message
-                            yield DispersyDuplicatedUndo(message, db_msg)
-                            break
+                db_msg = self._get_undo_message(undone, member, message.payload.global_time,
+                                                [self.get_meta_message(u"dispersy-undo-own")])
+                if db_msg:
+                    # we've found another packet which undid this packet
+                    if member == self.my_member:
+                        self._logger.exception("We created a duplicate undo-own message")
+                    else:
+                        self._logger.warning("Someone else created a duplicate undo-own message")
+
+                    # Reply to this peer with a higher (or equally) ranked message in case we have one
+                    if db_msg.packet <= message.packet:
+                        message.payload.process_undo = False
+                        yield message
+                        # the sender apparently does not have the lower dispersy-undo message, lets give it back
+                        self._dispersy._send_packets([message.candidate], [db_msg.packet], self, db_msg.name)
+
+                        yield DispersyDuplicatedUndo(db_msg, message)
+                    else:
+                        # The new message is binary lower. As we cannot delete the old one, what we do
+                        # instead, is we store both and mark the message we already have as undone by the new one.
+                        # To accomplish this, we yield a DispersyDuplicatedUndo so on_undo() can mark the other
+                        # message as undone by the newly reveived message.
+                        yield message
+                        yield DispersyDuplicatedUndo(message, db_msg)
                 else:
-                    # did not break, hence, the message hasn't been undone more than once.
+                    # the message hasn't been undone more than once.
                     yield message
 
                 # continue.  either the message was malicious or it has already been yielded
@@ -3501,6 +3629,33 @@ class Community(TaskManager):
 
             yield message
 
+    def _get_undo_message(self, undone, member, global_time, metas):
+        """
+        Returns the stored undo message, created by MEMBER using one of METAS, that undid the message at GLOBAL_TIME.
+
+        UNDONE is the sync.undone value of the undone message.  on_undo sets it to the packet id of the undo message,
+        hence only that packet is decoded.  All undo messages by MEMBER are decoded only when UNDONE does not refer to
+        a matching undo message, i.e. when the message was undone by a timeline change.
+        """
+        metas = dict((meta.database_id, meta) for meta in metas)
+        execute = self._dispersy._database.execute
+
+        row = execute(u"SELECT id, member, meta_message, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE id = ?", (undone,)).fetchone()
+        if row:
+            packet_id, member_id, meta_id, packet = row
+            if member_id == member.database_id and meta_id in metas:
+                msg = Packet(metas[meta_id], str(packet), packet_id).load_message()
+                if msg.payload.global_time == global_time:
+                    return msg
+
+        for packet_id, meta_id, packet in execute(
+                u"SELECT id, meta_message, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id "
+                u"WHERE community = ? AND member = ? AND meta_message IN (%s)" %
+                ", ".join("?" * len(metas)), [self.database_id, member.database_id] + metas.keys()):
+            msg = Packet(metas[meta_id], str(packet), packet_id).load_message()
+            if msg.payload.global_time == global_time:
+                return msg
+
     def on_undo(self, messages):
         """
         Undo a single message.
@@ -3617,15 +3772,66 @@ class Community(TaskManager):
                         _, proofs = self._timeline.check(item)
                         todo.extend(proofs)
 
-                # 1. cleanup the double_signed_sync table.
-                self._dispersy._database.execute(u"DELETE FROM double_signed_sync WHERE sync IN (SELECT id FROM sync JOIN double_signed_sync ON sync.id = double_signed_sync.sync WHERE sync.community = ?)", (self.database_id,))
-
-                # 2. cleanup sync table.  everything except what we need to tell others this
-                # community is no longer available
-                self._dispersy._database.execute(u"DELETE FROM sync WHERE community = ? AND id NOT IN (" + u", ".join(u"?" for _ in packet_ids) + ")", [self.database_id] + list(packet_ids))
+                # cleanup the sync and double_signed_sync tables.  everything except what we need to
+                # tell others this community is no longer available.  this is done in the background
+                # by the reclassified community, see _resume_purge
+                last_packet_id, = self._dispersy._database.execute(u"SELECT MAX(id) FROM sync WHERE community = ?",
+                                                                   (self.database_id,)).next()
+                self._dispersy._database.execute(u"INSERT OR REPLACE INTO option (key, value) VALUES (?, ?)",
+                                                 (self._purge_option_key, u"%d:%s" % (last_packet_id, u",".join(str(packet_id) for packet_id in packet_ids))))
 
             self._dispersy.reclassify_community(self, new_classification)
 
+    @property
+    def _purge_option_key(self):
+        return u"purge_community_%d" % self._database_id
+
+    def _resume_purge(self):
+        """
+        Start removing the packets of a hard-killed community, when on_destroy_community scheduled this.
+
+        The packets are removed in chunks of PURGE_CHUNK_SIZE, one chunk per reactor iteration.  The packets to keep,
+        and the last packet that existed when the community was destroyed, are stored in the option table until the
+        purge is done, hence an unfinished purge resumes when the community is loaded again.
+        """
+        try:
+            value, = self._dispersy.database.execute(u"SELECT value FROM option WHERE key = ?",
+                                                     (self._purge_option_key,)).next()
+        except StopIteration:
+            return
+
+        last_packet_id, keep = value.split(u":")
+        self._purge_last = int(last_packet_id)
+        self._purge_keep = set(int(packet_id) for packet_id in keep.split(u","))
+        self._purge_cursor = 0
+        count, = self._dispersy.database.execute(u"SELECT COUNT(*) FROM sync WHERE community = ? AND id <= ?",
+                                                 (self._database_id, self._purge_last)).next()
+        self._statistics.purge_remaining = max(0, count - len(self._purge_keep))
+        self._logger.info("purging %d packets from %s", self._statistics.purge_remaining, self.cid.encode("HEX"))
+        self.register_task("purge", LoopingCall(self._purge_chunk)).start(0, now=False)
+
+    def _purge_chunk(self):
+        execute = self._dispersy.database.execute
+        packet_ids = [packet_id for packet_id, in execute(u"SELECT id FROM sync WHERE community = ? AND id > ? AND id <= ? ORDER BY id LIMIT ?",
+                                                          (self._database_id, self._purge_cursor, self._purge_last, PURGE_CHUNK_SIZE))]
+        if not packet_ids:
+            execute(u"DELETE FROM option WHERE key = ?", (self._purge_option_key,))
+            self._statistics.purge_remaining = 0
+            self._logger.info("purged %d packets from %s", self._statistics.purge_deleted, self.cid.encode("HEX"))
+            self.cancel_pending_task("purge")
+            return
+
+        low, high = packet_ids[0], packet_ids[-1]
+        self._purge_cursor = high
+        obsolete = [(packet_id,) for packet_id in packet_ids if not packet_id in self._purge_keep]
+        if obsolete:
+            execute(u"DELETE FROM double_signed_sync WHERE sync BETWEEN ? AND ? AND sync IN (SELECT id FROM sync WHERE community = ? AND id BETWEEN ? AND ?)",
+                    (low, high, self._database_id, low, high))
+            self._dispersy.database.executemany(u"DELETE FROM sync WHERE id = ?", obsolete)
+            self._sync_history.invalidate()
+            self._statistics.purge_deleted += len(obsolete)
+            self._statistics.purge_remaining = max(0, self._statistics.purge_remaining - len(obsolete))
+
     def create_dynamic_settings(self, policies, sign_with_master=False, store=True, update=True, forward=True):
         meta = self.get_meta_message(u"dispersy-dynamic-settings")
         message = meta.impl(authentication=((self.master_member if sign_with_master else self.my_member),),
@@ -3658,7 +3864,7 @@ class Community(TaskManager):
         undo = []
         redo = []
 
-        for packet_id, packet, undone in list(execute(u"SELECT id, packet, undone FROM sync WHERE meta_message = ? AND global_time BETWEEN ? AND ?",
+        for packet_id, packet, undone in list(execute(u"SELECT id, packet, undone FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message = ? AND global_time BETWEEN ? AND ?",
                                                       (meta.database_id, time_low, time_high))):
             message = self._dispersy.convert_packet_to_message(str(packet), self)
             if message:
@@ -3714,7 +3920,7 @@ class HardKilledCommunity(Community):
         super(HardKilledCommunity, self).initialize(*args, **kargs)
         destroy_message_id = self._meta_messages[u"dispersy-destroy-community"].database_id
         try:
-            packet, = self._dispersy.database.execute(u"SELECT packet FROM sync WHERE meta_message = ? LIMIT 1", (destroy_message_id,)).next()
+            packet, = self._dispersy.database.execute(u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message = ? LIMIT 1", (destroy_message_id,)).next()
         except StopIteration:
             self._logger.error("unable to locate the dispersy-destroy-community message")
             self._destroy_community_packet = ""
@@ -1205,7 +1205,7 @@ class NoDefBinaryConversion(Conversion):
 
         return self._decode_message_map[data[22]].meta
 
-    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {return_value}")
+    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {return_value.name}")
     def decode_message(self, candidate, data, verify=True, allow_empty_signature=False, source="unknown"):
         """
         Decode a binary string into a Message structure, with some
@@ -1,9 +1,11 @@
+from collections import OrderedDict
 from hashlib import sha1
 from math import ceil
 from struct import Struct
 import logging
 
 from M2Crypto import EC, BIO
+from twisted.internet.threads import deferToThread
 
 import libnacl.dual
 
@@ -26,8 +28,57 @@ _CURVES.update({u"very-low": (EC.NID_sect163k1, "M2Crypto"),
 # Add custom curves, not provided by M2Crypto
 _CURVES.update({u'curve25519': (None, "libnacl")})
 
+# ECCrypto keeps at most this many parsed keys
+KEY_CACHE_SIZE = 4096
+
 logger = logging.getLogger(__name__)
 
+
+class KeyCache(object):
+
+    """
+    A bounded cache with parsed DispersyKey instances, keyed by their binary representation.
+
+    The least recently used key is removed when the cache is full.  Parsed keys are never modified, hence they can be
+    shared by everyone that parses the same binary key.
+    """
+
+    def __init__(self, size=KEY_CACHE_SIZE):
+        assert isinstance(size, int), type(size)
+        assert size > 0, size
+        self._size = size
+        self._keys = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, string):
+        return string in self._keys
+
+    def get(self, string, parse):
+        """
+        Returns the key for STRING, calling PARSE(STRING) when it is not cached.
+
+        Exceptions raised by PARSE are passed on and nothing is cached.
+        """
+        try:
+            key = self._keys.pop(string)
+        except KeyError:
+            self.misses += 1
+            key = parse(string)
+            if len(self._keys) >= self._size:
+                self._keys.popitem(False)
+        else:
+            self.hits += 1
+        self._keys[string] = key
+        return key
+
+    def clear(self):
+        self._keys.clear()
+
+
 class DispersyCrypto(object):
 
     @property
@@ -48,6 +99,24 @@ class DispersyCrypto(object):
         """
         raise NotImplementedError()
 
+    def generate_key_in_thread(self, security_level):
+        """
+        Generate a new key using the specified security_level in a thread from the reactor thread pool.
+        @param security_level: Level of security, supported levels can be obtained using .security_levels.
+        @type security_level: unicode
+
+        @rtype Deferred firing with the key
+        """
+        return deferToThread(self.generate_key, security_level)
+
+    @property
+    def key_caches(self):
+        """
+        Returns the KeyCache instances with parsed keys, empty when keys are parsed every time
+        @rtype: tuple
+        """
+        return ()
+
     def key_to_bin(self, key):
         "Convert a key to the binary format."
         raise NotImplementedError()
@@ -98,10 +167,20 @@ class ECCrypto(DispersyCrypto):
         @author: Niels Zeilemaker
     """
 
+    def __init__(self, key_cache_size=KEY_CACHE_SIZE):
+        super(ECCrypto, self).__init__()
+        # separate caches, key_from_private_bin must never return a public key
+        self._private_key_cache = KeyCache(key_cache_size)
+        self._public_key_cache = KeyCache(key_cache_size)
+
     def _progress(self, *args):
         "Called when no feedback needs to be given."
         pass
 
+    @property
+    def key_caches(self):
+        return (self._private_key_cache, self._public_key_cache)
+
     @property
     def security_levels(self):
         """
@@ -160,6 +239,9 @@ class ECCrypto(DispersyCrypto):
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name}")
     def is_valid_public_bin(self, string):
         "Returns True if the input is a valid public key"
+        if string in self._public_key_cache:
+            # only keys that were parsed successfully are cached
+            return True
         try:
             self.key_from_public_bin(string)
         except:
@@ -168,12 +250,20 @@ class ECCrypto(DispersyCrypto):
 
     def key_from_private_bin(self, string):
         "Get the EC from a public/private keypair stored in a binary format."
+        return self._private_key_cache.get(string, self._parse_private_bin)
+
+    def key_from_public_bin(self, string):
+        "Get the EC from a public key in binary format."
+        return self._public_key_cache.get(string, self._parse_public_bin)
+
+    @staticmethod
+    def _parse_private_bin(string):
         if string.startswith("LibNaCLSK:"):
             return LibNaCLSK(string[10:])
         return M2CryptoSK(keystring=string)
 
-    def key_from_public_bin(self, string):
-        "Get the EC from a public key in binary format."
+    @staticmethod
+    def _parse_public_bin(string):
         if string.startswith("LibNaCLPK:"):
             return LibNaCLPK(string[10:])
         return M2CryptoPK(keystring=string)
@@ -68,24 +68,87 @@ class IgnoreCommits(Exception):
         super(IgnoreCommits, self).__init__("Ignore all commits made within __enter__ and __exit__")
 
 
+# PRAGMA synchronous returns a number
+_SYNCHRONOUS = {u"OFF": 0, u"NORMAL": 1, u"FULL": 2, u"EXTRA": 3}
+
+
+class DatabaseProfile(object):
+
+    """
+    The SQLite settings that Database._initial_statements applies.
+
+    Settings that are None are left to SQLite.  See http://www.sqlite.org/pragma.html for the meaning of each setting.
+    CHECKPOINT_ON_CLOSE is the wal_checkpoint mode used when the database is closed, i.e. u"TRUNCATE" to empty the
+    write-ahead log, or None to leave the checkpoint to SQLite.
+    """
+
+    def __init__(self, name, journal_mode=u"WAL", locking_mode=None, synchronous=u"NORMAL", cache_size=None,
+                 mmap_size=None, temp_store=None, wal_autocheckpoint=None, checkpoint_on_close=None):
+        assert isinstance(name, unicode), type(name)
+        assert journal_mode in (u"DELETE", u"TRUNCATE", u"PERSIST", u"MEMORY", u"WAL", u"OFF"), journal_mode
+        assert locking_mode in (None, u"NORMAL", u"EXCLUSIVE"), locking_mode
+        assert synchronous in _SYNCHRONOUS, synchronous
+        assert cache_size is None or isinstance(cache_size, int), type(cache_size)
+        assert mmap_size is None or isinstance(mmap_size, int), type(mmap_size)
+        assert temp_store in (None, u"DEFAULT", u"FILE", u"MEMORY"), temp_store
+        assert wal_autocheckpoint is None or isinstance(wal_autocheckpoint, int), type(wal_autocheckpoint)
+        assert checkpoint_on_close in (None, u"PASSIVE", u"FULL", u"RESTART", u"TRUNCATE"), checkpoint_on_close
+        super(DatabaseProfile, self).__init__()
+        self.name = name
+        self.journal_mode = journal_mode
+        self.locking_mode = locking_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.temp_store = temp_store
+        self.wal_autocheckpoint = wal_autocheckpoint
+        self.checkpoint_on_close = checkpoint_on_close
+
+    def __str__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.name)
+
+
+DATABASE_PROFILES = dict((profile.name, profile) for profile in (
+    # the settings used before profiles existed
+    DatabaseProfile(u"default", locking_mode=u"EXCLUSIVE"),
+    # desktop nodes: survive a power failure, keep the write-ahead log small, and leave memory to other applications
+    DatabaseProfile(u"conservative", locking_mode=u"NORMAL", synchronous=u"FULL", cache_size=-2000, mmap_size=0,
+                    wal_autocheckpoint=1000, checkpoint_on_close=u"TRUNCATE"),
+    # dedicated nodes with memory to spare
+    DatabaseProfile(u"performance", locking_mode=u"EXCLUSIVE", cache_size=-64 * 1024, mmap_size=256 * 1024 * 1024,
+                    temp_store=u"MEMORY", wal_autocheckpoint=10000, checkpoint_on_close=u"TRUNCATE"),
+    # trackers and CI: everything can be obtained again from the network, a crash may corrupt the database
+    DatabaseProfile(u"unsynchronized", journal_mode=u"MEMORY", locking_mode=u"EXCLUSIVE", synchronous=u"OFF",
+                    cache_size=-64 * 1024, temp_store=u"MEMORY"),
+))
+DEFAULT_DATABASE_PROFILE = u"default"
+
+
 class Database(object):
 
     __metaclass__ = ABCMeta
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, profile=None):
         """
         Initialize a new Database instance.
 
         @param file_path: the path to the database file.
         @type file_path: unicode
+
+        @param profile: the SQLite settings, DATABASE_PROFILES[DEFAULT_DATABASE_PROFILE] when None.
+        @type profile: DatabaseProfile
         """
         assert isinstance(file_path, unicode)
+        assert profile is None or isinstance(profile, DatabaseProfile), type(profile)
 
         super(Database, self).__init__()
         self._logger = logging.getLogger(self.__class__.__name__)
 
         self._logger.debug("loading database [%s]", file_path)
         self._file_path = file_path
+        self._profile = profile or DATABASE_PROFILES[DEFAULT_DATABASE_PROFILE]
+        # name:value pairs with the settings that are in effect, set during open(...)
+        self._settings = {}
 
         # _CONNECTION, _CURSOR, AND _DATABASE_VERSION are set during open(...)
         self._connection = None
@@ -120,6 +183,12 @@ class Database(object):
         assert self._connection is not None, "Database.close() has been called or Database.open() has not been called"
         if commit:
             self.commit(exiting=True)
+        if self._profile.checkpoint_on_close and self._settings.get(u"journal_mode") == u"WAL":
+            self._logger.debug("PRAGMA wal_checkpoint(%s) [%s]", self._profile.checkpoint_on_close, self._file_path)
+            try:
+                self._cursor.execute(u"PRAGMA wal_checkpoint(%s)" % self._profile.checkpoint_on_close)
+            except sqlite3.Error as exception:
+                self._logger.warning("unable to checkpoint: %s [%s]", exception, self._file_path)
         self._logger.debug("close database [%s]", self._file_path)
         self._cursor.close()
         self._cursor = None
@@ -161,29 +230,68 @@ class Database(object):
         else:
             self._logger.debug("PRAGMA page_size = %s (no change) [%s]", page_size, self._file_path)
 
+        profile = self._profile
+
+        #
+        # PRAGMA locking_mode = NORMAL | EXCLUSIVE
+        # http://www.sqlite.org/pragma.html#pragma_locking_mode
+        # Must be set before the journal mode is changed to WAL, otherwise WAL uses shared memory.
+        #
+        if profile.locking_mode:
+            self._logger.debug("PRAGMA locking_mode = %s [%s]", profile.locking_mode, self._file_path)
+            self._cursor.execute(u"PRAGMA locking_mode = %s" % profile.locking_mode)
+
         #
         # PRAGMA journal_mode = DELETE | TRUNCATE | PERSIST | MEMORY | WAL | OFF
-        # http://www.sqlite.org/pragma.html#pragma_page_size
+        # http://www.sqlite.org/pragma.html#pragma_journal_mode
+        # An in-memory database always uses the MEMORY journal mode.
         #
-        if not (journal_mode == u"WAL" or self._file_path == u":memory:"):
-            self._logger.debug("PRAGMA journal_mode = WAL (previously: %s) [%s]", journal_mode, self._file_path)
-            self._cursor.execute(u"PRAGMA locking_mode = EXCLUSIVE")
-            execute_or_script(self._cursor, u"PRAGMA journal_mode = WAL")
+        if not (journal_mode == profile.journal_mode or self._file_path == u":memory:"):
+            self._logger.debug("PRAGMA journal_mode = %s (previously: %s) [%s]",
+                               profile.journal_mode, journal_mode, self._file_path)
+            execute_or_script(self._cursor, u"PRAGMA journal_mode = %s" % profile.journal_mode)
 
         else:
             self._logger.debug("PRAGMA journal_mode = %s (no change) [%s]", journal_mode, self._file_path)
 
         #
-        # PRAGMA synchronous = 0 | OFF | 1 | NORMAL | 2 | FULL;
+        # PRAGMA synchronous = 0 | OFF | 1 | NORMAL | 2 | FULL | 3 | EXTRA;
         # http://www.sqlite.org/pragma.html#pragma_synchronous
         #
-        if not synchronous in (u"NORMAL", u"1"):
-            self._logger.debug("PRAGMA synchronous = NORMAL (previously: %s) [%s]", synchronous, self._file_path)
-            execute_or_script(self._cursor, u"PRAGMA synchronous = NORMAL")
+        if not synchronous in (profile.synchronous, unicode(_SYNCHRONOUS[profile.synchronous])):
+            self._logger.debug("PRAGMA synchronous = %s (previously: %s) [%s]",
+                               profile.synchronous, synchronous, self._file_path)
+            execute_or_script(self._cursor, u"PRAGMA synchronous = %s" % profile.synchronous)
 
         else:
             self._logger.debug("PRAGMA synchronous = %s (no change) [%s]", synchronous, self._file_path)
 
+        #
+        # PRAGMA cache_size, mmap_size, temp_store, and wal_autocheckpoint only apply to this connection
+        # http://www.sqlite.org/pragma.html
+        #
+        for name in (u"cache_size", u"mmap_size", u"temp_store", u"wal_autocheckpoint"):
+            value = getattr(profile, name)
+            if value is not None:
+                self._logger.debug("PRAGMA %s = %s [%s]", name, value, self._file_path)
+                self._cursor.execute(u"PRAGMA %s = %s" % (name, value))
+
+        self._settings = self._get_settings()
+        self._logger.info("database profile %s: %s [%s]", profile.name,
+                          ", ".join("%s=%s" % item for item in sorted(self._settings.iteritems())), self._file_path)
+
+    def _get_settings(self):
+        """
+        Returns a name:value dictionary with the settings that are in effect.
+        """
+        settings = {}
+        for name in (u"page_size", u"journal_mode", u"locking_mode", u"synchronous", u"cache_size", u"mmap_size",
+                     u"temp_store", u"wal_autocheckpoint"):
+            row = next(self._cursor.execute(u"PRAGMA %s" % name), None)
+            if row is not None:
+                settings[name] = row[0].upper() if isinstance(row[0], basestring) else row[0]
+        return settings
+
     def _prepare_version(self):
         assert self._cursor is not None, "Database.close() has been called or Database.open() has not been called"
         assert self._connection is not None, "Database.close() has been called or Database.open() has not been called"
@@ -212,6 +320,17 @@ class Database(object):
     def database_version(self):
         return self._database_version
 
+    @property
+    def profile(self):
+        return self._profile
+
+    @property
+    def settings(self):
+        """
+        A name:value dictionary with the SQLite settings that are in effect, available after open(...).
+        """
+        return self._settings
+
     @property
     def file_path(self):
         """
@@ -5,7 +5,7 @@ from .meta import MetaObject
 class Destination(MetaObject):
 
     class Implementation(MetaObject.Implementation):
-        pass
+        __slots__ = ()
 
     def setup(self, message):
         """
@@ -25,6 +25,8 @@ class CandidateDestination(Destination):
     """
     class Implementation(Destination.Implementation):
 
+        __slots__ = ("_candidates",)
+
         def __init__(self, meta, *candidates):
             """
             Construct a CandidateDestination.Implementation object.
@@ -56,6 +58,8 @@ class CommunityDestination(Destination):
     """
     class Implementation(Destination.Implementation):
 
+        __slots__ = ("_candidates",)
+
         def __init__(self, meta, *candidates, **kwargs):
             """
             Construct a CandidateDestination.Implementation object.
@@ -109,6 +113,8 @@ class NHopCommunityDestination(CommunityDestination):
 
     class Implementation(CommunityDestination.Implementation):
 
+        __slots__ = ("_depth",)
+
         def __init__(self, meta, *candidates, **kwargs):
             """
             Construct a NHopCommunityDestination.Implementation object.
@@ -1,7 +1,10 @@
 # Written by Niels Zeilemaker, Egbert Bouman
 import logging
 import os
+from bisect import bisect_left, insort
 from collections import OrderedDict
+from itertools import count
+from heapq import heappop, heappush, nlargest
 from random import random, shuffle
 from time import time
 
@@ -31,10 +34,17 @@ PING_INTERVAL = CANDIDATE_WALK_LIFETIME / 5
 PING_TIMEOUT = CANDIDATE_WALK_LIFETIME / 2
 INSERT_TRACKER_INTERVAL = 300
 PEERCACHE_FILENAME = 'peercache.txt'
+# the peer cache file is rewritten once it holds more lines than this times the number of peers
+PEERCACHE_COMPACT_FACTOR = 4
 TIME_BETWEEN_CONNECTION_ATTEMPTS = 10.0
 
 BOOTSTRAP_FILE_ENVNAME = 'DISPERSY_BOOTSTRAP_FILE'
 
+# the size of the tb_overlap bitfields in a similarity-response
+BITFIELD_SIZE = 4 * 8
+# PreferenceBits assigns new ids once more preferences than this are known
+PREFERENCE_BITS_LIMIT = 1024
+
 
 class LimitedOrderedDict(OrderedDict):
 
@@ -48,6 +58,48 @@ class LimitedOrderedDict(OrderedDict):
             self.popitem(last=False)
 
 
+def count_bits(bits):
+    return bin(bits).count("1")
+
+
+class PreferenceBits(object):
+
+    """
+    Assigns a bit to each preference, allowing a set of preferences to be stored as a bitset (an int or long).
+
+    Overlap between two sets of preferences is then the number of bits in the bitwise and of their bitsets.  Every
+    preference that is given to get is assigned a bit, hence the caller must call clear, and recreate all bitsets it
+    holds, once too many preferences are known.
+    """
+
+    def __init__(self):
+        super(PreferenceBits, self).__init__()
+        self._bits = {}
+
+    def __len__(self):
+        return len(self._bits)
+
+    def clear(self):
+        self._bits.clear()
+
+    def get(self, preferences, assign=True):
+        """
+        Returns the bitset for PREFERENCES.
+
+        When ASSIGN is False preferences that do not have a bit yet are ignored, no bitset created so far contains them.
+        """
+        bits = self._bits
+        result = 0
+        for preference in preferences:
+            bit = bits.get(preference)
+            if bit is None:
+                if not assign:
+                    continue
+                bit = bits[preference] = 1 << len(bits)
+            result |= bit
+        return result
+
+
 class TasteBuddy(object):
 
     def __init__(self, overlap, preferences, sock_addr):
@@ -61,6 +113,8 @@ class TasteBuddy(object):
         self.preferences = preferences
         self.sock_addr = sock_addr
         self.random_sort_value = random()
+        # set by the DiscoveryCommunity, see PreferenceBits
+        self.preference_bits = 0
 
     def update_overlap(self, other, compute_overlap):
         self.preferences = self.preferences | other.preferences
@@ -69,11 +123,14 @@ class TasteBuddy(object):
     def does_overlap(self, preference):
         return preference in self.preferences
 
+    @property
+    def sort_key(self):
+        # we sort by overlap, then random
+        return (self.overlap, self.random_sort_value)
+
     def __cmp__(self, other):
         if isinstance(other, TasteBuddy):
-            # we sort by overlap, then random
-            return cmp((self.overlap, self.random_sort_value),
-                       (other.overlap, other.random_sort_value))
+            return cmp(self.sort_key, other.sort_key)
 
         elif isinstance(other, int):
             return cmp(self.overlap, other)
@@ -146,11 +203,14 @@ class PossibleTasteBuddy(TasteBuddy):
     def did_received_from(self, candidate):
         return candidate == self.received_from
 
+    @property
+    def sort_key(self):
+        # we want to sort based on overlap, then time desc, then random
+        return (self.overlap, self.timestamp, self.random_sort_value)
+
     def __cmp__(self, other):
         if isinstance(other, PossibleTasteBuddy):
-            # we want to sort based on overlap, then time desc, then random
-            return cmp((self.overlap, self.timestamp, self.random_sort_value),
-                       (other.overlap, other.timestamp, other.random_sort_value))
+            return cmp(self.sort_key, other.sort_key)
 
         return TasteBuddy.__cmp__(self, other)
 
@@ -173,6 +233,127 @@ class PossibleTasteBuddy(TasteBuddy):
         return hash(self.candidate_mid)
 
 
+class TasteBuddyIndex(object):
+
+    """
+    A set of (possible) taste buddies indexed by candidate_mid and, when known, by sock_addr.
+
+    Taste buddies are kept ordered by their sort_key, allowing the highest and lowest to be found in constant time,
+    and in a heap ordered by timestamp, allowing expired taste buddies to be removed without scanning all of them.
+
+    The overlap and timestamp of a taste buddy are part of its ordering, hence they must be changed through reorder
+    and touch while the taste buddy is in the index.  When LIMIT is given, adding a taste buddy to a full index removes
+    the lowest one.
+    """
+
+    def __init__(self, limit=0):
+        assert isinstance(limit, int), type(limit)
+        super(TasteBuddyIndex, self).__init__()
+        self._limit = limit
+        self._mids = {}
+        self._sock_addrs = {}
+        # ascending (sort_key, candidate_mid) tuples, SORT_KEYS holds the tuple currently used for each taste buddy
+        self._order = []
+        self._sort_keys = {}
+        # (timestamp, candidate_mid) tuples, entries for removed or touched taste buddies are skipped when popped
+        self._expiry = []
+
+    def __len__(self):
+        return len(self._mids)
+
+    def __iter__(self):
+        """
+        Yields all taste buddies, most similar first.
+        """
+        mids = self._mids
+        return (mids[mid] for _, mid in reversed(self._order))
+
+    def get_mid(self, mid):
+        return self._mids.get(mid)
+
+    def get_sock_addr(self, sock_addr):
+        return self._sock_addrs.get(sock_addr)
+
+    def highest(self):
+        return self._mids[self._order[-1][1]] if self._order else None
+
+    def lowest(self):
+        return self._mids[self._order[0][1]] if self._order else None
+
+    def add(self, taste_buddy):
+        """
+        Add TASTE_BUDDY, replacing the taste buddies with the same candidate_mid or sock_addr.
+        """
+        assert isinstance(taste_buddy, TasteBuddy), type(taste_buddy)
+        for existing in (self._mids.get(taste_buddy.candidate_mid), self._sock_addrs.get(taste_buddy.sock_addr)):
+            if existing is not None:
+                self.remove(existing)
+
+        mid = taste_buddy.candidate_mid
+        self._mids[mid] = taste_buddy
+        if taste_buddy.sock_addr is not None:
+            self._sock_addrs[taste_buddy.sock_addr] = taste_buddy
+        self._sort_keys[mid] = sort_key = (taste_buddy.sort_key, mid)
+        insort(self._order, sort_key)
+        heappush(self._expiry, (taste_buddy.timestamp, mid))
+
+        if self._limit and len(self._order) > self._limit:
+            self.remove(self.lowest())
+
+    def remove(self, taste_buddy):
+        mid = taste_buddy.candidate_mid
+        if self._mids.get(mid) is taste_buddy:
+            del self._mids[mid]
+            if self._sock_addrs.get(taste_buddy.sock_addr) is taste_buddy:
+                del self._sock_addrs[taste_buddy.sock_addr]
+            self._remove_order(mid)
+
+    def _remove_order(self, mid):
+        sort_key = self._sort_keys.pop(mid)
+        del self._order[bisect_left(self._order, sort_key)]
+
+    def pop_highest(self):
+        taste_buddy = self.highest()
+        if taste_buddy is not None:
+            self.remove(taste_buddy)
+        return taste_buddy
+
+    def reorder(self, taste_buddy):
+        """
+        Must be called after the sort_key of TASTE_BUDDY changed.
+        """
+        mid = taste_buddy.candidate_mid
+        assert self._mids.get(mid) is taste_buddy, taste_buddy
+        self._remove_order(mid)
+        self._sort_keys[mid] = sort_key = (taste_buddy.sort_key, mid)
+        insort(self._order, sort_key)
+
+    def touch(self, taste_buddy, timestamp):
+        """
+        Set the timestamp of TASTE_BUDDY.
+        """
+        assert self._mids.get(taste_buddy.candidate_mid) is taste_buddy, taste_buddy
+        taste_buddy.timestamp = timestamp
+        heappush(self._expiry, (timestamp, taste_buddy.candidate_mid))
+        if isinstance(taste_buddy, PossibleTasteBuddy):
+            self.reorder(taste_buddy)
+
+    def expire(self, too_old):
+        """
+        Removes and returns the taste buddies with a timestamp of TOO_OLD or lower.
+        """
+        expired = []
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= too_old:
+            timestamp, mid = heappop(expiry)
+            taste_buddy = self._mids.get(mid)
+            # skip entries for taste buddies that have since been removed, replaced, or touched
+            if taste_buddy is not None and taste_buddy.timestamp == timestamp:
+                self.remove(taste_buddy)
+                expired.append(taste_buddy)
+        return expired
+
+
 class SimilarityAttempt(RandomNumberCache):
 
     def __init__(self, community, requested_candidate, preference_list, allow_sync):
@@ -210,10 +391,11 @@ class DiscoveryCommunity(Community):
         self.peer_cache = PeerCache(os.path.join(self._dispersy._working_directory, PEERCACHE_FILENAME), self)
         self.max_prefs = max_prefs
         self.max_tbs = max_tbs
-        self.taste_buddies = []
-        self.possible_taste_buddies = []
+        self.taste_buddies = TasteBuddyIndex(limit=max_tbs * 4)
+        self.possible_taste_buddies = TasteBuddyIndex()
         self.requested_introductions = {}
         self.recent_taste_buddies = LimitedOrderedDict(limit=1000)
+        self.preference_bits = PreferenceBits()
 
         self.send_packet_size = 0
         self.reply_packet_size = 0
@@ -335,48 +517,65 @@ class DiscoveryCommunity(Community):
         my_communities = dict((community.cid, community)
                               for community in self._dispersy.get_communities() if community.dispersy_enable_candidate_walker)
 
-        for i in xrange(len(new_taste_buddies) - 1, -1, -1):
-            new_taste_buddy = new_taste_buddies[i]
+        for new_taste_buddy in new_taste_buddies:
             self._logger.debug("DiscoveryCommunity: new taste buddy? %s", new_taste_buddy)
 
             if new_taste_buddy.should_cache():
                 self.peer_cache.add_or_update_peer(new_taste_buddy.candidate)
 
-            for taste_buddy in self.taste_buddies:
-                if new_taste_buddy == taste_buddy:
-                    self._logger.debug(
-                        "DiscoveryCommunity: new taste buddy? no, equal to %s %s", new_taste_buddy, taste_buddy)
+            taste_buddy = self.taste_buddies.get_sock_addr(new_taste_buddy.sock_addr)
+            if taste_buddy and taste_buddy.candidate_mid == new_taste_buddy.candidate_mid:
+                self._logger.debug(
+                    "DiscoveryCommunity: new taste buddy? no, equal to %s %s", new_taste_buddy, taste_buddy)
 
-                    taste_buddy.update_overlap(new_taste_buddy, self.compute_overlap)
-                    new_taste_buddies.pop(i)
-                    break
+                taste_buddy.update_overlap(new_taste_buddy, self.compute_overlap)
+                taste_buddy.preference_bits = self.preference_bits.get(taste_buddy.preferences)
+                self.taste_buddies.reorder(taste_buddy)
 
             # new peer
             else:
                 self._logger.debug("DiscoveryCommunity: new taste buddy? yes, adding to list")
-                self.taste_buddies.append(new_taste_buddy)
+                taste_buddy = new_taste_buddy
+                taste_buddy.preference_bits = self.preference_bits.get(taste_buddy.preferences)
+                self.taste_buddies.add(taste_buddy)
+
+            # a taste buddy is no longer a possible taste buddy
+            if taste_buddy.overlap:
+                possible = self.possible_taste_buddies.get_mid(taste_buddy.candidate_mid)
+                if possible:
+                    self.possible_taste_buddies.remove(possible)
 
             # add taste buddy to overlapping communities
             for cid in new_taste_buddy.preferences:
                 if cid in my_communities:
                     my_communities[cid].add_discovered_candidate(new_taste_buddy.candidate)
 
-        self.taste_buddies.sort(reverse=True)
-        self.taste_buddies = self.taste_buddies[:self.max_tbs * 4]
-
         if DEBUG_VERBOSE:
             self._logger.debug("DiscoveryCommunity: current tastebuddy list %s %s", len(
                 self.taste_buddies), map(str, self.taste_buddies))
         else:
             self._logger.debug("DiscoveryCommunity: current tastebuddy list %s", len(self.taste_buddies))
 
+    def reset_preference_bits(self):
+        """
+        Assign new preference bits once too many preferences are known, keeping the bitsets small.
+
+        Must not be called while bitsets obtained from the current bits are being used.
+        """
+        if len(self.preference_bits) > PREFERENCE_BITS_LIMIT:
+            self._logger.debug("DiscoveryCommunity: resetting %d preference bits", len(self.preference_bits))
+            self.preference_bits.clear()
+            for taste_buddy in self.taste_buddies:
+                taste_buddy.preference_bits = self.preference_bits.get(taste_buddy.preferences)
+
+    def remove_old_taste_buddies(self):
+        for taste_buddy in self.taste_buddies.expire(time() - PING_TIMEOUT):
+            self._logger.debug("DiscoveryCommunity: removing tastebuddy too old %s", taste_buddy)
+
     def yield_taste_buddies(self, ignore_candidate=None):
-        for i in range(len(self.taste_buddies) - 1, -1, -1):
-            if self.taste_buddies[i].time_remaining() == 0:
-                self._logger.debug("DiscoveryCommunity: removing tastebuddy too old %s", self.taste_buddies[i])
-                self.taste_buddies.pop(i)
+        self.remove_old_taste_buddies()
 
-        taste_buddies = self.taste_buddies[:]
+        taste_buddies = list(self.taste_buddies)
         shuffle(taste_buddies)
         ignore_sock_addr = ignore_candidate.sock_addr if ignore_candidate else None
 
@@ -385,31 +584,33 @@ class DiscoveryCommunity(Community):
                 yield taste_buddy
 
     def is_taste_buddy(self, candidate):
-        for tb in self.yield_taste_buddies():
-            if tb == candidate:
-                return tb
+        self.remove_old_taste_buddies()
+
+        tb = self.taste_buddies.get_sock_addr(candidate.sock_addr)
+        if tb and tb.overlap:
+            return tb
 
     def is_taste_buddy_mid(self, mid):
         assert isinstance(mid, str)
         assert len(mid) == 20
 
-        for tb in self.yield_taste_buddies():
-            if mid == tb.candidate_mid:
-                return tb
+        self.remove_old_taste_buddies()
+
+        tb = self.taste_buddies.get_mid(mid)
+        if tb and tb.overlap:
+            return tb
 
     def reset_taste_buddy(self, candidate):
-        for tb in self.yield_taste_buddies():
-            if tb == candidate:
-                tb.timestamp = time()
-                if tb.should_cache():
-                    self.peer_cache.add_or_update_peer(tb.candidate)
-                break
+        tb = self.is_taste_buddy(candidate)
+        if tb:
+            self.taste_buddies.touch(tb, time())
+            if tb.should_cache():
+                self.peer_cache.add_or_update_peer(tb.candidate)
 
     def remove_taste_buddy(self, candidate):
-        for tb in self.yield_taste_buddies():
-            if tb == candidate:
-                self.taste_buddies.remove(tb)
-                break
+        tb = self.is_taste_buddy(candidate)
+        if tb:
+            self.taste_buddies.remove(tb)
 
     def is_recent_taste_buddy(self, candidate):
         member = candidate.get_member()
@@ -428,32 +629,28 @@ class DiscoveryCommunity(Community):
             for possible in possibles:
                 assert isinstance(possible, PossibleTasteBuddy), type(possible)
 
+        added = False
         low_sim = self.get_least_similar_tb()
-        for i in xrange(len(possibles) - 1, -1, -1):
-            new_possible = possibles[i]
-
+        for new_possible in possibles:
             self._logger.debug("DiscoveryCommunity: new possible taste buddy? %s", new_possible)
 
             if new_possible < low_sim or self.is_taste_buddy_mid(new_possible.candidate_mid) or new_possible == self.my_member:
                 self._logger.debug("DiscoveryCommunity: new possible taste buddy? no, %s %s %s", new_possible < low_sim, self.is_taste_buddy_mid(new_possible.candidate_mid), new_possible == self.my_member)
-                possibles.pop(i)
                 continue
 
-            for i, possible in enumerate(self.possible_taste_buddies):
-                if possible == new_possible:
-                    new_possible.update_overlap(possible, self.compute_overlap)
-
-                    # replace in list
-                    self.possible_taste_buddies[i] = new_possible
-                    break
+            added = True
+            possible = self.possible_taste_buddies.get_mid(new_possible.candidate_mid)
+            if possible:
+                new_possible.update_overlap(possible, self.compute_overlap)
 
             # new peer
             else:
                 self._logger.debug("DiscoveryCommunity: new possible taste buddy? yes, adding to list")
-                self.possible_taste_buddies.append(new_possible)
 
-        self.possible_taste_buddies.sort(reverse=True)
-        if possibles:
+            # add, or replace in index
+            self.possible_taste_buddies.add(new_possible)
+
+        if added:
             if DEBUG_VERBOSE:
                 self._logger.debug("DiscoveryCommunity: got possible taste buddies, current list %s %s",
                                    len(self.possible_taste_buddies), map(str, self.possible_taste_buddies))
@@ -462,16 +659,17 @@ class DiscoveryCommunity(Community):
                                    len(self.possible_taste_buddies))
 
     def clean_possible_taste_buddies(self):
-        low_sim = self.get_least_similar_tb()
-        for i in range(len(self.possible_taste_buddies) - 1, -1, -1):
-            to_low_sim = self.possible_taste_buddies[i] < low_sim
-            too_old = self.possible_taste_buddies[i].time_remaining() == 0
-            is_tb = self.is_taste_buddy_mid(self.possible_taste_buddies[i].candidate_mid)
+        for possible in self.possible_taste_buddies.expire(time() - PING_TIMEOUT):
+            self._logger.debug("DiscoveryCommunity: removing possible tastebuddy too old %s", possible)
 
-            if to_low_sim or too_old or is_tb:
-                self._logger.debug("DiscoveryCommunity: removing possible tastebuddy %s %s %s %s",
-                                   to_low_sim, too_old, is_tb, self.possible_taste_buddies[i])
-                self.possible_taste_buddies.pop(i)
+        # possible taste buddies that are taste buddies are removed by add_taste_buddies, those that are too low
+        # are the least similar
+        low_sim = self.get_least_similar_tb()
+        possible = self.possible_taste_buddies.lowest()
+        while possible and possible < low_sim:
+            self._logger.debug("DiscoveryCommunity: removing possible tastebuddy too low %s", possible)
+            self.possible_taste_buddies.remove(possible)
+            possible = self.possible_taste_buddies.lowest()
 
     def has_possible_taste_buddies(self, candidate):
         for possible in self.possible_taste_buddies:
@@ -483,31 +681,28 @@ class DiscoveryCommunity(Community):
         assert isinstance(mid, str)
         assert len(mid) == 20
 
-        for ptb in self.possible_taste_buddies:
-            if mid == ptb.candidate_mid:
-                return ptb
+        return self.possible_taste_buddies.get_mid(mid)
 
     def get_most_similar(self, candidate):
         assert isinstance(candidate, WalkCandidate), [type(candidate), candidate]
 
         self.clean_possible_taste_buddies()
 
-        if self.possible_taste_buddies:
-            most_similar = self.possible_taste_buddies.pop(0)
+        most_similar = self.possible_taste_buddies.pop_highest()
+        if most_similar:
             return most_similar.received_from, most_similar.candidate_mid
 
         return candidate, None
 
     def get_least_similar_tb(self):
-        if self.taste_buddies:
-            return self.taste_buddies[-1]
-        return 0
+        return self.taste_buddies.lowest() or 0
 
     def create_introduction_request(self, destination, allow_sync, forward=True, is_fast_walker=False):
         assert isinstance(destination, WalkCandidate), [type(destination), destination]
 
-        self._logger.debug("DiscoveryCommunity: creating intro request %s %s %s", self.is_taste_buddy(
-            destination), self.has_possible_taste_buddies(destination), destination)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("DiscoveryCommunity: creating intro request %s %s %s", self.is_taste_buddy(
+                destination), self.has_possible_taste_buddies(destination), destination)
 
         send = False
         if not self.is_recent_taste_buddy(destination):
@@ -554,6 +749,10 @@ class DiscoveryCommunity(Community):
     def on_similarity_request(self, messages):
         meta = self.get_meta_message(u"similarity-response")
 
+        self.reset_preference_bits()
+        my_preferences = self.my_preferences()
+        my_bits = self.preference_bits.get(my_preferences)
+
         # similar to on_introduction_request, we first add all requests to our taste_buddies
         # and then create the replies
         for message in messages:
@@ -566,31 +765,32 @@ class DiscoveryCommunity(Community):
             his_preferences = message.payload.preference_list[:self.max_prefs]
             assert all(isinstance(his_preference, str) for his_preference in his_preferences)
 
-            overlap_count = self.compute_overlap(his_preferences)
+            overlap_count = count_bits(self.preference_bits.get(his_preferences) & my_bits)
             self.add_taste_buddies([ActualTasteBuddy(overlap_count, set(his_preferences),
                                                      time(), wcandidate)])
 
+        # the taste buddies that can be used in the bitfields
+        tbs = [tb for tb in self.taste_buddies if tb.time_remaining() > 5.0]
+
         for message in messages:
             self._logger.debug("DiscoveryCommunity: got similarity request from %s %s", message.candidate, overlap_count)
 
             his_preferences = message.payload.preference_list[:self.max_prefs]
+            his_bits = self.preference_bits.get(his_preferences, assign=False)
+            # the bitfield has one bit for each of the first BITFIELD_SIZE preferences in the request
+            bitfield_bits = [(self.preference_bits.get((preference,), assign=False), 1 << index)
+                             for index, preference in enumerate(his_preferences[:BITFIELD_SIZE])]
 
             # Determine overlap for top taste buddies
             bitfields = []
-            tbs = []
-            for tb in self.taste_buddies:
-                if tb.time_remaining() > 5.0:
-                    if tb != message.candidate or True:
-                        tbs.append((self.compute_overlap(his_preferences, tb.preferences), random(), tb))
-
-            sorted_tbs = sorted(tbs, reverse=True)
-            for _, _, tb in sorted_tbs[:self.max_tbs]:
-                # Size of the bitfield is fixed and set to 4 bytes.
-                bitfield = sum([2 ** index for index in range(min(len(his_preferences), 4 * 8))
-                                if his_preferences[index] in tb.preferences])
+            for _, _, tb in nlargest(self.max_tbs, ((count_bits(his_bits & tb.preference_bits), random(), tb) for tb in tbs)):
+                bitfield = 0
+                for preference_bit, bitfield_bit in bitfield_bits:
+                    if tb.preference_bits & preference_bit:
+                        bitfield |= bitfield_bit
                 bitfields.append((tb.candidate_mid, bitfield))
 
-            payload = (message.payload.identifier, self.my_preferences()[:self.max_prefs], bitfields)
+            payload = (message.payload.identifier, my_preferences[:self.max_prefs], bitfields)
             response_message = meta.impl(
                 authentication=(self.my_member,), distribution=(self.global_time,), payload=payload)
 
@@ -624,6 +824,9 @@ class DiscoveryCommunity(Community):
             yield message
 
     def on_similarity_response(self, messages):
+        self.reset_preference_bits()
+        my_bits = self.preference_bits.get(self.my_preferences())
+
         for message in messages:
             # Update possible taste buddies.
             request = self._request_cache.pop(u"similarity", message.payload.identifier)
@@ -640,7 +843,7 @@ class DiscoveryCommunity(Community):
 
             assert all(isinstance(his_preference, str) for his_preference in his_preferences)
 
-            overlap_count = self.compute_overlap(his_preferences)
+            overlap_count = count_bits(self.preference_bits.get(his_preferences) & my_bits)
             self.add_taste_buddies([ActualTasteBuddy(overlap_count, his_preferences, time(),
                                                      w_candidate)])
 
@@ -650,8 +853,8 @@ class DiscoveryCommunity(Community):
             possibles = []
             original_list = request.preference_list
             for candidate_mid, bitfield in message.payload.tb_overlap:
-                tb_preferences = set([original_list[index] for index in
-                                      range(min(len(original_list), 4 * 8)) if bool(bitfield & 2 ** index)])
+                tb_preferences = set(original_list[index] for index in
+                                     xrange(min(len(original_list), BITFIELD_SIZE)) if bitfield >> index & 1)
                 possibles.append(PossibleTasteBuddy(len(tb_preferences), tb_preferences,
                                                     now, candidate_mid, w_candidate))
 
@@ -757,6 +960,16 @@ class DiscoveryCommunity(Community):
 
 class PeerCache(object):
 
+    """
+    The walk candidates that we have seen, stored in FILENAME to be used as walk candidates after a restart.
+
+    FILENAME is a journal: clean_and_save appends a line for each peer that changed since the previous save, a later
+    line for a peer replaces the earlier ones when loading.  The file is rewritten when peers are removed or when it
+    holds more than PEERCACHE_COMPACT_FACTOR lines for each peer.
+
+    The file is loaded when the cache is first used, not when the cache is created.
+    """
+
     def __init__(self, filename, community, limit=100):
         assert isinstance(filename, (str, unicode)), type(filename)
 
@@ -765,60 +978,121 @@ class PeerCache(object):
 
         self.filename = filename
         self.community = community
-        self.walkcandidates = {}
+        self._walkcandidates = {}
         self.walkcandidates_limit = limit
         self.info_keys = ['last_seen', 'last_checked', 'num_fails']
-        self.load()
+        self._loaded = False
+        self._dirty = set()
+        self._journal_lines = 0
+        # (last_checked, counter, wcandidate) tuples, entries that no longer match the peer info are skipped
+        self._last_checked_heap = []
+        self._counter = count()
 
         self.community.register_task("clean_and_save_peer_cache", LoopingCall(self.clean_and_save)).start(30, now=False)
 
+    @property
+    def walkcandidates(self):
+        self._ensure_loaded()
+        return self._walkcandidates
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
     def load(self):
+        self._loaded = True
         if os.path.exists(self.filename):
+            rows = {}
             with open(self.filename, 'r') as fp:
-                for line in fp.readlines():
+                for line in fp:
                     if not line.startswith('#'):
+                        self._journal_lines += 1
                         result = self.parse_line(line)
                         if result is None:
                             continue
-                        wcandidate, info = result
-                        self.walkcandidates[wcandidate] = info
-            self._logger.info('PeerCache: loaded %s, got %d peers', self.filename, len(self.walkcandidates))
-
-    def clean_and_save(self):
-        old_num_candidates = len(self.walkcandidates)
+                        addresses, info = result
+                        rows[addresses] = info
 
-        for wcandidate, info in self.walkcandidates.items():
-            if info['num_fails'] > 3:
-                del self.walkcandidates[wcandidate]
-
-        if len(self.walkcandidates) > self.walkcandidates_limit:
-            sorted_keys = sorted([(info['last_seen'], wcandidate) for wcandidate, info in self.walkcandidates.iteritems()], reverse=True)
-            for _, wcandidate in sorted_keys[:self.walkcandidates_limit]:
-                del self.walkcandidates[wcandidate]
+            for (wan_addr, lan_addr, tunnel), info in rows.iteritems():
+                wcandidate = self.create_walkcandidate(wan_addr, lan_addr, tunnel)
+                self._walkcandidates[wcandidate] = info
+                self._push_last_checked(wcandidate, info)
+            self._logger.info('PeerCache: loaded %s, got %d peers from %d lines',
+                              self.filename, len(self._walkcandidates), self._journal_lines)
 
-        self._logger.debug('PeerCache: removed %d peers', old_num_candidates - len(self.walkcandidates))
-
-        with open(self.filename, 'w') as fp:
-            print >> fp, '# WAN address\tLAN address\tTunnel',
-            print >> fp, "\t".join(self.info_keys)
+    def clean_and_save(self):
+        if not self._loaded:
+            # nothing can have changed
+            return
 
-            for wcandidate, info in self.walkcandidates.iteritems():
-                print >> fp, '%s:%d\t%s:%d\t%r\t' % (wcandidate.wan_address + wcandidate.lan_address + (wcandidate.tunnel,)),
-                print >> fp, '\t'.join([str(info[key]) for key in self.info_keys])
+        old_num_candidates = len(self._walkcandidates)
 
-            self._logger.debug('PeerCache: saved %d peers to %s', len(self.walkcandidates), self.filename)
+        for wcandidate, info in self._walkcandidates.items():
+            if info['num_fails'] > 3:
+                del self._walkcandidates[wcandidate]
+
+        if len(self._walkcandidates) > self.walkcandidates_limit:
+            sorted_keys = sorted([(info['last_seen'], wcandidate) for wcandidate, info in self._walkcandidates.iteritems()], reverse=True)
+            for _, wcandidate in sorted_keys[self.walkcandidates_limit:]:
+                del self._walkcandidates[wcandidate]
+
+        num_removed = old_num_candidates - len(self._walkcandidates)
+        self._logger.debug('PeerCache: removed %d peers', num_removed)
+
+        if len(self._last_checked_heap) > 2 * len(self._walkcandidates):
+            self._last_checked_heap = []
+            for wcandidate, info in self._walkcandidates.iteritems():
+                self._push_last_checked(wcandidate, info)
+
+        if (num_removed or not os.path.exists(self.filename) or
+                self._journal_lines + len(self._dirty) > PEERCACHE_COMPACT_FACTOR * max(len(self._walkcandidates), 1)):
+            with open(self.filename, 'w') as fp:
+                fp.write('# WAN address\tLAN address\tTunnel %s\n' % "\t".join(self.info_keys))
+                for wcandidate, info in self._walkcandidates.iteritems():
+                    fp.write(self.format_line(wcandidate, info))
+            self._journal_lines = len(self._walkcandidates)
+            self._logger.debug('PeerCache: saved %d peers to %s', len(self._walkcandidates), self.filename)
+
+        elif self._dirty:
+            lines = [self.format_line(wcandidate, self._walkcandidates[wcandidate])
+                     for wcandidate in self._dirty if wcandidate in self._walkcandidates]
+            with open(self.filename, 'a') as fp:
+                fp.writelines(lines)
+            self._journal_lines += len(lines)
+            self._logger.debug('PeerCache: appended %d peers to %s', len(lines), self.filename)
+
+        self._dirty.clear()
+
+    def format_line(self, wcandidate, info):
+        return '%s:%d\t%s:%d\t%r\t' % (wcandidate.wan_address + wcandidate.lan_address + (wcandidate.tunnel,)) + \
+            '\t'.join([str(info[key]) for key in self.info_keys]) + '\n'
+
+    def _push_last_checked(self, wcandidate, info):
+        heappush(self._last_checked_heap, (info['last_checked'], next(self._counter), wcandidate))
 
     def add_or_update_peer(self, wcandidate):
         assert isinstance(wcandidate, WalkCandidate), type(wcandidate)
 
         if wcandidate in self.walkcandidates:
-            self.walkcandidates[wcandidate]['last_seen'] = time()
+            self._walkcandidates[wcandidate]['last_seen'] = time()
         else:
-            self.walkcandidates[wcandidate] = {'last_seen': time(), 'last_checked': 0, 'num_fails': 0}
+            self._walkcandidates[wcandidate] = info = {'last_seen': time(), 'last_checked': 0, 'num_fails': 0}
+            self._push_last_checked(wcandidate, info)
+        self._dirty.add(wcandidate)
 
     def get_peer(self):
-        sorted_keys = sorted([(info['last_checked'], wcandidate) for wcandidate, info in self.walkcandidates.iteritems()])
-        candidate = sorted_keys[0][1] if sorted_keys else None
+        self._ensure_loaded()
+
+        # the peer that was checked the longest ago
+        heap = self._last_checked_heap
+        while heap:
+            last_checked, _, wcandidate = heap[0]
+            info = self._walkcandidates.get(wcandidate)
+            if info is not None and info['last_checked'] == last_checked:
+                break
+            heappop(heap)
+
+        candidate = heap[0][2] if heap else None
         self._logger.debug('PeerCache: returning walk candidate %s', candidate)
         return candidate
 
@@ -827,13 +1101,21 @@ class PeerCache(object):
 
     def inc_num_fails(self, wcandidate):
         if wcandidate in self.walkcandidates:
-            self.walkcandidates[wcandidate]['num_fails'] += 1
+            self._walkcandidates[wcandidate]['num_fails'] += 1
+            self._dirty.add(wcandidate)
 
     def set_last_checked(self, wcandidate, last_checked):
         if wcandidate in self.walkcandidates:
-            self.walkcandidates[wcandidate]['last_checked'] = last_checked
+            info = self._walkcandidates[wcandidate]
+            info['last_checked'] = last_checked
+            self._push_last_checked(wcandidate, info)
+            self._dirty.add(wcandidate)
 
     def parse_line(self, line):
+        """
+        Returns ((WAN_ADDR, LAN_ADDR, TUNNEL), INFO_DICT) for a LINE written by format_line, or None when LINE is
+        invalid.
+        """
         trimmed_line = line.replace("\t\t", "\t")
         row = trimmed_line.split('\t')
 
@@ -858,11 +1140,12 @@ class PeerCache(object):
 
         tunnel = row[2] == 'True'
 
-        sock_addr = lan_addr if wan_addr[0] == self.community._dispersy._wan_address[0] else wan_addr
-        wcandidate = self.community.create_or_update_walkcandidate(sock_addr, lan_addr, wan_addr, tunnel, u'public')
-
         info_dict = {"last_seen": float(row[3]),
                      "last_checked": float(row[4]),
                      "num_fails": int(row[5])
                      }
-        return wcandidate, info_dict
+        return (wan_addr, lan_addr, tunnel), info_dict
+
+    def create_walkcandidate(self, wan_addr, lan_addr, tunnel):
+        sock_addr = lan_addr if wan_addr[0] == self.community._dispersy._wan_address[0] else wan_addr
+        return self.community.create_or_update_walkcandidate(sock_addr, lan_addr, wan_addr, tunnel, u'public')
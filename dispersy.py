@@ -48,27 +48,33 @@ from time import time
 
 import netifaces
 from twisted.internet import reactor
-from twisted.internet.defer import maybeDeferred, gatherResults, inlineCallbacks, returnValue
+from twisted.internet.defer import maybeDeferred, gatherResults, inlineCallbacks, returnValue, succeed
 from twisted.internet.task import LoopingCall
 from twisted.python.failure import Failure
 from twisted.python.threadable import isInIOThread
 
+from .addressvoting import AddressVotes, LanMatcher
 from .authentication import MemberAuthentication, DoubleMemberAuthentication
 from .candidate import LoopbackCandidate, WalkCandidate, Candidate
 from .community import Community
 from .crypto import DispersyCrypto, ECCrypto
+from .database import DATABASE_PROFILES, DEFAULT_DATABASE_PROFILE
 from .destination import CommunityDestination, CandidateDestination, NHopCommunityDestination
 from .discovery.community import DiscoveryCommunity
 from .dispersydatabase import DispersyDatabase
 from .distribution import SyncDistribution, FullSyncDistribution, LastSyncDistribution
 from .endpoint import Endpoint
 from .exception import CommunityNotFoundException, ConversionNotFoundException, MetaNotFoundException
+from .commitscheduler import CommitScheduler
+from .keypool import KeyPool
 from .member import DummyMember, Member
+from .memberstorage import DatabaseMemberStorage, MemberStorage
 from .message import Message, DropPacket, DelayPacket
 from .statistics import DispersyStatistics, _runtime_statistics
 from .taskmanager import TaskManager
+from .walkerscheduler import WalkerScheduler
 from .util import (attach_runtime_statistics, init_instrumentation, blocking_call_on_reactor_thread, is_valid_address,
-                   get_lan_address_without_netifaces, address_is_lan_without_netifaces)
+                   get_lan_address_without_netifaces)
 
 
 # Set up the instrumentation utilities
@@ -85,7 +91,8 @@ class Dispersy(TaskManager):
     outgoing data for, possibly, multiple communities.
     """
 
-    def __init__(self, endpoint, working_directory, database_filename=u"dispersy.db", crypto=ECCrypto()):
+    def __init__(self, endpoint, working_directory, database_filename=u"dispersy.db", crypto=ECCrypto(),
+                 member_storage=None, key_pool=None, database_profile=DEFAULT_DATABASE_PROFILE):
         """
         Initialise a Dispersy instance.
 
@@ -97,11 +104,23 @@ class Dispersy(TaskManager):
 
         @param database_filename: The database filename or u":memory:"
         @type database_filename: unicode
+
+        @param member_storage: Where member keys are stored, the member table in the database when None.
+        @type member_storage: MemberStorage
+
+        @param key_pool: Pre-generated keys used by get_new_member, keys are always generated on demand when None.
+        @type key_pool: KeyPool
+
+        @param database_profile: The name of the SQLite settings to use, one of DATABASE_PROFILES.
+        @type database_profile: unicode
         """
         assert isinstance(endpoint, Endpoint), type(endpoint)
         assert isinstance(working_directory, unicode), type(working_directory)
         assert isinstance(database_filename, unicode), type(database_filename)
         assert isinstance(crypto, DispersyCrypto), type(crypto)
+        assert member_storage is None or isinstance(member_storage, MemberStorage), type(member_storage)
+        assert key_pool is None or isinstance(key_pool, KeyPool), type(key_pool)
+        assert database_profile in DATABASE_PROFILES, database_profile
         super(Dispersy, self).__init__()
         self._logger = logging.getLogger(self.__class__.__name__)
 
@@ -123,9 +142,14 @@ class Dispersy(TaskManager):
             if not os.path.isdir(database_directory):
                 os.makedirs(database_directory)
             database_filename = os.path.join(database_directory, database_filename)
-        self._database = DispersyDatabase(database_filename)
+        self._database = DispersyDatabase(database_filename, DATABASE_PROFILES[database_profile])
+        self._member_storage = DatabaseMemberStorage(self._database) if member_storage is None else member_storage
 
         self._crypto = crypto
+        self._key_pool = key_pool
+
+        # coalesces the commits of stored messages
+        self._commit_scheduler = CommitScheduler(self._database)
 
         # indicates what our connection type is.  currently it can be u"unknown", u"public", or
         # u"symmetric-NAT"
@@ -135,7 +159,7 @@ class Dispersy(TaskManager):
         self._netifaces_failed = False
         self._lan_address = self._get_lan_address(True)
         self._wan_address = ("0.0.0.0", 0)
-        self._wan_address_votes = defaultdict(set)
+        self._wan_address_votes = AddressVotes()
         self._logger.debug("my LAN address is %s:%d", self._lan_address[0], self._lan_address[1])
         self._logger.debug("my WAN address is %s:%d", self._wan_address[0], self._wan_address[1])
         self._logger.debug("my connection type is %s", self._connection_type)
@@ -149,6 +173,9 @@ class Dispersy(TaskManager):
         # progress handlers (used to notify the user when something will take a long time)
         self._progress_handlers = []
 
+        # takes the walk steps of all communities
+        self._walker_scheduler = WalkerScheduler()
+
         # statistics...
         self._statistics = DispersyStatistics(self)
 
@@ -213,10 +240,7 @@ class Dispersy(TaskManager):
             logger.warning("failed to check network interfaces, error was: %r", e)
 
     def _address_is_lan(self, address):
-        if self._netifaces_failed:
-            return address_is_lan_without_netifaces(address)
-        else:
-            return any(address in interface for interface in self._local_interfaces)
+        return address in self._lan_matcher
 
     def _get_lan_address(self, bootstrap=False):
         """
@@ -224,10 +248,14 @@ class Dispersy(TaskManager):
         :return: lan address
         """
         if self._netifaces_failed:
+            self._lan_matcher = LanMatcher.without_netifaces()
             return (get_lan_address_without_netifaces(), self._lan_address[1])
         else:
             self._local_interfaces = list(self._get_interface_addresses())
             interface = self._guess_lan_address(self._local_interfaces)
+            # _guess_lan_address sets _netifaces_failed when none of the interfaces is usable
+            self._lan_matcher = LanMatcher.without_netifaces() if self._netifaces_failed else \
+                LanMatcher.from_interfaces(self._local_interfaces)
             return (interface.address if interface else get_lan_address_without_netifaces()), \
                    (0 if bootstrap else self._lan_address[1])
 
@@ -358,6 +386,38 @@ class Dispersy(TaskManager):
         """
         return self._database
 
+    @property
+    def member_storage(self):
+        """
+        The MemberStorage that stores the database id and keys of every member.
+        @rtype: MemberStorage
+        """
+        return self._member_storage
+
+    @property
+    def key_pool(self):
+        """
+        The KeyPool used by get_new_member, or None.
+        @rtype: KeyPool
+        """
+        return self._key_pool
+
+    @property
+    def commit_scheduler(self):
+        """
+        The CommitScheduler that commits stored messages.
+        @rtype: CommitScheduler
+        """
+        return self._commit_scheduler
+
+    @property
+    def walker_scheduler(self):
+        """
+        The WalkerScheduler that takes the walk steps of all communities.
+        @rtype: WalkerScheduler
+        """
+        return self._walker_scheduler
+
     @property
     def crypto(self):
         """
@@ -488,21 +548,17 @@ class Dispersy(TaskManager):
 
         # both public and private keys are valid at this point
 
-        # The member is not cached, let's try to get it from the database
-        row = self.database.execute(u"SELECT id, public_key, private_key FROM member WHERE mid = ? LIMIT 1", (buffer(mid),)).fetchone()
+        # The member is not cached, let's try to get it from the member storage
+        row = self._member_storage.get(mid)
 
         if row:
             database_id, public_key_from_db, private_key_from_db = row
 
-            public_key_from_db = "" if public_key_from_db is None else str(public_key_from_db)
-            private_key_from_db = "" if private_key_from_db is None else str(private_key_from_db)
-
             # the private key that was passed as an argument overrules everything, update db if neccesary
             if private_key:
                 assert public_key
                 if private_key_from_db != private_key:
-                    self.database.execute(u"UPDATE member SET public_key = ?, private_key = ? WHERE id = ?",
-                        (buffer(public_key), buffer(private_key), database_id))
+                    self._member_storage.update(database_id, public_key, private_key)
             else:
                 # the private key from the database overrules the public key argument
                 if private_key_from_db:
@@ -511,8 +567,7 @@ class Dispersy(TaskManager):
                 # the public key argument overrules anything in the database
                 elif public_key:
                     if public_key_from_db != public_key:
-                        self.database.execute(u"UPDATE member SET public_key = ? WHERE id = ?",
-                            (buffer(public_key), database_id))
+                        self._member_storage.update(database_id, public_key)
 
                 # no priv/pubkey arguments passed, maybe use the public key from the database
                 elif public_key_from_db:
@@ -526,13 +581,10 @@ class Dispersy(TaskManager):
             if private_key:
                 assert public_key
             # The MID or public/private keys are not in the database, store them.
-            database_id = self.database.execute(
-                u"INSERT INTO member (mid, public_key, private_key) VALUES (?, ?, ?)",
-                (buffer(mid), buffer(public_key), buffer(private_key)), get_lastrowid=True)
+            database_id = self._member_storage.add(mid, public_key, private_key)
         else:
             # We could't find the key on the DB, nothing else to do
-            database_id = self.database.execute(u"INSERT INTO member (mid) VALUES (?)",
-                (buffer(mid),), get_lastrowid=True)
+            database_id = self._member_storage.add(mid)
             return DummyMember(self, database_id, mid)
 
         member = Member(self, key, database_id, mid)
@@ -549,10 +601,29 @@ class Dispersy(TaskManager):
     def get_new_member(self, securitylevel=u"medium"):
         """
         Returns a Member instance created from a newly generated public key.
+
+        The key is taken from the key pool when it has one for SECURITYLEVEL, otherwise it is generated on the
+        reactor thread.
+        """
+        assert isinstance(securitylevel, unicode), type(securitylevel)
+        private_key = self._key_pool.take(securitylevel) if self._key_pool else None
+        if private_key is None:
+            private_key = self.crypto.key_to_bin(self.crypto.generate_key(securitylevel))
+        return self.get_member(private_key=private_key)
+
+    def get_new_member_in_thread(self, securitylevel=u"medium"):
+        """
+        Returns a Deferred that fires with a Member instance created from a newly generated public key.
+
+        The key is taken from the key pool when it has one for SECURITYLEVEL, otherwise it is generated in a thread
+        from the reactor thread pool.
         """
         assert isinstance(securitylevel, unicode), type(securitylevel)
-        key = self.crypto.generate_key(securitylevel)
-        return self.get_member(private_key=self.crypto.key_to_bin(key))
+        private_key = self._key_pool.take(securitylevel) if self._key_pool else None
+        if private_key is None:
+            return self.crypto.generate_key_in_thread(securitylevel).addCallback(
+                lambda key: self.get_member(private_key=self.crypto.key_to_bin(key)))
+        return succeed(self.get_member(private_key=private_key))
 
     def get_member_from_database_id(self, database_id):
         """
@@ -560,11 +631,10 @@ class Dispersy(TaskManager):
         not available.
         """
         assert isinstance(database_id, (int, long)), type(database_id)
-        try:
-            public_key, = next(self._database.execute(u"SELECT public_key FROM member WHERE id = ?", (database_id,)))
-            return self.get_member(public_key=str(public_key))
-        except StopIteration:
-            pass
+        row = self._member_storage.get_by_id(database_id)
+        if row:
+            mid, public_key, _ = row
+            return self.get_member(public_key=public_key) if public_key else self.get_member(mid=mid)
 
     @inlineCallbacks
     def reclassify_community(self, source, destination):
@@ -662,19 +732,19 @@ class Dispersy(TaskManager):
 
         except KeyError:
             if load or auto_load:
-                try:
-                    # have we joined this community
-                    classification, auto_load_flag, master_public_key = self._database.execute(u"SELECT community.classification, community.auto_load, member.public_key FROM community JOIN member ON member.id = community.master WHERE mid = ?",
-                                                                                               (buffer(cid),)).next()
+                # have we joined this community
+                master_row = self._member_storage.get(cid)
+                community_row = master_row and self._database.execute(u"SELECT classification, auto_load FROM community WHERE master = ?",
+                                                                      (master_row[0],)).fetchone()
 
-                except StopIteration:
-                    pass
+                if community_row:
+                    classification, auto_load_flag = community_row
+                    _, master_public_key, _ = master_row
 
-                else:
                     if load or (auto_load and auto_load_flag):
 
                         if classification in self._auto_load_communities:
-                            master = self.get_member(public_key=str(master_public_key)) if master_public_key else self.get_member(mid=cid)
+                            master = self.get_member(public_key=master_public_key) if master_public_key else self.get_member(mid=cid)
                             cls, my_member, args, kargs = self._auto_load_communities[classification]
                             community = cls.init_community(self, master, my_member, *args, **kargs)
                             assert master.mid in self._communities
@@ -706,7 +776,7 @@ class Dispersy(TaskManager):
         assert isinstance(member, Member)
         assert isinstance(global_time, (int, long))
         try:
-            packet, = self._database.execute(u"SELECT packet FROM sync WHERE community = ? AND member = ? AND global_time = ?",
+            packet, = self._database.execute(u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE community = ? AND member = ? AND global_time = ?",
                                              (community.database_id, member.database_id, global_time)).next()
         except StopIteration:
             return None
@@ -718,7 +788,7 @@ class Dispersy(TaskManager):
         assert isinstance(member, Member)
         assert isinstance(meta, Message)
         try:
-            packet, = self._database.execute(u"SELECT packet FROM sync WHERE member = ? AND meta_message = ? ORDER BY global_time DESC LIMIT 1",
+            packet, = self._database.execute(u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE member = ? AND meta_message = ? ORDER BY global_time DESC LIMIT 1",
                                              (member.database_id, meta.database_id)).next()
         except StopIteration:
             return None
@@ -730,12 +800,7 @@ class Dispersy(TaskManager):
         Removes and returns one vote made by VOTER.
         """
         assert isinstance(voter, Candidate)
-        for vote, voters in self._wan_address_votes.iteritems():
-            if voter.sock_addr in voters:
-                voters.remove(voter.sock_addr)
-                if len(voters) == 0:
-                    del self._wan_address_votes[vote]
-                return vote
+        return self._wan_address_votes.unvote(voter.sock_addr)
 
     def wan_address_vote(self, address, voter):
         """
@@ -789,12 +854,12 @@ class Dispersy(TaskManager):
                 self._connection_type = connection_type
                 return True
 
-        # undo previous vote
-        self.wan_address_unvote(voter)
+        votes = self._wan_address_votes
 
         # ensure ADDRESS is valid
         if not is_valid_address(address):
             self._logger.debug("ignore vote for %s from %s (address is invalid)", address, voter.sock_addr)
+            votes.unvote(voter.sock_addr)
             return
 
         # ignore votes from voters that we know are within any of our LAN interfaces.  these voters
@@ -802,11 +867,12 @@ class Dispersy(TaskManager):
 
         if self._address_is_lan(voter.sock_addr[0]):
             self._logger.debug("ignore vote for %s from %s (voter is within our LAN)", address, voter.sock_addr)
+            votes.unvote(voter.sock_addr)
             return
 
-        # do vote
+        # do vote, this replaces the previous vote of VOTER
         self._logger.debug("add vote for %s from %s", address, voter.sock_addr)
-        self._wan_address_votes[address].add(voter.sock_addr)
+        votes.vote(address, voter.sock_addr)
 
         #
         # check self._lan_address and self._wan_address
@@ -814,7 +880,7 @@ class Dispersy(TaskManager):
 
         # change when new vote count is higher than old address vote count (don't use equal to avoid
         # alternating between two equally voted addresses)
-        if len(self._wan_address_votes[address]) > len(self._wan_address_votes.get(self._wan_address, ())):
+        if votes.count(address) > votes.count(self._wan_address):
             if set_wan_address(address):
                 # refresh our LAN address(es), perhaps we are running on a roaming device
                 lan_address = self._get_lan_address()
@@ -830,18 +896,16 @@ class Dispersy(TaskManager):
         # check self._connection_type
         #
 
-        if len(self._wan_address_votes) == 1 and self._lan_address == self._wan_address:
+        if len(votes) == 1 and self._lan_address == self._wan_address:
             # external peers are reporting the same WAN address that happens to be our LAN address
             # as well
             set_connection_type(u"public")
 
-        elif len(self._wan_address_votes) > 1:
-            for voters in self._wan_address_votes.itervalues():
-                if len(set([address[0] for address in voters])) > 1:
-                    # A single NAT mapping has more than one destination IP hence
-                    # it cannot be a symmetric NAT
-                    set_connection_type(u"unknown")
-                    break
+        elif len(votes) > 1:
+            if votes.has_multiple_host_address:
+                # A single NAT mapping has more than one destination IP hence
+                # it cannot be a symmetric NAT
+                set_connection_type(u"unknown")
             else:
                 # Our nat created a new mapping for each destination IP
                 set_connection_type(u"symmetric-NAT")
@@ -862,7 +926,7 @@ class Dispersy(TaskManager):
         assert isinstance(global_time, (int, long)), type(global_time)
 
         try:
-            packet_id, packet, undone = self._database.execute(u"SELECT id, packet, undone FROM sync WHERE community = ? AND member = ? AND global_time = ? LIMIT 1",
+            packet_id, packet, undone = self._database.execute(u"SELECT id, packet, undone FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE community = ? AND member = ? AND global_time = ? LIMIT 1",
                                                        (community.database_id, member.database_id, global_time)).next()
         except StopIteration:
             return None
@@ -886,7 +950,7 @@ class Dispersy(TaskManager):
         assert isinstance(packet_id, (int, long)), type(packet_id)
 
         try:
-            packet, undone = self._database.execute(u"SELECT packet, undone FROM sync WHERE id = ?",
+            packet, undone = self._database.execute(u"SELECT packet, undone FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE id = ?",
                                                        (packet_id,)).next()
         except StopIteration:
             return None
@@ -1018,6 +1082,7 @@ class Dispersy(TaskManager):
         meta = messages[0].meta
         self._logger.debug("attempting to store %d %s messages", len(messages), meta.name)
         is_double_member_authentication = isinstance(meta.authentication, DoubleMemberAuthentication)
+        sync_history = meta.community.sync_history
         highest_global_time = 0
         highest_sequence_number = defaultdict(int)
 
@@ -1035,20 +1100,25 @@ class Dispersy(TaskManager):
 
             # add packet to database
             message.packet_id = self._database.execute(
-                u"INSERT INTO sync (community, member, global_time, meta_message, packet, sequence) "
-                u"VALUES (?, ?, ?, ?, ?, ?)",
+                u"INSERT INTO sync (community, member, global_time, meta_message, sequence) "
+                u"VALUES (?, ?, ?, ?, ?)",
                (message.community.database_id,
                 message.authentication.member.database_id,
                 message.distribution.global_time,
                 message.database_id,
-                buffer(message.packet),
                 (message.distribution.sequence_number if
                  isinstance(meta.distribution, FullSyncDistribution)
                  and message.distribution.enable_sequence_number else None)
                 ), get_lastrowid=True)
+            self._database.execute(u"INSERT INTO sync_packet (sync, packet) VALUES (?, ?)",
+                                   (message.packet_id, buffer(message.packet)))
 
             # ensure that we can reference this packet
             self._logger.debug("stored message %s in database at row %d", message.name, message.packet_id)
+            sync_history.store(message.authentication.member.database_id, meta, message.distribution.global_time,
+                               message.distribution.sequence_number if
+                               isinstance(meta.distribution, FullSyncDistribution)
+                               and message.distribution.enable_sequence_number else 0)
 
             if is_double_member_authentication:
                 member1 = message.authentication.members[0].database_id
@@ -1088,22 +1158,27 @@ class Dispersy(TaskManager):
 SELECT sync.id, sync.global_time
 FROM sync
 JOIN double_signed_sync ON double_signed_sync.sync = sync.id
+JOIN sync_packet ON sync_packet.sync = sync.id
 WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed_sync.member2 = ?
-ORDER BY sync.global_time, sync.packet""", (meta.database_id, member1, member2)))
+ORDER BY sync.global_time, sync_packet.packet""", (meta.database_id, member1, member2)))
                         if len(all_items) > meta.distribution.history_size:
                             items.update(all_items[:len(all_items) - meta.distribution.history_size])
 
                 else:
+                    # the sync history cache knows the stored global times, only the obsolete packets need to
+                    # touch the database
                     for member_database_id in set(message.authentication.member.database_id for message in messages):
-                        all_items = list(self._database.execute(u"""
-SELECT id, global_time
-FROM sync
-WHERE meta_message = ? AND member = ?
-ORDER BY global_time""", (meta.database_id, member_database_id)))
-                        if len(all_items) > meta.distribution.history_size:
-                            items.update(all_items[:len(all_items) - meta.distribution.history_size])
+                        global_times = sync_history.get_global_times(member_database_id, meta)
+                        if len(global_times) > meta.distribution.history_size:
+                            obsolete = global_times[:len(global_times) - meta.distribution.history_size]
+                            self._database.executemany(
+                                u"DELETE FROM sync WHERE community = ? AND member = ? AND global_time = ?",
+                                [(meta.community.database_id, member_database_id, global_time) for global_time in obsolete])
+                            sync_history.remove(member_database_id, meta, obsolete)
 
             if items:
+                # a custom callback or double member authentication may remove packets from any member
+                sync_history.invalidate(meta=meta)
                 self._database.executemany(u"DELETE FROM sync WHERE id = ?", [(syncid,) for syncid, _ in items])
 
                 if is_double_member_authentication:
@@ -1118,6 +1193,10 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                         history_size, = self._database.execute(u"SELECT COUNT(*) FROM sync WHERE meta_message = ? AND member = ?", (message.database_id, message.authentication.member.database_id)).next()
                         assert history_size <= message.distribution.history_size, [history_size, message.distribution.history_size, message.authentication.member.database_id]
 
+        # the stored filter must contain every stored message, the duplicate checks rely on it
+        meta.community.update_stored_filter([(message.authentication.member.database_id,
+                                              message.distribution.global_time) for message in messages])
+
         # update the global time
         meta.community.update_global_time(highest_global_time)
 
@@ -1165,8 +1244,10 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         To reduce the disk activity, namely syncing the database to disk, we will perform the
         database commit not after the (1) store operation but after the (2) update operation.  This
         will ensure that any database changes from handling the message are also synced to disk.  It
-        is important to note that the sync will occur before the (3) forward operation to ensure
-        that no remote nodes will obtain data that we have not safely synced ourselves.
+        is important to note that, for messages created by my_member, the sync will occur before the
+        (3) forward operation to ensure that no remote nodes will obtain data that we have not safely
+        synced ourselves.  Other messages are committed by the CommitScheduler, which coalesces the
+        commits of many batches.
 
         For performance reasons messages are processed in batches, where each batch contains only
         messages from the same community and the same meta message instance.  This method, or more
@@ -1222,10 +1303,13 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
             my_messages = sum(message.authentication.member == message.community.my_member for message in messages)
             if my_messages:
                 self._logger.debug("commit user generated message")
-                self._database.commit()
+                self._commit_scheduler.commit()
 
                 messages[0].community.statistics.increase_msg_count(u"created", messages[0].meta.name, my_messages)
 
+            else:
+                self._commit_scheduler.add(len(messages))
+
         if forward:
             return self._forward(messages)
 
@@ -1339,7 +1423,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
             for message in messages:
                 if message.meta.name == u"dispersy-introduction-request":
                     for candidate in candidates:
-                        message.community.statistics.msg_statistics.walk_attempt_count += 1
+                        message.community.statistics.msg_statistics.get_counter(u"walk_attempt").increment()
                         message.community.statistics.increase_msg_count(u"outgoing_intro", candidate.sock_addr)
 
                         self.statistics.walk_attempt_count += 1
@@ -1393,17 +1477,15 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                 # ensure that the dispersy-identity for my member must be in the database
                 meta_identity = community.get_meta_message(u"dispersy-identity")
 
-                try:
-                    member_id, = self._database.execute(u"SELECT id FROM member WHERE mid = ?", (buffer(community.my_member.mid),)).next()
-                except StopIteration:
+                row = self._member_storage.get(community.my_member.mid)
+                if not row:
                     raise ValueError("unable to find the public key for my member")
+                member_id, _, private_key = row
 
                 if not member_id == community.my_member.database_id:
                     raise ValueError("my member's database id is invalid", member_id, community.my_member.database_id)
 
-                try:
-                    self._database.execute(u"SELECT 1 FROM member WHERE id = ? AND private_key IS NOT NULL", (member_id,)).next()
-                except StopIteration:
+                if not private_key:
                     raise ValueError("unable to find the private key for my member")
 
                 try:
@@ -1432,7 +1514,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                 meta_undo_other = community.get_meta_message(u"dispersy-undo-other")
 
                 # TODO we are not taking into account that undo messages can be undone
-                for undo_packet_id, undo_packet_global_time, undo_packet in select(u"SELECT id, global_time, packet FROM sync WHERE community = ? AND meta_message = ? ORDER BY id LIMIT ? OFFSET ?", (community.database_id, meta_undo_other.database_id)):
+                for undo_packet_id, undo_packet_global_time, undo_packet in select(u"SELECT id, global_time, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE community = ? AND meta_message = ? ORDER BY id LIMIT ? OFFSET ?", (community.database_id, meta_undo_other.database_id)):
                     undo_packet = str(undo_packet)
                     undo_message = self.convert_packet_to_message(undo_packet, community, verify=False)
 
@@ -1443,7 +1525,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
 
                     # get the message that undo_message refers to
                     try:
-                        packet, undone = self._database.execute(u"SELECT packet, undone FROM sync WHERE community = ? AND member = ? AND global_time = ?", (community.database_id, undo_message.payload.member.database_id, undo_message.payload.global_time)).next()
+                        packet, undone = self._database.execute(u"SELECT packet, undone FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE community = ? AND member = ? AND global_time = ?", (community.database_id, undo_message.payload.member.database_id, undo_message.payload.global_time)).next()
                     except StopIteration:
                         raise ValueError("found dispersy-undo-other but not the message that it refers to")
                     packet = str(packet)
@@ -1480,7 +1562,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
             # ensure all packets in the database are valid and that the binary packets are consistent
             # with the information stored in the database
             #
-            for packet_id, member_id, global_time, meta_message_id, packet in select(u"SELECT id, member, global_time, meta_message, packet FROM sync WHERE community = ? ORDER BY id LIMIT ? OFFSET ?", (community.database_id,)):
+            for packet_id, member_id, global_time, meta_message_id, packet in select(u"SELECT id, member, global_time, meta_message, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE community = ? ORDER BY id LIMIT ? OFFSET ?", (community.database_id,)):
                 if meta_message_id in enabled_messages:
                     packet = str(packet)
                     message = self.convert_packet_to_message(packet, community, verify=True)
@@ -1514,7 +1596,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                     counter = 0
                     counter_member_id = 0
                     exception = None
-                    for packet_id, member_id, packet in select(u"SELECT id, member, packet FROM sync WHERE meta_message = ? ORDER BY member, global_time LIMIT ? OFFSET ?", (meta.database_id,)):
+                    for packet_id, member_id, packet in select(u"SELECT id, member, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message = ? ORDER BY member, global_time LIMIT ? OFFSET ?", (meta.database_id,)):
                         packet = str(packet)
                         message = self.convert_packet_to_message(packet, community, verify=False)
                         assert message
@@ -1548,7 +1630,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                     if isinstance(meta.authentication, MemberAuthentication):
                         counter = 0
                         counter_member_id = 0
-                        for packet_id, member_id, packet in select(u"SELECT id, member, packet FROM sync WHERE meta_message = ? ORDER BY member ASC, global_time DESC LIMIT ? OFFSET ?", (meta.database_id,)):
+                        for packet_id, member_id, packet in select(u"SELECT id, member, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message = ? ORDER BY member ASC, global_time DESC LIMIT ? OFFSET ?", (meta.database_id,)):
                             message = self.convert_packet_to_message(str(packet), community, verify=False)
                             assert message
 
@@ -1565,7 +1647,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
 
                     else:
                         assert isinstance(meta.authentication, DoubleMemberAuthentication)
-                        for packet_id, member_id, packet in select(u"SELECT id, member, packet FROM sync WHERE meta_message = ? ORDER BY member ASC, global_time DESC LIMIT ? OFFSET ?", (meta.database_id,)):
+                        for packet_id, member_id, packet in select(u"SELECT id, member, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message = ? ORDER BY member ASC, global_time DESC LIMIT ? OFFSET ?", (meta.database_id,)):
                             message = self.convert_packet_to_message(str(packet), community, verify=False)
                             assert message
 
@@ -1589,8 +1671,8 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         Periodically called to commit database changes to disk.
         """
         try:
-            # flush changes to disk every 1 minutes
-            self._database.commit()
+            # flush changes that were not reported to the commit scheduler to disk every 1 minutes
+            self._commit_scheduler.commit()
 
         except Exception as exception:
             # OperationalError: database is locked
@@ -1643,6 +1725,9 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
 
                 # TODO: pass None instead of new member, let community decide if we need a new member or not.
                 self._discovery_community = self.define_auto_load(DiscoveryCommunity, self.get_new_member(), load=True)[0]
+
+            if self._key_pool:
+                self._key_pool.start()
             return True
 
         else:
@@ -1715,6 +1800,13 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                                 if community.get_classification() == classification])
 
 
+        self._walker_scheduler.cancel_all_pending_tasks()
+        # the database commits when it is closed
+        self._commit_scheduler.cancel_all_pending_tasks()
+
+        if self._key_pool:
+            yield self._key_pool.stop()
+
         # stop endpoint
         results[u"endpoint"] = maybeDeferred(self._endpoint.close, timeout)
 
@@ -6,13 +6,15 @@ This module provides an interface to the Dispersy database.
 @contact: dispersy@frayja.com
 """
 
+import sys
 from itertools import groupby
+from sqlite3 import OperationalError
 
 from .database import Database
 from .distribution import FullSyncDistribution
 
 
-LATEST_VERSION = 21
+LATEST_VERSION = 22
 
 schema = u"""
 CREATE TABLE member(
@@ -57,11 +59,17 @@ CREATE TABLE sync(
  global_time INTEGER,
  meta_message INTEGER REFERENCES meta_message(id),
  undone INTEGER DEFAULT 0,
- packet BLOB,
  sequence INTEGER,
  UNIQUE(community, member, global_time));
 CREATE INDEX sync_meta_message_undone_global_time_index ON sync(meta_message, undone, global_time);
-CREATE INDEX sync_meta_message_member ON sync(meta_message, member);
+CREATE INDEX sync_meta_message_member_global_time_index ON sync(meta_message, member, global_time);
+CREATE INDEX sync_meta_message_member_sequence_index ON sync(meta_message, member, sequence, global_time);
+
+-- the packets are stored apart from the sync table, hence queries that only use the sync columns read far fewer pages
+CREATE TABLE sync_packet(
+ sync INTEGER PRIMARY KEY REFERENCES sync(id),
+ packet BLOB);
+CREATE TRIGGER sync_packet_delete AFTER DELETE ON sync BEGIN DELETE FROM sync_packet WHERE sync = OLD.id; END;
 
 CREATE TABLE option(key TEXT PRIMARY KEY, value BLOB);
 INSERT INTO option(key, value) VALUES('database_version', '""" + str(LATEST_VERSION) + """');
@@ -253,11 +261,77 @@ UPDATE option SET value = '21' WHERE key = 'database_version';""")
                 self.commit()
                 self._logger.debug("upgrade database %d -> %d (done)", database_version, 21)
 
-            new_db_version = 22
+            # Upgrade from 21 to 22
+            if database_version < 22:
+                # move the packets from the sync table into the sync_packet table and replace the
+                # sync_meta_message_member index with covering indexes.  the sync table is rebuilt, hence the
+                # upgrade runs in a single transaction: when it is interrupted the database remains at version 21
+                self._logger.debug("upgrade database %d -> %d", database_version, 22)
+                try:
+                    self.executescript(u"""
+BEGIN;
+
+DROP INDEX IF EXISTS sync_meta_message_undone_global_time_index;
+DROP INDEX IF EXISTS sync_meta_message_member;
+DROP TABLE IF EXISTS sync_packet;
+DROP TABLE IF EXISTS sync_new;
+
+CREATE TABLE sync_packet(
+ sync INTEGER PRIMARY KEY REFERENCES sync(id),
+ packet BLOB);
+
+INSERT INTO sync_packet(sync, packet) SELECT id, packet FROM sync ORDER BY id;
+
+CREATE TABLE sync_new(
+ id INTEGER PRIMARY KEY AUTOINCREMENT,
+ community INTEGER REFERENCES community(id),
+ member INTEGER REFERENCES member(id),                  -- the creator of the message
+ global_time INTEGER,
+ meta_message INTEGER REFERENCES meta_message(id),
+ undone INTEGER DEFAULT 0,
+ sequence INTEGER,
+ UNIQUE(community, member, global_time));
+
+INSERT OR IGNORE INTO sync_new(id, community, member, global_time, meta_message, undone, sequence)
+  SELECT id, community, member, global_time, meta_message, undone, sequence FROM sync ORDER BY id;
+
+-- keep the AUTOINCREMENT high-water mark, ids of removed rows must not be used again
+INSERT INTO sqlite_sequence(name, seq)
+  SELECT 'sync_new', 0 WHERE NOT EXISTS (SELECT * FROM sqlite_sequence WHERE name = 'sync_new');
+UPDATE sqlite_sequence SET seq = MAX(seq, IFNULL((SELECT MAX(seq) FROM sqlite_sequence WHERE name = 'sync'), 0))
+  WHERE name = 'sync_new';
+
+DROP TABLE sync;
+ALTER TABLE sync_new RENAME TO sync;
+
+CREATE INDEX sync_meta_message_undone_global_time_index ON sync(meta_message, undone, global_time);
+CREATE INDEX sync_meta_message_member_global_time_index ON sync(meta_message, member, global_time);
+CREATE INDEX sync_meta_message_member_sequence_index ON sync(meta_message, member, sequence, global_time);
+CREATE TRIGGER sync_packet_delete AFTER DELETE ON sync BEGIN DELETE FROM sync_packet WHERE sync = OLD.id; END;
+
+-- packets of rows that were not copied, i.e. duplicates left behind by the 19 -> 20 upgrade
+DELETE FROM sync_packet WHERE sync NOT IN (SELECT id FROM sync);
+
+UPDATE option SET value = '22' WHERE key = 'database_version';
+
+COMMIT;""")
+                except:
+                    exc_info = sys.exc_info()
+                    # executescript would commit the partial upgrade before running ROLLBACK
+                    try:
+                        self._cursor.execute(u"ROLLBACK")
+                    except OperationalError:
+                        # SQLite already rolled back the transaction
+                        pass
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                self.commit()
+                self._logger.debug("upgrade database %d -> %d (done)", database_version, 22)
+
+            new_db_version = 23
             if database_version < new_db_version:
                 # there is no version new_db_version yet...
                 # self._logger.debug("upgrade database %d -> %d", database_version, new_db_version)
-                # self.executescript(u"""UPDATE option SET value = '22' WHERE key = 'database_version';""")
+                # self.executescript(u"""UPDATE option SET value = '23' WHERE key = 'database_version';""")
                 # self.commit()
                 # self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
                 pass
@@ -328,7 +402,7 @@ UPDATE option SET value = '21' WHERE key = 'database_version';""")
 
             sequence_updates = []
             for meta in metas:
-                rows = list(self.execute(u"SELECT id, member, packet FROM sync "
+                rows = list(self.execute(u"SELECT id, member, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id "
                                          u"WHERE meta_message = ? ORDER BY member, global_time", (meta.database_id,)))
                 groups = groupby(rows, key=lambda tup: tup[1])
                 for member_id, iterator in groups:
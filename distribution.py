@@ -15,16 +15,28 @@ global_time.
 """
 
 from abc import ABCMeta, abstractmethod
+from bisect import insort
+from collections import OrderedDict
+
 from .authentication import DoubleMemberAuthentication, MemberAuthentication
 from .candidate import WalkCandidate
 from .meta import MetaObject
 from .util import attach_runtime_statistics
 
+# the number of (member, global_time) pairs resolved in one query, each pair uses three of the 999 host parameters
+# that SQLite allows
+STORED_PACKETS_BATCH_SIZE = 300
+
+# the number of (member, meta message) entries kept by a SyncHistoryCache
+SYNC_HISTORY_CACHE_SIZE = 10000
+
 
 class Pruning(MetaObject):
 
     class Implementation(MetaObject.Implementation):
 
+        __slots__ = ("_distribution",)
+
         __metaclass__ = ABCMeta
 
         def __init__(self, meta, distribution):
@@ -58,6 +70,8 @@ class NoPruning(Pruning):
 
     class Implementation(Pruning.Implementation):
 
+        __slots__ = ()
+
         def is_active(self):
             return True
 
@@ -72,6 +86,8 @@ class GlobalTimePruning(Pruning):
 
     class Implementation(Pruning.Implementation):
 
+        __slots__ = ()
+
         @property
         def inactive_threshold(self):
             return self._meta.inactive_threshold
@@ -121,6 +137,8 @@ class Distribution(MetaObject):
 
     class Implementation(MetaObject.Implementation):
 
+        __slots__ = ("_global_time",)
+
         def __init__(self, meta, global_time):
             assert isinstance(meta, Distribution)
             assert isinstance(global_time, (int, long))
@@ -164,6 +182,8 @@ class SyncDistribution(Distribution):
 
     class Implementation(Distribution.Implementation):
 
+        __slots__ = ("_pruning",)
+
         def __init__(self, meta, global_time):
             super(SyncDistribution.Implementation, self).__init__(meta, global_time)
             self._pruning = meta.pruning.Implementation(meta.pruning, self)
@@ -250,10 +270,43 @@ class SyncDistribution(Distribution):
         cache["priority"] = self._priority
         cache["direction"] = self.synchronization_direction_value
 
-    def _is_duplicate_sync_message(self, dispersy, message):
+    def _fetch_stored_packets(self, dispersy, messages):
+        """
+        Returns a dictionary with (packet, undone) for each (member, global_time) of MESSAGES that is already stored.
+
+        Most incoming messages are new.  Keys that are not in the community stored_filter are certainly not in the
+        database and are never queried, the remaining keys are resolved in batches of STORED_PACKETS_BATCH_SIZE using
+        the UNIQUE(community, member, global_time) index.
+        """
+        if not messages:
+            return {}
+
+        community = messages[0].community
+        stored_filter = community.stored_filter
+        keys = [key for key in set((message.authentication.member.database_id, message.distribution.global_time)
+                                   for message in messages)
+                if key in stored_filter]
+
+        stored = {}
+        for offset in xrange(0, len(keys), STORED_PACKETS_BATCH_SIZE):
+            batch = keys[offset:offset + STORED_PACKETS_BATCH_SIZE]
+            parameters = []
+            for member_database_id, global_time in batch:
+                parameters.extend((community.database_id, member_database_id, global_time))
+
+            for member_database_id, global_time, packet, undone in dispersy._database.execute(
+                    u"SELECT member, global_time, packet, undone FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE " +
+                    u" OR ".join([u"(community = ? AND member = ? AND global_time = ?)"] * len(batch)), parameters):
+                stored[(member_database_id, global_time)] = (str(packet), undone)
+        return stored
+
+    def _is_duplicate_sync_message(self, dispersy, message, stored=None):
         """
         Returns True when this message is a duplicate, otherwise the message must be processed.
 
+        STORED is the result of _fetch_stored_packets for a batch that includes MESSAGE, when it is not given the
+        message is looked up by itself.
+
         === Problem: duplicate message ===
         The simplest reason to drop an incoming message is when we already have it, based on the
         community, member, and global time.  No further action is performed.
@@ -286,16 +339,18 @@ class SyncDistribution(Distribution):
         until the bloom filter is synced with the database again.
         """
         community = message.community
+        if stored is None:
+            stored = self._fetch_stored_packets(dispersy, [message])
+
         # fetch the duplicate binary packet from the database
+        key = (message.authentication.member.database_id, message.distribution.global_time)
         try:
-            have_packet, undone = dispersy._database.execute(u"SELECT packet, undone FROM sync WHERE community = ? AND member = ? AND global_time = ?",
-                                                        (community.database_id, message.authentication.member.database_id, message.distribution.global_time)).next()
-        except StopIteration:
+            have_packet, undone = stored[key]
+        except KeyError:
             dispersy._logger.debug("this message is not a duplicate")
             return False
 
         else:
-            have_packet = str(have_packet)
             if have_packet == message.packet:
                 # exact binary duplicate, do NOT process the message
                 dispersy._logger.warning("received identical message %s %d@%d from %s %s",
@@ -307,7 +362,7 @@ class SyncDistribution(Distribution):
 
                 if undone:
                     try:
-                        proof, = dispersy._database.execute(u"SELECT packet FROM sync WHERE id = ?", (undone,)).next()
+                        proof, = dispersy._database.execute(u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE id = ?", (undone,)).next()
                     except StopIteration:
                         pass
                     else:
@@ -326,8 +381,10 @@ class SyncDistribution(Distribution):
 
                     if have_packet < message.packet:
                         # replace our current message with the other one
-                        dispersy._database.execute(u"UPDATE sync SET packet = ? WHERE community = ? AND member = ? AND global_time = ?",
+                        dispersy._database.execute(u"UPDATE sync_packet SET packet = ? WHERE sync = "
+                                                   u"(SELECT id FROM sync WHERE community = ? AND member = ? AND global_time = ?)",
                                                (buffer(message.packet), community.database_id, message.authentication.member.database_id, message.distribution.global_time))
+                        stored[key] = (message.packet, undone)
 
                         # notify that global times have changed
                         # community.update_sync_range(message.meta, [message.distribution.global_time])
@@ -340,6 +397,119 @@ class SyncDistribution(Distribution):
             return True
 
 
+class SyncHistoryCache(object):
+
+    """
+    Write-through cache with the state of the sync table for (member, meta message) pairs.
+
+    Each entry holds the highest global time, the highest sequence number and, for messages with the
+    LastSyncDistribution policy, the sorted global times of the messages that are stored.  Entries are loaded from the
+    database when first needed and are kept up to date by Dispersy._store.  Code that removes messages from the sync
+    table in any other way must call invalidate.
+
+    At most SIZE entries are kept, the least recently used entry is removed first.
+    """
+
+    class Entry(object):
+
+        __slots__ = ["global_time", "sequence_number", "global_times"]
+
+        def __init__(self, global_time, sequence_number, global_times):
+            self.global_time = global_time
+            self.sequence_number = sequence_number
+            self.global_times = global_times
+
+    def __init__(self, community, size=SYNC_HISTORY_CACHE_SIZE):
+        assert isinstance(size, int), type(size)
+        assert 0 < size, size
+        self._community = community
+        self._size = size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, member_database_id, meta):
+        key = (member_database_id, meta.database_id)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            entry = self._load(member_database_id, meta)
+            if len(self._entries) >= self._size:
+                self._entries.popitem(last=False)
+        self._entries[key] = entry
+        return entry
+
+    def _load(self, member_database_id, meta):
+        execute = self._community.dispersy.database.execute
+        if isinstance(meta.distribution, LastSyncDistribution):
+            global_times = sorted(global_time for global_time, in
+                                  execute(u"SELECT global_time FROM sync WHERE community = ? AND member = ? AND meta_message = ?",
+                                          (self._community.database_id, member_database_id, meta.database_id)))
+            return self.Entry(global_times[-1] if global_times else 0, 0, global_times)
+
+        global_time, sequence_number, count = execute(
+            u"SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
+            (member_database_id, meta.database_id)).next()
+        assert not meta.distribution.enable_sequence_number or (sequence_number or 0) == count, \
+            [sequence_number, count, meta.name]
+        return self.Entry(global_time or 0, sequence_number or 0, None)
+
+    def get_highest(self, member_database_id, meta):
+        """
+        Returns the (global_time, sequence_number) of the most recent stored META message created by the member.
+
+        Both are zero when no such message is stored.
+        """
+        entry = self._get(member_database_id, meta)
+        return entry.global_time, entry.sequence_number
+
+    def get_global_times(self, member_database_id, meta):
+        """
+        Returns a new, sorted, list with the global times of the stored META messages created by the member.
+
+        META must use the LastSyncDistribution policy.
+        """
+        assert isinstance(meta.distribution, LastSyncDistribution), meta.name
+        return list(self._get(member_database_id, meta).global_times)
+
+    def store(self, member_database_id, meta, global_time, sequence_number=0):
+        """
+        Called after a META message created by the member is stored.
+        """
+        entry = self._entries.get((member_database_id, meta.database_id))
+        # entries that are not cached are loaded from the database, which already contains this message
+        if entry is not None:
+            entry.global_time = max(entry.global_time, global_time)
+            entry.sequence_number = max(entry.sequence_number, sequence_number)
+            if entry.global_times is not None:
+                insort(entry.global_times, global_time)
+
+    def remove(self, member_database_id, meta, global_times):
+        """
+        Called after the META messages created by the member at GLOBAL_TIMES are removed.
+        """
+        entry = self._entries.get((member_database_id, meta.database_id))
+        if entry is not None:
+            if entry.global_times is None:
+                del self._entries[(member_database_id, meta.database_id)]
+            else:
+                global_times = set(global_times)
+                entry.global_times = [global_time for global_time in entry.global_times if not global_time in global_times]
+                entry.global_time = entry.global_times[-1] if entry.global_times else 0
+
+    def invalidate(self, member_database_id=None, meta=None):
+        """
+        Removes the entries for MEMBER_DATABASE_ID and/or META, or all entries when neither is given.
+        """
+        if member_database_id is None and meta is None:
+            self._entries.clear()
+        else:
+            for key in [key for key in self._entries
+                        if (member_database_id is None or key[0] == member_database_id) and
+                        (meta is None or key[1] == meta.database_id)]:
+                del self._entries[key]
+
+
 class FullSyncDistribution(SyncDistribution):
 
     """
@@ -357,6 +527,8 @@ class FullSyncDistribution(SyncDistribution):
     """
     class Implementation(SyncDistribution.Implementation):
 
+        __slots__ = ("_sequence_number",)
+
         def __init__(self, meta, global_time, sequence_number=0):
             assert isinstance(sequence_number, (int, long))
             assert (meta._enable_sequence_number and sequence_number > 0) or (not meta._enable_sequence_number and sequence_number == 0), (meta._enable_sequence_number, sequence_number)
@@ -423,16 +595,17 @@ class FullSyncDistribution(SyncDistribution):
         # refuse messages where the global time is unreasonably high
         acceptable_global_time = messages[0].community.acceptable_global_time
 
+        # resolve the duplicate checks for the whole batch at once
+        stored = self._fetch_stored_packets(dispersy, messages)
+
         if enable_sequence_number:
             # obtain the highest sequence_number from the database
+            sync_history = messages[0].community.sync_history
             highest = {}
             for message in messages:
                 if not message.authentication.member.database_id in highest:
-                    last_global_time, last_seq, count = execute(
-                        u"SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
-                        (message.authentication.member.database_id, message.database_id)).next()
-                    highest[message.authentication.member.database_id] = (last_global_time or 0, last_seq or 0)
-                    assert last_seq or 0 == count, [last_seq, count, message.name]
+                    highest[message.authentication.member.database_id] = sync_history.get_highest(
+                        message.authentication.member.database_id, message.meta)
 
             # all messages must follow the sequence_number order
             for message in messages:
@@ -458,7 +631,7 @@ class FullSyncDistribution(SyncDistribution):
 
                     # fetch the corresponding packet from the database (it should be binary identical)
                     global_time, packet = execute(
-                        u"SELECT global_time, packet FROM sync WHERE member = ? AND meta_message = ? ORDER BY global_time, packet LIMIT 1 OFFSET ?",
+                        u"SELECT global_time, packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE member = ? AND meta_message = ? ORDER BY global_time, packet LIMIT 1 OFFSET ?",
                         (message.authentication.member.database_id, message.database_id,
                          message.distribution.sequence_number - 1)).next()
                     packet = str(packet)
@@ -481,13 +654,14 @@ class FullSyncDistribution(SyncDistribution):
                             # TODO we should undo the messages that we are about to remove (when applicable)
                             execute(u"DELETE FROM sync WHERE member = ? AND meta_message = ? AND global_time >= ?",
                                     (message.authentication.member.database_id, message.database_id, global_time))
+                            for key in [key for key in stored
+                                        if key[0] == message.authentication.member.database_id and key[1] >= global_time]:
+                                del stored[key]
 
                             # by deleting messages we changed SEQ and the HIGHEST cache
-                            last_global_time, last_seq, count = execute(
-                                u"SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
-                                (message.authentication.member.database_id, message.database_id)).next()
-                            highest[message.authentication.member.database_id] = (last_global_time or 0, last_seq or 0)
-                            assert last_seq or 0 == count, [last_seq, count, message.name]
+                            sync_history.invalidate(message.authentication.member.database_id, message.meta)
+                            highest[message.authentication.member.database_id] = sync_history.get_highest(
+                                message.authentication.member.database_id, message.meta)
                             # we can allow MESSAGE to be processed
 
                 elif seq + 1 != message.distribution.sequence_number:
@@ -497,7 +671,7 @@ class FullSyncDistribution(SyncDistribution):
 
                 # we have the previous message, check for duplicates based on community,
                 # member, and global_time
-                if self._is_duplicate_sync_message(dispersy, message):
+                if self._is_duplicate_sync_message(dispersy, message, stored):
                     # we have the previous message (drop)
                     yield DropMessage(message, "duplicate message by global_time (1)")
                     continue
@@ -531,7 +705,7 @@ class FullSyncDistribution(SyncDistribution):
                 unique.add(key)
 
                 # check for duplicates based on community, member, and global_time
-                if self._is_duplicate_sync_message(dispersy, message):
+                if self._is_duplicate_sync_message(dispersy, message, stored):
                     # we have the previous message (drop)
                     yield DropMessage(message, "duplicate message by global_time (2)")
                     continue
@@ -544,6 +718,8 @@ class LastSyncDistribution(SyncDistribution):
 
     class Implementation(SyncDistribution.Implementation):
 
+        __slots__ = ()
+
         @property
         def history_size(self):
             return self._meta._history_size
@@ -605,12 +781,13 @@ class LastSyncDistribution(SyncDistribution):
                               (MemberAuthentication.Implementation, DoubleMemberAuthentication.Implementation)) for
                    message in messages)
 
-        def check_member_and_global_time(unique, times, message):
+        def check_member_and_global_time(unique, times, stored, message):
             """
             The member + global_time combination must always be unique in the database
             """
             assert isinstance(unique, set)
             assert isinstance(times, dict)
+            assert isinstance(stored, dict)
             assert isinstance(message, Message.Implementation)
             assert isinstance(message.distribution, LastSyncDistribution.Implementation)
 
@@ -622,18 +799,14 @@ class LastSyncDistribution(SyncDistribution):
                 unique.add(key)
 
                 if not message.authentication.member.database_id in times:
-                    times[message.authentication.member.database_id] = [global_time for global_time, in
-                                                                        dispersy._database.execute(
-                                                                            u"SELECT global_time FROM sync WHERE community = ? AND member = ? AND meta_message = ?",
-                                                                            (message.community.database_id,
-                                                                             message.authentication.member.database_id,
-                                                                             message.database_id))]
+                    times[message.authentication.member.database_id] = message.community.sync_history.get_global_times(
+                        message.authentication.member.database_id, message.meta)
                     assert len(times[message.authentication.member.database_id]) <= message.distribution.history_size, [
                         message.packet_id, message.distribution.history_size,
                         times[message.authentication.member.database_id]]
                 tim = times[message.authentication.member.database_id]
 
-                if message.distribution.global_time in tim and self._is_duplicate_sync_message(dispersy, message):
+                if message.distribution.global_time in tim and self._is_duplicate_sync_message(dispersy, message, stored):
                     return DropMessage(message, "duplicate message by member^global_time (3)")
 
                 elif len(tim) >= message.distribution.history_size and min(tim) > message.distribution.global_time:
@@ -644,7 +817,7 @@ class LastSyncDistribution(SyncDistribution):
                     if message.distribution.history_size == 1:
                         try:
                             packet, = dispersy._database.execute(
-                                u"SELECT packet FROM sync WHERE community = ? AND member = ? ORDER BY global_time DESC LIMIT 1",
+                                u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE community = ? AND member = ? ORDER BY global_time DESC LIMIT 1",
                                 (message.community.database_id, message.authentication.member.database_id)).next()
                         except StopIteration:
                             # TODO can still fail when packet is in one of the received messages
@@ -661,13 +834,14 @@ class LastSyncDistribution(SyncDistribution):
                     tim.append(message.distribution.global_time)
                     return message
 
-        def check_double_member_and_global_time(unique, times, message):
+        def check_double_member_and_global_time(unique, times, stored, message):
             """
             No other message may exist with this message.authentication.members / global_time
             combination, regardless of the ordering of the members
             """
             assert isinstance(unique, set)
             assert isinstance(times, dict)
+            assert isinstance(stored, dict)
             assert isinstance(message, Message.Implementation)
             assert isinstance(message.authentication, DoubleMemberAuthentication.Implementation)
 
@@ -691,7 +865,7 @@ class LastSyncDistribution(SyncDistribution):
                 else:
                     unique.add(key)
 
-                    if self._is_duplicate_sync_message(dispersy, message):
+                    if self._is_duplicate_sync_message(dispersy, message, stored):
                         # we have the previous message (drop)
                         dispersy._logger.debug("drop %s %s@%d (_is_duplicate_sync_message)",
                                            message.name, members, message.distribution.global_time)
@@ -705,9 +879,10 @@ class LastSyncDistribution(SyncDistribution):
                         times[members] = dict((global_time, (packet_id, str(packet)))
                                               for global_time, packet_id, packet
                                               in dispersy._database.execute(u"""
-    SELECT sync.global_time, sync.id, sync.packet
+    SELECT sync.global_time, sync.id, sync_packet.packet
     FROM sync
     JOIN double_signed_sync ON double_signed_sync.sync = sync.id
+    JOIN sync_packet ON sync_packet.sync = sync.id
     WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed_sync.member2 = ?
     """,
                                                                         (message.database_id,) + members))
@@ -744,9 +919,14 @@ class LastSyncDistribution(SyncDistribution):
 
                                 if have_packet < message.packet:
                                     # replace our current message with the other one
-                                    dispersy._database.execute(u"UPDATE sync SET member = ?, packet = ? WHERE id = ?",
-                                                           (message.authentication.member.database_id,
-                                                            buffer(message.packet), packet_id))
+                                    dispersy._database.execute(u"UPDATE sync SET member = ? WHERE id = ?",
+                                                           (message.authentication.member.database_id, packet_id))
+                                    dispersy._database.execute(u"UPDATE sync_packet SET packet = ? WHERE sync = ?",
+                                                           (buffer(message.packet), packet_id))
+                                    # the packet is now stored under a different member
+                                    message.community.update_stored_filter([(message.authentication.member.database_id,
+                                                                             message.distribution.global_time)])
+                                    message.community.sync_history.invalidate(meta=message.meta)
 
                                     return DropMessage(message,
                                                        "replaced existing packet with other packet with the same payload")
@@ -815,8 +995,11 @@ class LastSyncDistribution(SyncDistribution):
             # function
             unique = set()
             times = {}
+            stored = self._fetch_stored_packets(dispersy, [message for message in messages
+                                                           if isinstance(message, Message.Implementation)])
             messages = [
-                message if isinstance(message, DropMessage) else check_member_and_global_time(unique, times, message)
+                message if isinstance(message, DropMessage) else check_member_and_global_time(unique, times, stored,
+                                                                                              message)
                 for message in messages]
 
         # instead of storing HISTORY_SIZE messages for each authentication.member, we will store
@@ -825,10 +1008,12 @@ class LastSyncDistribution(SyncDistribution):
             assert isinstance(meta.authentication, DoubleMemberAuthentication)
             unique = set()
             times = {}
+            stored = self._fetch_stored_packets(dispersy, [message for message in messages
+                                                           if isinstance(message, Message.Implementation)])
             messages = [
                 message if isinstance(message, DropMessage) else check_double_member_and_global_time(unique, times,
-                                                                                                     message) for
-                message in messages]
+                                                                                                     stored, message)
+                for message in messages]
 
         return messages
 
@@ -836,7 +1021,7 @@ class LastSyncDistribution(SyncDistribution):
 class DirectDistribution(Distribution):
 
     class Implementation(Distribution.Implementation):
-        pass
+        __slots__ = ()
 
     @attach_runtime_statistics(u"{0.__class__.__name__}._check_distribution direct")
     def check_batch(self, dispersy, messages):
@@ -877,4 +1062,4 @@ class DirectDistribution(Distribution):
 class RelayDistribution(Distribution):
 
     class Implementation(Distribution.Implementation):
-        pass
+        __slots__ = ()
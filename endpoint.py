@@ -12,6 +12,7 @@ from twisted.internet import reactor
 
 from util import is_valid_address_or_log
 from .candidate import Candidate
+from .packetcapture import PacketCaptureWriter, CAPTURE_FILE_SIZE, CAPTURE_FILE_COUNT
 from ipv8_endpoint import EndpointListener
 
 
@@ -23,6 +24,11 @@ else:
 TUNNEL_PREFIX = "ffffffff".decode("HEX")
 TUNNEL_PREFIX_LENGHT = 4
 
+# IPv8toDispersyAdapter hands received packets to Dispersy in batches of at most RECEIVE_BATCH_SIZE packets, at most
+# RECEIVE_BATCH_LATENCY seconds after the first packet of the batch arrived
+RECEIVE_BATCH_SIZE = 100
+RECEIVE_BATCH_LATENCY = 0.0
+
 
 class Endpoint(object):
     __metaclass__ = ABCMeta
@@ -52,6 +58,32 @@ class Endpoint(object):
         assert isinstance(timeout, float), type(timeout)
         return True
 
+    def _send_batch(self, candidates, packets, prefix=None):
+        """
+        Sends every packet in PACKETS, prefixed with PREFIX, to every candidate in CANDIDATES using send_packet.
+
+        Returns True when at least one packet was sent.
+        """
+        assert self._dispersy, "Should not be called before open(...)"
+        assert isinstance(candidates, (tuple, list, set)), type(candidates)
+        assert all(isinstance(candidate, Candidate) for candidate in candidates), [type(candidate) for candidate in candidates]
+        assert isinstance(packets, (tuple, list, set)), type(packets)
+        assert all(isinstance(packet, str) for packet in packets), [type(packet) for packet in packets]
+        assert all(len(packet) > 0 for packet in packets), [len(packet) for packet in packets]
+
+        prefix = prefix or ''
+        packets = [prefix + packet for packet in packets]
+
+        if any(len(packet) > 2 ** 16 - 60 for packet in packets):
+            raise RuntimeError("UDP does not support %d byte packets" % max(len(packet) for packet in packets))
+
+        send_packet = False
+        for candidate, packet in product(candidates, packets):
+            if self.send_packet(candidate, packet):
+                send_packet = True
+
+        return send_packet
+
     def log_packet(self, sock_addr, packet, outbound=True):
         try:
             community = self._dispersy.get_community(packet[2:22], load=False, auto_load=False)
@@ -115,6 +147,8 @@ class StandaloneEndpoint(Endpoint):
         self._thread = None
         self._socket = None
         self.packet_handlers = {}
+        # PacketCaptureWriter when incoming packets are captured
+        self._capture = None
 
     def listen_to(self, prefix, handler):
         self.packet_handlers[prefix] = handler
@@ -126,28 +160,56 @@ class StandaloneEndpoint(Endpoint):
         assert self._dispersy, "Should not be called before open(...)"
         return self._socket.getsockname()
 
+    @property
+    def capture(self):
+        """
+        The PacketCaptureWriter that incoming packets are written to, or None.
+        """
+        return self._capture
+
+    def start_capture(self, filename, max_file_size=CAPTURE_FILE_SIZE, max_files=CAPTURE_FILE_COUNT):
+        """
+        Writes all incoming packets to FILENAME, see packetcapture.py.
+
+        Replaces the capture that is currently running, if any.
+        """
+        self.stop_capture()
+        self._capture = PacketCaptureWriter(filename, max_file_size, max_files)
+
+    def stop_capture(self):
+        capture, self._capture = self._capture, None
+        if capture:
+            capture.close()
+
     def open(self, dispersy):
         super(StandaloneEndpoint, self).open(dispersy)
 
+        self._socket = self._create_socket()
+
+        self._running = True
+        self._thread = threading.Thread(name="StandaloneEndpoint", target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def _create_socket(self):
+        """
+        Returns a non-blocking UDP socket bound to self._ip, trying the next port when self._port is unavailable.
+        """
         for _ in xrange(10000):
             try:
                 self._logger.debug("Listening at %d", self._port)
-                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 870400)
-                self._socket.bind((self._ip, self._port))
-                self._socket.setblocking(0)
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 870400)
+                sock.bind((self._ip, self._port))
+                sock.setblocking(0)
 
-                self._port = self._socket.getsockname()[1]
+                self._port = sock.getsockname()[1]
             except socket.error:
                 self._port += 1
                 continue
             break
-
-        self._running = True
-        self._thread = threading.Thread(name="StandaloneEndpoint", target=self._loop)
-        self._thread.daemon = True
-        self._thread.start()
-        return True
+        return sock
 
     def close(self, timeout=10.0):
         self._running = False
@@ -171,21 +233,22 @@ class StandaloneEndpoint(Endpoint):
             self._logger.exception("%s", exception)
             result = False
 
+        self.stop_capture()
         return super(StandaloneEndpoint, self).close(timeout) and result
 
     def _loop(self):
         assert self._dispersy, "Should not be called before open(...)"
-        recvfrom = self._socket.recvfrom
-        socket_list = [self._socket.fileno()]
+        write_socket_list = [self._socket.fileno()]
+        read_socket_list = self._read_sockets()
 
         prev_sendqueue = 0
         while self._running:
             # This is a tricky, if we are running on the DAS4 whenever a socket is ready for writing all processes of
             # this node will try to write. Therefore, we have to limit the frequency of trying to write a bit.
             if self._sendqueue and (time() - prev_sendqueue) > 0.1:
-                read_list, write_list, _ = select(socket_list, socket_list, [], 0.1)
+                read_list, write_list, _ = select(read_socket_list, write_socket_list, [], 0.1)
             else:
-                read_list, write_list, _ = select(socket_list, [], [], 0.1)
+                read_list, write_list, _ = select(read_socket_list, [], [], 0.1)
 
             # Furthermore, if we are allowed to send, process sendqueue immediately
             if write_list:
@@ -193,28 +256,51 @@ class StandaloneEndpoint(Endpoint):
                 prev_sendqueue = time()
 
             if read_list:
-                packets = []
-                try:
-                    while True:
-                        (data, sock_addr) = recvfrom(65535)
-                        if data:
-                            packets.append((sock_addr, data))
-                        else:
-                            break
+                self._on_readable(read_list)
+
+    def _read_sockets(self):
+        """
+        Returns the file descriptors that _loop waits on for incoming packets.
+        """
+        return [self._socket.fileno()]
+
+    def _on_readable(self, read_list):
+        """
+        Called from the endpoint thread when one or more of the file descriptors in READ_LIST can be read.
+        """
+        packets = self._receive(self._socket)
+        if packets:
+            self._logger.debug('%d came in, %d bytes in total', len(packets), sum(len(packet) for _, packet in packets))
+            self.data_came_in(packets)
+
+    def _receive(self, sock):
+        """
+        Returns a list with (sock_addr, data) tuples for all packets that are waiting at SOCK.
+        """
+        recvfrom = sock.recvfrom
+        packets = []
+        try:
+            while True:
+                (data, sock_addr) = recvfrom(65535)
+                if data:
+                    packets.append((sock_addr, data))
+                else:
+                    break
 
-                except socket.error as e:
-                    if e.errno != errno.EAGAIN:
-                        self._dispersy.statistics.dict_inc(u"endpoint_recv", u"socket-error-'%s'" % repr(e))
+        except socket.error as e:
+            if e.errno != errno.EAGAIN:
+                self._dispersy.statistics.dict_inc(u"endpoint_recv", u"socket-error-'%s'" % repr(e))
 
-                finally:
-                    if packets:
-                        self._logger.debug('%d came in, %d bytes in total', len(packets), sum(len(packet) for _, packet in packets))
-                        self.data_came_in(packets)
+        return packets
 
     def data_came_in(self, packets, cache=True):
         assert self._dispersy, "Should not be called before open(...)"
         assert isinstance(packets, (list, tuple)), type(packets)
 
+        capture = self._capture
+        if capture:
+            capture.write(time(), packets)
+
         normal_packets = []
         for packet in packets:
             prefix = next((p for p in self.packet_handlers if
@@ -258,25 +344,7 @@ class StandaloneEndpoint(Endpoint):
             self._logger.exception("Ignored assertion error in Dispersy")
 
     def send(self, candidates, packets, prefix=None):
-        assert self._dispersy, "Should not be called before open(...)"
-        assert isinstance(candidates, (tuple, list, set)), type(candidates)
-        assert all(isinstance(candidate, Candidate) for candidate in candidates), [type(candidate) for candidate in candidates]
-        assert isinstance(packets, (tuple, list, set)), type(packets)
-        assert all(isinstance(packet, str) for packet in packets), [type(packet) for packet in packets]
-        assert all(len(packet) > 0 for packet in packets), [len(packet) for packet in packets]
-
-        prefix = prefix or ''
-        packets = [prefix + packet for packet in packets]
-
-        if any(len(packet) > 2 ** 16 - 60 for packet in packets):
-            raise RuntimeError("UDP does not support %d byte packets" % max(len(packet) for packet in packets))
-
-        send_packet = False
-        for candidate, packet in product(candidates, packets):
-            if self.send_packet(candidate, packet):
-                send_packet = True
-
-        return send_packet
+        return self._send_batch(candidates, packets, prefix)
 
     def send_packet(self, candidate, packet, prefix=None):
         assert self._dispersy, "Should not be called before open(...)"
@@ -405,7 +473,16 @@ class IPv8toDispersyAdapter(EndpointListener, Endpoint):
     horribly wrong...
     """
 
-    def __init__(self, ipv8_endpoint):
+    def __init__(self, ipv8_endpoint, max_batch_size=RECEIVE_BATCH_SIZE, max_batch_latency=RECEIVE_BATCH_LATENCY):
+        """
+        Packets received from IPV8_ENDPOINT are handed to Dispersy in batches of at most MAX_BATCH_SIZE packets.  A
+        batch is handed over MAX_BATCH_LATENCY seconds after its first packet arrived, or in the next reactor
+        iteration when MAX_BATCH_LATENCY is 0.0.
+        """
+        assert isinstance(max_batch_size, int), type(max_batch_size)
+        assert max_batch_size > 0, max_batch_size
+        assert isinstance(max_batch_latency, float), type(max_batch_latency)
+        assert max_batch_latency >= 0.0, max_batch_latency
         #super(IPv8toDispersyAdapter, self).__init__(ipv8_endpoint)
         EndpointListener.__init__(self, ipv8_endpoint)
         Endpoint.__init__(self)
@@ -414,27 +491,17 @@ class IPv8toDispersyAdapter(EndpointListener, Endpoint):
         self._ipv8_endpoint.add_listener(self)
         self.packet_handlers = {}
 
+        self._reactor = reactor
+        self._max_batch_size = max_batch_size
+        self._max_batch_latency = max_batch_latency
+        self._receive_queue = []
+        self._receive_call = None
+
     def get_address(self):
         return self._address
 
     def send(self, candidates, packets, prefix=None):
-        assert isinstance(candidates, (tuple, list, set)), type(candidates)
-        assert all(isinstance(candidate, Candidate) for candidate in candidates), [type(candidate) for candidate in candidates]
-        assert isinstance(packets, (tuple, list, set)), type(packets)
-        assert all(isinstance(packet, str) for packet in packets), [type(packet) for packet in packets]
-        assert all(len(packet) > 0 for packet in packets), [len(packet) for packet in packets]
-        prefix = prefix or ''
-        packets = [prefix + packet for packet in packets]
-
-        if any(len(packet) > 2 ** 16 - 60 for packet in packets):
-            raise RuntimeError("UDP does not support %d byte packets" % max(len(packet) for packet in packets))
-
-        send_packet = False
-        for candidate, packet in product(candidates, packets):
-            if self.send_packet(candidate, packet):
-                send_packet = True
-
-        return send_packet
+        return self._send_batch(candidates, packets, prefix)
 
     def send_packet(self, candidate, packet, prefix=None):
         assert self._dispersy, "Should not be called before open(...)"
@@ -464,10 +531,31 @@ class IPv8toDispersyAdapter(EndpointListener, Endpoint):
     def stop_listen_to(self, prefix):
         del self.packet_handlers[prefix]
     
+    def close(self, timeout=0.0):
+        if self._receive_call:
+            self._receive_call.cancel()
+            self._receive_call = None
+        self._receive_queue = []
+        return super(IPv8toDispersyAdapter, self).close(timeout)
+
     def on_packet(self, packet):
-        l = list()
-        l.append(packet)
-        self.data_came_in(l)
+        # called on the reactor thread, since we are a main thread listener
+        self._receive_queue.append(packet)
+
+        if len(self._receive_queue) >= self._max_batch_size:
+            self._flush_receive_queue()
+        elif not self._receive_call:
+            self._receive_call = self._reactor.callLater(self._max_batch_latency, self._flush_receive_queue)
+
+    def _flush_receive_queue(self):
+        if self._receive_call:
+            if self._receive_call.active():
+                self._receive_call.cancel()
+            self._receive_call = None
+
+        packets, self._receive_queue = self._receive_queue, []
+        if packets:
+            self.data_came_in(packets)
 
     def data_came_in(self, packets, cache=True):
         assert self._dispersy, "Should not be called before open(...)"
@@ -489,8 +577,8 @@ class IPv8toDispersyAdapter(EndpointListener, Endpoint):
                 for sock_addr, data in normal_packets:
                     self.log_packet(sock_addr, data, outbound=False)
 
-            # The endpoint runs on it's own thread, so we can't do a callLater here
-            reactor.callFromThread(self.dispersythread_data_came_in, normal_packets, time(), cache)
+            # unlike the StandaloneEndpoint we already run on the reactor thread
+            self.dispersythread_data_came_in(normal_packets, time(), cache)
 
     def dispersythread_data_came_in(self, packets, timestamp, cache=True):
         assert self._dispersy, "Should not be called before open(...)"
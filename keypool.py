@@ -0,0 +1,167 @@
+"""
+A pool of pre-generated private keys.
+
+Generating a key on one of the larger curves takes long enough to stall the reactor.  A KeyPool keeps a number of keys
+for each security level, generated one at a time in a worker thread, so that Dispersy.get_new_member can take a key
+without waiting for it.  The keys can be stored in a file, allowing a pool to survive a restart.  A key is removed from
+the pool, and from the file, as soon as it is taken, hence every key is handed out only once.
+"""
+import logging
+import os
+
+from twisted.internet.defer import Deferred, succeed
+
+# number of keys kept for each security level
+KEY_POOL_SIZE = 2
+
+
+class KeyPool(object):
+
+    def __init__(self, crypto, security_levels=(u"medium",), size=KEY_POOL_SIZE, filename=None):
+        """
+        Keeps SIZE keys, generated by CRYPTO, for each of SECURITY_LEVELS.  When FILENAME is given the keys are stored
+        in, and loaded from, this file.
+        """
+        assert all(isinstance(security_level, unicode) for security_level in security_levels), security_levels
+        assert all(security_level in crypto.security_levels for security_level in security_levels), security_levels
+        assert isinstance(size, int), type(size)
+        assert size > 0, size
+        assert filename is None or isinstance(filename, basestring), type(filename)
+        super(KeyPool, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._crypto = crypto
+        self._security_levels = tuple(security_levels)
+        self._size = size
+        self._filename = filename
+        # security_level:[private key bin] pairs
+        self._keys = dict((security_level, []) for security_level in self._security_levels)
+        self._refilling = False
+        self._stopped = False
+        # Deferreds that fire when the current refill is done
+        self._waiters = []
+
+        if filename and os.path.exists(filename):
+            self._load()
+
+    @property
+    def security_levels(self):
+        return self._security_levels
+
+    @property
+    def size(self):
+        return self._size
+
+    def count(self, security_level):
+        """
+        Returns the number of keys available for SECURITY_LEVEL.
+        """
+        return len(self._keys.get(security_level, ()))
+
+    def take(self, security_level):
+        """
+        Returns a private key, in binary format, for SECURITY_LEVEL or None when the pool has no such key.
+
+        Taking a key from the pool starts refilling it in the background.
+        """
+        assert isinstance(security_level, unicode), type(security_level)
+        keys = self._keys.get(security_level)
+        if keys is None:
+            return None
+
+        key = keys.pop(0) if keys else None
+        if key and self._filename:
+            self._save()
+        self.refill()
+        return key
+
+    def start(self):
+        """
+        Starts refilling the pool, also after it was stopped.
+
+        Returns a Deferred that fires when the pool is full or stopped.
+        """
+        self._stopped = False
+        return self.refill()
+
+    def refill(self):
+        """
+        Generates keys, one at a time, until every security level has SIZE keys.
+
+        Returns a Deferred that fires when the pool is full or stopped.
+        """
+        if self._stopped:
+            return succeed(None)
+
+        deferred = Deferred()
+        self._waiters.append(deferred)
+        if not self._refilling:
+            self._refilling = True
+            self._refill_next()
+        return deferred
+
+    def stop(self):
+        """
+        Stops refilling the pool.
+
+        Returns a Deferred that fires once the key that is being generated, if any, is done.
+        """
+        self._stopped = True
+        if self._refilling:
+            deferred = Deferred()
+            self._waiters.append(deferred)
+            return deferred
+        return succeed(None)
+
+    def _refill_next(self):
+        security_level = None if self._stopped else next((security_level
+                                                          for security_level in self._security_levels
+                                                          if len(self._keys[security_level]) < self._size), None)
+        if security_level is None:
+            self._refilling = False
+            waiters, self._waiters = self._waiters, []
+            for waiter in waiters:
+                waiter.callback(None)
+            return
+
+        self._logger.debug("generating a %s key", security_level)
+        self._crypto.generate_key_in_thread(security_level).addCallbacks(self._on_key, self._on_error,
+                                                                         callbackArgs=(security_level,),
+                                                                         errbackArgs=(security_level,))
+
+    def _on_key(self, key, security_level):
+        self._keys[security_level].append(self._crypto.key_to_bin(key))
+        if self._filename:
+            self._save()
+        self._refill_next()
+
+    def _on_error(self, failure, security_level):
+        self._logger.error("unable to generate a %s key: %s", security_level, failure.getErrorMessage())
+        # do not retry, the next take or refill will
+        self._refilling = False
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            waiter.callback(None)
+
+    def _load(self):
+        try:
+            with open(self._filename, "r") as f:
+                for line in f:
+                    security_level, _, key = line.strip().partition(" ")
+                    security_level = security_level.decode("UTF-8")
+                    if security_level in self._keys and key:
+                        self._keys[security_level].append(key.decode("HEX"))
+        except (IOError, TypeError) as exception:
+            self._logger.warning("unable to load key pool %s: %s", self._filename, exception)
+
+    def _save(self):
+        # write to a temporary file that only we can read, then replace the pool file
+        filename = self._filename + ".tmp"
+        try:
+            fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+            with os.fdopen(fd, "w") as f:
+                for security_level in self._security_levels:
+                    for key in self._keys[security_level]:
+                        f.write("%s %s\n" % (security_level.encode("UTF-8"), key.encode("HEX")))
+            os.rename(filename, self._filename)
+        except (IOError, OSError) as exception:
+            self._logger.warning("unable to save key pool %s: %s", self._filename, exception)
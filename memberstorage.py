@@ -0,0 +1,143 @@
+"""
+Storage for member identifiers and keys.
+
+Dispersy uses a MemberStorage to find and store the database id, public key, and private key of every member.
+DatabaseMemberStorage keeps these in the member table of the Dispersy database.  MemoryMemberStorage keeps them in
+dictionaries instead, this is intended for trackers that use an in-memory database and see many short-lived members.
+
+Keys that are not known are represented by empty strings.
+"""
+from abc import ABCMeta, abstractmethod
+
+# DatabaseMemberStorage.get_many looks up at most this many members per query
+GET_MANY_CHUNK_SIZE = 400
+
+
+class MemberStorage(object):
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def get(self, mid):
+        """
+        Returns a (database_id, public_key, private_key) tuple for the member with MID, or None when unknown.
+        """
+        pass
+
+    def get_many(self, mids):
+        """
+        Returns a dictionary with mid:(database_id, public_key, private_key) pairs for the known members in MIDS.
+        """
+        rows = {}
+        for mid in mids:
+            row = self.get(mid)
+            if row:
+                rows[mid] = row
+        return rows
+
+    @abstractmethod
+    def get_by_id(self, database_id):
+        """
+        Returns a (mid, public_key, private_key) tuple for the member with DATABASE_ID, or None when unknown.
+        """
+        pass
+
+    @abstractmethod
+    def add(self, mid, public_key="", private_key=""):
+        """
+        Stores a new member and returns its database id.
+        """
+        pass
+
+    @abstractmethod
+    def update(self, database_id, public_key, private_key=None):
+        """
+        Sets the PUBLIC_KEY of the member with DATABASE_ID, and its PRIVATE_KEY unless None is given.
+        """
+        pass
+
+
+class DatabaseMemberStorage(MemberStorage):
+
+    def __init__(self, database):
+        super(DatabaseMemberStorage, self).__init__()
+        self._database = database
+
+    def get(self, mid):
+        row = self._database.execute(u"SELECT id, public_key, private_key FROM member WHERE mid = ? LIMIT 1",
+                                     (buffer(mid),)).fetchone()
+        if row:
+            database_id, public_key, private_key = row
+            return database_id, "" if public_key is None else str(public_key), "" if private_key is None else str(private_key)
+
+    def get_many(self, mids):
+        mids = list(mids)
+        rows = {}
+        for index in xrange(0, len(mids), GET_MANY_CHUNK_SIZE):
+            chunk = mids[index:index + GET_MANY_CHUNK_SIZE]
+            for mid, database_id, public_key, private_key in self._database.execute(
+                    u"SELECT mid, id, public_key, private_key FROM member WHERE mid IN (%s)" % ", ".join("?" * len(chunk)),
+                    [buffer(mid) for mid in chunk]):
+                rows[str(mid)] = (database_id,
+                                  "" if public_key is None else str(public_key),
+                                  "" if private_key is None else str(private_key))
+        return rows
+
+    def get_by_id(self, database_id):
+        row = self._database.execute(u"SELECT mid, public_key, private_key FROM member WHERE id = ?",
+                                     (database_id,)).fetchone()
+        if row:
+            mid, public_key, private_key = row
+            return str(mid), "" if public_key is None else str(public_key), "" if private_key is None else str(private_key)
+
+    def add(self, mid, public_key="", private_key=""):
+        if public_key or private_key:
+            return self._database.execute(u"INSERT INTO member (mid, public_key, private_key) VALUES (?, ?, ?)",
+                                          (buffer(mid), buffer(public_key), buffer(private_key)), get_lastrowid=True)
+        return self._database.execute(u"INSERT INTO member (mid) VALUES (?)", (buffer(mid),), get_lastrowid=True)
+
+    def update(self, database_id, public_key, private_key=None):
+        if private_key is None:
+            self._database.execute(u"UPDATE member SET public_key = ? WHERE id = ?", (buffer(public_key), database_id))
+        else:
+            self._database.execute(u"UPDATE member SET public_key = ?, private_key = ? WHERE id = ?",
+                                   (buffer(public_key), buffer(private_key), database_id))
+
+
+class MemoryMemberStorage(MemberStorage):
+
+    def __init__(self):
+        super(MemoryMemberStorage, self).__init__()
+        self._next_id = 1
+        # mid:(database_id, public_key, private_key) pairs
+        self._by_mid = {}
+        # database_id:mid pairs
+        self._by_id = {}
+
+    def __len__(self):
+        return len(self._by_mid)
+
+    def get(self, mid):
+        return self._by_mid.get(mid)
+
+    def get_many(self, mids):
+        by_mid = self._by_mid
+        return dict((mid, by_mid[mid]) for mid in mids if mid in by_mid)
+
+    def get_by_id(self, database_id):
+        mid = self._by_id.get(database_id)
+        if mid is not None:
+            _, public_key, private_key = self._by_mid[mid]
+            return mid, public_key, private_key
+
+    def add(self, mid, public_key="", private_key=""):
+        assert mid not in self._by_mid, mid.encode("HEX")
+        database_id = self._next_id
+        self._next_id += 1
+        self._by_mid[mid] = (database_id, public_key, private_key)
+        self._by_id[database_id] = mid
+        return database_id
+
+    def update(self, database_id, public_key, private_key=None):
+        mid = self._by_id[database_id]
+        _, _, current_private_key = self._by_mid[mid]
+        self._by_mid[mid] = (database_id, public_key, current_private_key if private_key is None else private_key)
@@ -246,6 +246,8 @@ class BatchConfiguration(object):
 #
 class Packet(MetaObject.Implementation):
 
+    __slots__ = ("_packet", "_packet_id")
+
     def __init__(self, meta, packet, packet_id):
         assert isinstance(packet, str), type(packet)
         assert isinstance(packet_id, (int, long)), type(packet_id)
@@ -318,6 +320,12 @@ class Message(MetaObject):
 
     class Implementation(Packet):
 
+        # an instance is created for every message, hence no per instance __dict__ and logger
+        __slots__ = ("_authentication", "_resolution", "_distribution", "_destination", "_payload", "_candidate",
+                     "_source", "_resume", "_conversion", "undone")
+
+        _logger = logging.getLogger("Implementation")
+
         def __init__(self, meta, authentication, resolution, distribution, destination, payload, conversion=None, candidate=None, source=u"unknown", packet="", packet_id=0, sign=True):
             from .conversion import Conversion
             assert isinstance(meta, Message), "META has invalid type '%s'" % type(meta)
@@ -338,7 +346,6 @@ class Message(MetaObject):
             self._payload = payload
             self._candidate = candidate
             self._source = source
-            self._logger = logging.getLogger(self.__class__.__name__)
 
             # _RESUME contains the message that caused SELF to be processed after it was delayed
             self._resume = None
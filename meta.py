@@ -6,6 +6,8 @@ class MetaObject(object):
 
     class Implementation(object):
 
+        __slots__ = ("_meta",)
+
         def __init__(self, meta):
             assert isinstance(meta, MetaObject), type(meta)
             self._meta = meta
@@ -0,0 +1,168 @@
+"""
+Recording of incoming datagrams.
+
+A StandaloneEndpoint can write every datagram it receives to a capture file, allowing real traffic to be replayed
+against another build using tool/replay.py.  The file starts with CAPTURE_MAGIC, followed by one record per datagram:
+the receive timestamp as a double, the IPv4 source address and port, the length of the datagram, and the datagram
+itself.  Datagrams that were received together share the same timestamp, hence a replay can hand them to Dispersy as
+one batch again.
+
+When a file grows beyond MAX_FILE_SIZE bytes it is renamed to FILENAME.1, FILENAME.1 to FILENAME.2, etc.  At most
+MAX_FILES files are kept, the oldest one is removed.
+"""
+import logging
+import os
+import socket
+import threading
+from struct import Struct
+
+CAPTURE_MAGIC = "DPCAP\x01"
+# maximum size of a single capture file in bytes
+CAPTURE_FILE_SIZE = 64 * 1024 * 1024
+# maximum number of capture files, including the one that is being written
+CAPTURE_FILE_COUNT = 4
+
+_record_struct = Struct("!d4sHH")
+
+
+def get_capture_files(filename):
+    """
+    Returns the names of the existing capture files written to FILENAME, oldest first.
+    """
+    filenames = []
+    index = 1
+    while os.path.exists("%s.%d" % (filename, index)):
+        filenames.append("%s.%d" % (filename, index))
+        index += 1
+    filenames.reverse()
+    if os.path.exists(filename):
+        filenames.append(filename)
+    return filenames
+
+
+def read_capture(filename):
+    """
+    Yields (timestamp, sock_addr, data) tuples for every datagram in the capture file FILENAME.
+
+    Raises ValueError when FILENAME is not a capture file.  A truncated last record, left behind when the process
+    writing the file was killed, is ignored.
+    """
+    with open(filename, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("%s is not a capture file" % filename)
+
+        while True:
+            header = f.read(_record_struct.size)
+            if len(header) < _record_struct.size:
+                break
+            timestamp, ip, port, length = _record_struct.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            yield timestamp, (socket.inet_ntoa(ip), port), data
+
+
+def read_batches(filenames):
+    """
+    Yields (timestamp, [(sock_addr, data), ...]) tuples, one for every batch of datagrams in FILENAMES.
+    """
+    timestamp, packets = None, []
+    for filename in filenames:
+        for record_timestamp, sock_addr, data in read_capture(filename):
+            if record_timestamp != timestamp and packets:
+                yield timestamp, packets
+                packets = []
+            timestamp = record_timestamp
+            packets.append((sock_addr, data))
+    if packets:
+        yield timestamp, packets
+
+
+class PacketCaptureWriter(object):
+
+    def __init__(self, filename, max_file_size=CAPTURE_FILE_SIZE, max_files=CAPTURE_FILE_COUNT):
+        """
+        Writes datagrams to FILENAME, keeping at most MAX_FILES files of at most MAX_FILE_SIZE bytes.
+
+        Existing capture files are replaced.
+        """
+        assert isinstance(filename, basestring), type(filename)
+        assert isinstance(max_file_size, (int, long)), type(max_file_size)
+        assert max_file_size > len(CAPTURE_MAGIC) + _record_struct.size, max_file_size
+        assert isinstance(max_files, int), type(max_files)
+        assert max_files > 0, max_files
+        super(PacketCaptureWriter, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._filename = filename
+        self._max_file_size = max_file_size
+        self._max_files = max_files
+        # write is called from the endpoint thread, close usually from the reactor thread
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+
+        self.packet_count = 0
+        self.byte_count = 0
+
+        for old_filename in get_capture_files(filename):
+            os.remove(old_filename)
+        self._open()
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def _open(self):
+        self._file = open(self._filename, "wb")
+        self._file.write(CAPTURE_MAGIC)
+        self._size = len(CAPTURE_MAGIC)
+
+    def _rotate(self):
+        self._file.close()
+        for index in xrange(self._max_files - 1, 0, -1):
+            source = "%s.%d" % (self._filename, index - 1) if index > 1 else self._filename
+            if os.path.exists(source):
+                os.rename(source, "%s.%d" % (self._filename, index))
+        if self._max_files == 1:
+            os.remove(self._filename)
+        self._open()
+
+    def write(self, timestamp, packets):
+        """
+        Writes PACKETS, a list with (sock_addr, data) tuples, received at TIMESTAMP.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+
+            try:
+                for (ip, port), data in packets:
+                    try:
+                        header = _record_struct.pack(timestamp, socket.inet_aton(ip), port, len(data))
+                    except (socket.error, TypeError):
+                        self._logger.debug("unable to capture a packet from %s:%s", ip, port)
+                        continue
+
+                    if self._size + len(header) + len(data) > self._max_file_size and self._size > len(CAPTURE_MAGIC):
+                        self._rotate()
+                    self._file.write(header)
+                    self._file.write(data)
+                    self._size += len(header) + len(data)
+                    self.packet_count += 1
+                    self.byte_count += len(data)
+
+            except (IOError, OSError) as exception:
+                self._logger.error("unable to write capture file %s, capture stopped: %s", self._filename, exception)
+                self._close()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except (IOError, OSError) as exception:
+                self._logger.warning("unable to close capture file %s: %s", self._filename, exception)
+            self._file = None
@@ -4,7 +4,7 @@ from .meta import MetaObject
 class Resolution(MetaObject):
 
     class Implementation(MetaObject.Implementation):
-        pass
+        __slots__ = ()
 
     def setup(self, message):
         """
@@ -20,7 +20,7 @@ class PublicResolution(Resolution):
     PublicResolution allows any member to create a message.
     """
     class Implementation(Resolution.Implementation):
-        pass
+        __slots__ = ()
 
 
 class LinearResolution(Resolution):
@@ -29,7 +29,7 @@ class LinearResolution(Resolution):
     LinearResolution allows only members that have a specific permission to create a message.
     """
     class Implementation(Resolution.Implementation):
-        pass
+        __slots__ = ()
 
 
 class DynamicResolution(Resolution):
@@ -43,6 +43,8 @@ class DynamicResolution(Resolution):
     """
     class Implementation(Resolution.Implementation):
 
+        __slots__ = ("_policy",)
+
         def __init__(self, meta, policy):
             """
             Create a DynamicResolution.Implementation instance.
@@ -1,6 +1,7 @@
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
-from threading import RLock
+from math import frexp
+from threading import RLock, local
 from time import time
 
 
@@ -49,104 +50,236 @@ class Statistics(object):
         pass
 
 
-class MessageStatistics(object):
+class Counter(object):
 
-    def __init__(self):
-        super(MessageStatistics, self).__init__()
-        self._lock = RLock()
+    """
+    A handle to one counter in a CounterRegistry.
 
-        self.total_received_count = 0
-        self.success_count = 0
-        self.drop_count = 0
-        self.created_count = 0
-        self.outgoing_count = 0
+    Handles are created once, using CounterRegistry.counter, and can be incremented from any thread without locking.
+    """
 
-        self.delay_received_count = 0
-        self.delay_send_count = 0
-        self.delay_timeout_count = 0
-        self.delay_success_count = 0
+    __slots__ = ("_registry", "_local", "_index")
 
-        self.success_dict = None
-        self.drop_dict = None
-        self.created_dict = None
-        self.delay_dict = None
-        self.outgoing_dict = None
+    def __init__(self, registry, index):
+        self._registry = registry
+        self._local = registry._local
+        self._index = index
 
-        self.walk_attempt_count = 0
-        self.walk_success_count = 0
-        self.walk_failure_count = 0
-        self.walk_failure_dict = None
-        self.invalid_response_identifier_count = 0
+    @property
+    def value(self):
+        return self._registry.get_value(self._index)
 
-        self.incoming_intro_count = 0
-        self.incoming_intro_dict = None
-        self.outgoing_intro_count = 0
-        self.outgoing_intro_dict = None
+    def increment(self, value=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._registry._create_shard()
+        shard[self._index] += value
 
-        self._enabled = None
 
-    def increase_count(self, category, name, value=1):
-        with self._lock:
-            count_name = u"%s_count" % category
-            dict_name = u"%s_dict" % category
-            if hasattr(self, count_name):
-                setattr(self, count_name, getattr(self, count_name) + value)
-            if getattr(self, dict_name) is not None:
-                getattr(self, dict_name)[name] += value
+class CounterGroup(object):
 
-    def increase_delay_count(self, category, value=1):
+    """
+    Increments several counters, possibly from different registries, at once.
+    """
+
+    __slots__ = ("_counters",)
+
+    def __init__(self, counters):
+        self._counters = tuple(counters)
+
+    def increment(self, value=1):
+        for counter in self._counters:
+            counter.increment(value)
+
+
+class CounterRegistry(object):
+
+    """
+    A set of named counters.
+
+    Every thread accumulates into its own shard, the shards are merged when the counters are read.  Locking only
+    occurs when a counter or a shard is created, and when counters are read or reset.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._local = local()
+        self._names = []
+        self._counters = {}
+        self._shards = []
+
+    def counter(self, name):
+        """
+        Returns the Counter handle for NAME, creating the counter when it does not exist yet.
+        """
+        try:
+            return self._counters[name]
+        except KeyError:
+            with self._lock:
+                if name not in self._counters:
+                    for shard in self._shards:
+                        shard.append(0)
+                    self._counters[name] = Counter(self, len(self._names))
+                    self._names.append(name)
+                return self._counters[name]
+
+    def _create_shard(self):
         with self._lock:
-            count_name = u"delay_%s_count" % category
-            setattr(self, count_name, getattr(self, count_name) + value)
+            shard = self._local.shard = [0] * len(self._names)
+            self._shards.append(shard)
+            return shard
 
-    def enable(self, enabled):
+    def get_value(self, index):
         with self._lock:
-            if self._enabled != enabled:
-                self._enabled = enabled
-                assigned_value = lambda: defaultdict(int) if enabled else None
+            return sum(shard[index] for shard in self._shards)
 
-                self.success_dict = assigned_value()
-                self.outgoing_dict = assigned_value()
-                self.created_dict = assigned_value()
-                self.drop_dict = assigned_value()
-                self.delay_dict = assigned_value()
+    def set_value(self, index, value):
+        """
+        Changes the merged value of counter INDEX to VALUE.
+        """
+        with self._lock:
+            for shard in self._shards:
+                shard[index] = 0
+            self._counters[self._names[index]].increment(value)
 
-                self.walk_failure_dict = assigned_value()
-                self.incoming_intro_dict = assigned_value()
-                self.outgoing_intro_dict = assigned_value()
+    def snapshot(self):
+        """
+        Returns a {name: value} dictionary with the current value of all counters.
+        """
+        with self._lock:
+            values = [sum(values) for values in zip(*self._shards)] if self._shards else [0] * len(self._names)
+            return dict(zip(self._names, values))
 
     def reset(self):
         with self._lock:
-            self.total_received_count = 0
-            self.success_count = 0
-            self.drop_count = 0
-            self.created_count = 0
-            self.outgoing_count = 0
+            for shard in self._shards:
+                shard[:] = [0] * len(shard)
 
-            self.delay_received_count = 0
-            self.delay_send_count = 0
-            self.delay_timeout_count = 0
-            self.delay_success_count = 0
+    @staticmethod
+    def delta(current, previous):
+        """
+        Returns a {name: difference} dictionary between two snapshots, omitting unchanged counters.
+        """
+        delta = {}
+        for name, value in current.iteritems():
+            difference = value - previous.get(name, 0)
+            if difference:
+                delta[name] = difference
+        return delta
 
-            self.walk_attempt_count = 0
-            self.walk_success_count = 0
-            self.walk_failure_count = 0
 
-            self.invalid_response_identifier_count = 0
+def _counter_property(name):
+    def getter(self):
+        return self._counters.counter(name).value
 
-            self.incoming_intro_count = 0
-            self.outgoing_intro_count = 0
+    def setter(self, value):
+        counter = self._counters.counter(name)
+        self._counters.set_value(counter._index, value)
+    return property(getter, setter)
 
-            if self._enabled:
-                self.success_dict.clear()
-                self.drop_dict.clear()
-                self.created_dict.clear()
-                self.delay_dict.clear()
-                self.outgoing_dict.clear()
 
-                self.walk_failure_dict.clear()
-                self.incoming_intro_dict.clear()
-                self.outgoing_intro_dict.clear()
+def _counter_dict_property(category):
+    def getter(self):
+        if not self._enabled:
+            return None
+        counts = defaultdict(int)
+        for name, value in self._counters.snapshot().iteritems():
+            if isinstance(name, tuple) and name[0] == category:
+                counts[name[1]] = value
+        return counts
+    return property(getter)
+
+
+class MessageStatistics(object):
+
+    """
+    Message counters, i.e. SUCCESS_COUNT, and per message counters, i.e. SUCCESS_DICT, that are only available when
+    enabled.
+
+    Counters are kept in a CounterRegistry.  Use get_counter to obtain a handle that can be incremented without string
+    formatting or locking.  The *_count and *_dict attributes are merged from the registry when read.
+    """
+
+    COUNTS = (u"total_received", u"success", u"drop", u"created", u"outgoing",
+              u"delay_received", u"delay_send", u"delay_timeout", u"delay_success",
+              u"walk_attempt", u"walk_success", u"walk_failure", u"invalid_response_identifier",
+              u"incoming_intro", u"outgoing_intro")
+
+    total_received_count = _counter_property(u"total_received_count")
+    success_count = _counter_property(u"success_count")
+    drop_count = _counter_property(u"drop_count")
+    created_count = _counter_property(u"created_count")
+    outgoing_count = _counter_property(u"outgoing_count")
+
+    delay_received_count = _counter_property(u"delay_received_count")
+    delay_send_count = _counter_property(u"delay_send_count")
+    delay_timeout_count = _counter_property(u"delay_timeout_count")
+    delay_success_count = _counter_property(u"delay_success_count")
+
+    success_dict = _counter_dict_property(u"success")
+    drop_dict = _counter_dict_property(u"drop")
+    created_dict = _counter_dict_property(u"created")
+    delay_dict = _counter_dict_property(u"delay")
+    outgoing_dict = _counter_dict_property(u"outgoing")
+
+    walk_attempt_count = _counter_property(u"walk_attempt_count")
+    walk_success_count = _counter_property(u"walk_success_count")
+    walk_failure_count = _counter_property(u"walk_failure_count")
+    walk_failure_dict = _counter_dict_property(u"walk_failure")
+    invalid_response_identifier_count = _counter_property(u"invalid_response_identifier_count")
+
+    incoming_intro_count = _counter_property(u"incoming_intro_count")
+    incoming_intro_dict = _counter_dict_property(u"incoming_intro")
+    outgoing_intro_count = _counter_property(u"outgoing_intro_count")
+    outgoing_intro_dict = _counter_dict_property(u"outgoing_intro")
+
+    def __init__(self):
+        super(MessageStatistics, self).__init__()
+        self._counters = CounterRegistry()
+        self._totals = dict((category, self._counters.counter(category + u"_count")) for category in self.COUNTS)
+        self._handles = {}
+        self._enabled = None
+
+    def get_counter(self, category, name=None):
+        """
+        Returns a handle for the CATEGORY total and, when enabled, the CATEGORY NAME counter.
+
+        The handle remains valid until enable is called.
+        """
+        if not self._enabled:
+            name = None
+        key = (category, name)
+        try:
+            return self._handles[key]
+        except KeyError:
+            counters = []
+            if category in self._totals:
+                counters.append(self._totals[category])
+            if name is not None:
+                counters.append(self._counters.counter(key))
+            handle = self._handles[key] = counters[0] if len(counters) == 1 else CounterGroup(counters)
+            return handle
+
+    def increase_count(self, category, name, value=1):
+        self.get_counter(category, name).increment(value)
+
+    def increase_delay_count(self, category, value=1):
+        self._totals[u"delay_" + category].increment(value)
+
+    def enable(self, enabled):
+        if self._enabled != enabled:
+            self._enabled = enabled
+            self._handles = {}
+
+    def reset(self):
+        self._counters.reset()
+
+    def snapshot(self):
+        """
+        Returns a {name: value} dictionary with all counters, per message counters use (category, name) keys.
+        """
+        return self._counters.snapshot()
 
 
 class DispersyStatistics(Statistics):
@@ -187,8 +320,8 @@ class DispersyStatistics(Statistics):
         self.endpoint_send = None
         self.received_introductions = None
 
-        # list with {count=int, duration=float, average=float, entry=str} dictionaries.  each entry
-        # represents a key from the attach_runtime_statistics decorator
+        # list with {count=int, samples=int, duration=float, average=float, histogram=list, entry=str}
+        # dictionaries.  each entry represents a key from the attach_runtime_statistics decorator
         self.runtime = None
 
         self._enabled = None
@@ -213,6 +346,42 @@ class DispersyStatistics(Statistics):
     def connection_type(self):
         return self._dispersy.connection_type
 
+    @property
+    def key_cache_hits(self):
+        return sum(key_cache.hits for key_cache in self._dispersy.crypto.key_caches)
+
+    @property
+    def key_cache_misses(self):
+        return sum(key_cache.misses for key_cache in self._dispersy.crypto.key_caches)
+
+    @property
+    def key_cache_size(self):
+        return sum(len(key_cache) for key_cache in self._dispersy.crypto.key_caches)
+
+    @property
+    def commit_count(self):
+        return self._dispersy.commit_scheduler.commit_count
+
+    @property
+    def commit_rows(self):
+        return self._dispersy.commit_scheduler.commit_rows
+
+    @property
+    def commit_failures(self):
+        return self._dispersy.commit_scheduler.commit_failures
+
+    @property
+    def commit_duration(self):
+        return self._dispersy.commit_scheduler.commit_duration
+
+    @property
+    def commit_duration_max(self):
+        return self._dispersy.commit_scheduler.commit_duration_max
+
+    @property
+    def wal_size(self):
+        return self._dispersy.commit_scheduler.wal_size
+
     def enable_debug_statistics(self, enable):
         if self._enabled != enable:
             self._enabled = enable
@@ -236,6 +405,17 @@ class DispersyStatistics(Statistics):
     def are_debug_statistics_enabled(self):
         return self._enabled
 
+    def enable_runtime_statistics(self, enable, sample_rate=1.0):
+        """
+        Enables or disables the attach_runtime_statistics instrumentation, measuring a fraction of SAMPLE_RATE calls.
+
+        Note that this is a process wide setting.
+        """
+        _runtime_statistics_settings.configure(enable, sample_rate)
+
+    def are_runtime_statistics_enabled(self):
+        return _runtime_statistics_settings.enabled
+
     def update(self, database=False):
         self.timestamp = time()
 
@@ -243,8 +423,8 @@ class DispersyStatistics(Statistics):
         for community in self.communities:
             community.update(database=database)
 
-        # list with {count=int, duration=float, average=float, entry=str} dictionaries.  each entry
-        # represents a key from the attach_runtime_statistics decorator
+        # list with {count=int, samples=int, duration=float, average=float, histogram=list, entry=str}
+        # dictionaries.  each entry represents a key from the attach_runtime_statistics decorator
         self.runtime = [(statistic.duration, statistic.get_dict(entry=entry)) for entry, statistic in _runtime_statistics.iteritems() if statistic.duration > 1]
         self.runtime.sort(reverse=True)
         self.runtime = [statistic[1] for statistic in self.runtime]
@@ -281,6 +461,36 @@ class DispersyStatistics(Statistics):
             self.endpoint_send = defaultdict(int)
             self.received_introductions = defaultdict(lambda: defaultdict(int))
 
+    SNAPSHOT_COUNTS = (u"total_down", u"total_up", u"total_send", u"total_received", u"cur_sendqueue",
+                       u"total_candidates_discovered", u"walk_attempt_count", u"walk_success_count",
+                       u"walk_failure_count", u"invalid_response_identifier_count", u"incoming_intro_count",
+                       u"outgoing_intro_count", u"key_cache_hits", u"key_cache_misses", u"key_cache_size",
+                       u"commit_count", u"commit_rows", u"commit_failures", u"commit_duration", u"commit_duration_max",
+                       u"wal_size")
+
+    def snapshot(self):
+        """
+        Returns a flat {name: value} dictionary with the current counters, without resetting anything.
+
+        Message statistics are prefixed with 'msg_statistics.'.  Per message counters, available when debug statistics
+        are enabled, are named 'msg_statistics.CATEGORY:NAME'.
+        """
+        snapshot = dict((name, getattr(self, name)) for name in self.SNAPSHOT_COUNTS)
+        for name, value in self.msg_statistics.snapshot().iteritems():
+            if isinstance(name, tuple):
+                name = u"%s:%s" % name
+            snapshot[u"msg_statistics." + name] = value
+        return snapshot
+
+    def delta(self, previous):
+        """
+        Returns a ({name: difference}, snapshot) tuple with the counters that changed since the PREVIOUS snapshot.
+
+        A monitoring scraper can poll this cheaply by passing the returned snapshot to the next call.
+        """
+        snapshot = self.snapshot()
+        return CounterRegistry.delta(snapshot, previous), snapshot
+
 
 class CommunityStatistics(Statistics):
 
@@ -301,12 +511,23 @@ class CommunityStatistics(Statistics):
         self.total_candidates_discovered = 0
 
         self.msg_statistics = MessageStatistics()
+        self._msg_counters = {}
+        self._total_received_counter = self.msg_statistics.get_counter(u"total_received")
 
         self.sync_bloom_new = 0
         self.sync_bloom_reuse = 0
         self.sync_bloom_send = 0
         self.sync_bloom_skip = 0
 
+        # progress of the background purge after a hard-kill, see Community._resume_purge
+        self.purge_deleted = 0
+        self.purge_remaining = 0
+
+        # walk steps taken by the WalkerScheduler and the seconds they were taken after they were due
+        self.walk_step_count = 0
+        self.walk_step_latency = 0.0
+        self.walk_step_latency_max = 0.0
+
         self.dispersy_acceptable_global_time_range = self._community.dispersy_acceptable_global_time_range
 
         self.dispersy_enable_candidate_walker = self._community.dispersy_enable_candidate_walker
@@ -315,15 +536,41 @@ class CommunityStatistics(Statistics):
         self.enable_debug_statistics(self._dispersy.statistics.are_debug_statistics_enabled())
 
     def increase_total_received_count(self, value):
-        self.msg_statistics.total_received_count += value
+        self._total_received_counter.increment(value)
+
+    def increase_walk_step(self, latency):
+        self.walk_step_count += 1
+        self.walk_step_latency += latency
+        if latency > self.walk_step_latency_max:
+            self.walk_step_latency_max = latency
+
+    @property
+    def walk_step_latency_average(self):
+        return self.walk_step_latency / self.walk_step_count if self.walk_step_count else 0.0
 
     def increase_discovered_candidates(self, value=1):
         self.total_candidates_discovered += value
         self._dispersy.statistics.total_candidates_discovered += value
 
+    def get_msg_counter(self, category, name=None):
+        """
+        Returns a handle that increments both the community and the Dispersy message statistics.
+
+        The handle remains valid until enable_debug_statistics is called.
+        """
+        if not self.msg_statistics._enabled:
+            name = None
+        key = (category, name)
+        try:
+            return self._msg_counters[key]
+        except KeyError:
+            handle = self._msg_counters[key] = CounterGroup(
+                (self.msg_statistics.get_counter(category, name),
+                 self._dispersy.statistics.msg_statistics.get_counter(category, name)))
+            return handle
+
     def increase_msg_count(self, category, name, value=1):
-        self.msg_statistics.increase_count(category, name, value)
-        self._dispersy.statistics.msg_statistics.increase_count(category, name, value)
+        self.get_msg_counter(category, name).increment(value)
 
     def increase_delay_msg_count(self, category, value=1):
         self.msg_statistics.increase_delay_count(category, value)
@@ -347,6 +594,7 @@ class CommunityStatistics(Statistics):
 
     def enable_debug_statistics(self, enabled):
         self.msg_statistics.enable(enabled)
+        self._msg_counters = {}
 
     def update(self, database=False):
         if database:
@@ -356,6 +604,9 @@ class CommunityStatistics(Statistics):
 
     def reset(self):
         self.total_candidates_discovered = 0
+        self.walk_step_count = 0
+        self.walk_step_latency = 0.0
+        self.walk_step_latency_max = 0.0
         self.msg_statistics.reset()
 
 
@@ -363,16 +614,26 @@ class RuntimeStatistic(object):
 
     def __init__(self):
         self._count = 0
+        self._samples = 0
         self._duration = 0.0
+        # binary exponent of the duration: number of samples
+        self._histogram = defaultdict(int)
+        # number of samples that took no measurable time, frexp would file these under 1.0 seconds
+        self._zero_samples = 0
 
     @property
     def count(self):
-        " Returns the number of times a method was called. "
+        " Returns the (estimated, when sampling) number of times a method was called. "
         return self._count
 
+    @property
+    def samples(self):
+        " Returns the number of calls that were actually measured. "
+        return self._samples
+
     @property
     def duration(self):
-        " Returns the cumulative time spent in a method. "
+        " Returns the (estimated, when sampling) cumulative time spent in a method. "
         return self._duration
 
     @property
@@ -380,14 +641,54 @@ class RuntimeStatistic(object):
         " Returns the average time spent in a method. "
         return self._duration / self._count
 
-    def increment(self, duration):
-        " Increase self.count with 1 and self.duration with DURATION. "
+    @property
+    def histogram(self):
+        " Returns a sorted list with (upper bound in seconds, samples) tuples. "
+        histogram = [(2.0 ** exponent, samples) for exponent, samples in sorted(self._histogram.iteritems())]
+        if self._zero_samples:
+            histogram.insert(0, (0.0, self._zero_samples))
+        return histogram
+
+    def increment(self, duration, weight=1):
+        """
+        Increase self.count with WEIGHT and self.duration with DURATION * WEIGHT.
+
+        WEIGHT is the inverse of the sample rate, i.e. the number of calls this measurement represents.
+        """
         assert isinstance(duration, float), type(duration)
-        self._duration += duration
-        self._count += 1
+        self._duration += duration * weight
+        self._count += weight
+        self._samples += 1
+        if duration > 0.0:
+            self._histogram[frexp(duration)[1]] += 1
+        else:
+            self._zero_samples += 1
 
     def get_dict(self, **kargs):
         " Returns a dictionary with the statistics. "
-        return dict(count=self.count, duration=self.duration, average=self.average, **kargs)
+        return dict(count=self.count, duration=self.duration, average=self.average, samples=self.samples,
+                    histogram=self.histogram, **kargs)
+
+
+class RuntimeStatisticSettings(object):
+
+    """
+    Global switches for the attach_runtime_statistics decorator.
+
+    When ENABLED is False decorated functions are called without any bookkeeping.  Otherwise a fraction of
+    SAMPLE_RATE calls is measured, unless the decorator was given its own sample rate.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.sample_rate = 1.0
+
+    def configure(self, enabled, sample_rate=1.0):
+        assert isinstance(enabled, bool), type(enabled)
+        assert isinstance(sample_rate, float), type(sample_rate)
+        assert 0.0 < sample_rate <= 1.0, sample_rate
+        self.enabled = enabled
+        self.sample_rate = sample_rate
 
 _runtime_statistics = defaultdict(RuntimeStatistic)
+_runtime_statistics_settings = RuntimeStatisticSettings()
@@ -1,12 +1,14 @@
+from collections import OrderedDict
 from threading import Lock
 
 from twisted.internet import reactor
 from twisted.internet.base import DelayedCall
 from twisted.internet.defer import Deferred, DeferredList
 from twisted.internet.task import LoopingCall
+from twisted.python.failure import Failure
 from twisted.python.threadable import isInIOThread
 
-from .util import blocking_call_on_reactor_thread
+from .util import blockingCallFromThread
 
 CLEANUP_FREQUENCY = 100
 
@@ -16,6 +18,10 @@ class TaskManager(object):
     """
     Provides a set of tools to mantain a list of twisted "tasks" (Deferred, LoopingCall, DelayedCall) that are to be
     executed during the lifetime of an arbitrary object, usually getting killed with it.
+
+    Deferreds and DelayedCalls remove themselves from the registry once they have fired, so the registry only holds
+    tasks that can still be cancelled.  LoopingCalls are removed when cancelled, or by the (amortized) cleanup pass
+    once they have stopped by themselves.
     """
     _reactor = reactor
 
@@ -53,23 +59,37 @@ class TaskManager(object):
             else:
                 raise ValueError("Expecting Deferred or LoopingCall if task is delayed")
 
-            task = (dc, task)
+            entry = (dc, task)
+        else:
+            entry = task
 
         self._maybe_clean_task_list()
         with self._task_lock:
-            self._pending_tasks[name] = task
-        return task
+            self._pending_tasks[name] = entry
+
+        # the completion hooks must be attached after ENTRY is stored, an already fired Deferred will remove itself
+        # immediately
+        if isinstance(task, Deferred):
+            self._remove_on_fire(name, entry, task)
+        elif isinstance(task, DelayedCall):
+            self._remove_on_call(name, entry, task)
+        return entry
 
-    @blocking_call_on_reactor_thread
     def cancel_pending_task(self, name):
         """
         Cancels the named task
         """
-        self._maybe_clean_task_list()
+        if isInIOThread():
+            self._cancel_pending_task(name)
+        else:
+            blockingCallFromThread(reactor, self._cancel_pending_task, name)
+
+    def _cancel_pending_task(self, name):
         is_active, stopfn = self._get_isactive_stopper(name)
+        with self._task_lock:
+            self._pending_tasks.pop(name, None)
         if is_active and stopfn:
             stopfn()
-            self._pending_tasks.pop(name)
 
     def cancel_all_pending_tasks(self):
         """
@@ -93,11 +113,10 @@ class TaskManager(object):
         Returns a deferred that will fire when all registered Deferreds are done.
         """
         assert isInIOThread()
-        self._maybe_clean_task_list()
         return DeferredList(self._iter_deferreds())
 
     def _iter_deferreds(self):
-        for task in self._pending_tasks.itervalues():
+        for task in self._pending_tasks.values():
             if isinstance(task, Deferred):
                 yield task
 
@@ -126,16 +145,138 @@ class TaskManager(object):
 
         return do_get(task)
 
+    def _remove_task(self, name, entry):
+        """
+        Removes the task registered under NAME, but only when it is still ENTRY (it may have been replaced).
+        """
+        with self._task_lock:
+            if self._pending_tasks.get(name) is entry:
+                del self._pending_tasks[name]
+
+    def _remove_on_fire(self, name, entry, deferred):
+        def remove(result):
+            self._remove_task(name, entry)
+            return result
+        deferred.addBoth(remove)
+
+    def _remove_on_call(self, name, entry, delayed_call):
+        func = delayed_call.func
+
+        def remove_and_call(*args, **kargs):
+            self._remove_task(name, entry)
+            return func(*args, **kargs)
+        remove_and_call.__name__ = getattr(func, "__name__", "remove_and_call")
+        delayed_call.func = remove_and_call
+
     def _maybe_clean_task_list(self):
         """
         Removes finished tasks from the task list.
+
+        Only tasks that can not remove themselves (i.e. LoopingCalls that stopped on their own) are left behind, hence
+        the scan runs once every max(CLEANUP_FREQUENCY, len(pending tasks)) calls, keeping registration amortized O(1).
         """
         if self._cleanup_counter:
             self._cleanup_counter -= 1
         else:
-            self._cleaup_counter = CLEANUP_FREQUENCY
-            for name in self._pending_tasks.keys():
-                if not self.is_pending_task_active(name):
-                    self._pending_tasks.pop(name)
+            with self._task_lock:
+                for name in self._pending_tasks.keys():
+                    if not self.is_pending_task_active(name):
+                        self._pending_tasks.pop(name)
+                self._cleanup_counter = max(CLEANUP_FREQUENCY, len(self._pending_tasks))
+
+
+class _TimerGroup(object):
+
+    """
+    A single LoopingCall that runs all CoalescedLoopingCalls sharing the same clock and interval.
+    """
+
+    def __init__(self, clock, interval):
+        self._key = (clock, interval)
+        self._members = OrderedDict()
+        self._looping_call = LoopingCall(self._run)
+        self._looping_call.clock = clock
+        self._interval = interval
+
+    def add(self, member):
+        self._members[member] = None
+        if not self._looping_call.running:
+            self._looping_call.start(self._interval, now=False)
+
+    def remove(self, member):
+        del self._members[member]
+        if not self._members:
+            if self._looping_call.running:
+                self._looping_call.stop()
+            del _timer_groups[self._key]
+
+    def _run(self):
+        # copy, as members may stop (and remove themselves) while running
+        for member in self._members.keys():
+            if member.running:
+                member._call()
+
+
+_timer_groups = {}
+
+
+class CoalescedLoopingCall(LoopingCall):
+
+    """
+    A LoopingCall that shares one timer with all other CoalescedLoopingCalls running at the same interval.
+
+    Hundreds of communities each scheduling the same periodic maintenance would otherwise result in hundreds of
+    reactor timers.  The price is precision: the first call after start (when NOW is False) happens at the next tick
+    of the shared timer, which is at most INTERVAL seconds away.
+
+    CoalescedLoopingCall can be given to TaskManager.register_task like any other LoopingCall.
+    """
+
+    def start(self, interval, now=True):
+        assert not self.running, "Tried to start an already running CoalescedLoopingCall."
+        if interval < 0:
+            raise ValueError("interval must be >= 0")
+
+        self.running = True
+        self.interval = interval
+        self._stopped = deferred = Deferred()
+        self.starttime = self.clock.seconds()
+
+        key = (self.clock, interval)
+        group = _timer_groups.get(key)
+        if group is None:
+            group = _timer_groups[key] = _TimerGroup(self.clock, interval)
+        self._group = group
+        group.add(self)
+
+        if now:
+            self._call()
+        return deferred
+
+    def stop(self):
+        assert self.running, "Tried to stop a CoalescedLoopingCall that was not running."
+        self._leave()
+        deferred, self._stopped = self._stopped, None
+        deferred.callback(self)
+
+    def reset(self):
+        assert self.running, "Tried to reset a CoalescedLoopingCall that was not running."
+
+    def _leave(self):
+        self.running = False
+        self._group.remove(self)
+        self._group = None
+
+    def _call(self):
+        try:
+            self.f(*self.a, **self.kw)
+        except:
+            # same as LoopingCall: an exception stops the call and is passed to the deferred returned by start
+            failure = Failure()
+            if self.running:
+                self._leave()
+                deferred, self._stopped = self._stopped, None
+                deferred.errback(failure)
+
 
-__all__ = ["TaskManager"]
+__all__ = ["TaskManager", "CoalescedLoopingCall"]
@@ -304,10 +304,10 @@ class DebugNode(object):
     @blocking_call_on_reactor_thread
     def fetch_packets(self, message_names, mid=None):
         if mid:
-            return [str(packet) for packet, in list(self._dispersy.database.execute(u"SELECT packet FROM sync, member WHERE sync.member = member.id "
+            return [str(packet) for packet, in list(self._dispersy.database.execute(u"SELECT packet FROM sync, sync_packet, member WHERE sync.id = sync_packet.sync AND sync.member = member.id "
                                                                                     u"AND mid = ? AND meta_message IN (" + ", ".join("?" * len(message_names)) + ") ORDER BY global_time, packet",
                                                                                 [buffer(mid), ] + [self._community.get_meta_message(name).database_id for name in message_names]))]
-        return [str(packet) for packet, in list(self._dispersy.database.execute(u"SELECT packet FROM sync WHERE meta_message IN (" + ", ".join("?" * len(message_names)) + ") ORDER BY global_time, packet",
+        return [str(packet) for packet, in list(self._dispersy.database.execute(u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE meta_message IN (" + ", ".join("?" * len(message_names)) + ") ORDER BY global_time, packet",
                                                                                 [self._community.get_meta_message(name).database_id for name in message_names]))]
 
     @blocking_call_on_reactor_thread
@@ -330,7 +330,7 @@ class DebugNode(object):
 
         for message in messages:
             try:
-                undone, packet = self._dispersy.database.execute(u"SELECT undone, packet FROM sync, member WHERE sync.member = member.id AND community = ? AND mid = ? AND global_time = ?",
+                undone, packet = self._dispersy.database.execute(u"SELECT undone, packet FROM sync, sync_packet, member WHERE sync.id = sync_packet.sync AND sync.member = member.id AND community = ? AND mid = ? AND global_time = ?",
                                                          (self._community.database_id, buffer(message.authentication.member.mid), message.distribution.global_time)).next()
                 self._testclass.assertEqual(undone, 0, "Message is undone")
                 self._testclass.assertEqual(str(packet), message.packet)
@@ -345,7 +345,7 @@ class DebugNode(object):
 
         for message in messages:
             try:
-                packet, = self._dispersy.database.execute(u"SELECT packet FROM sync, member WHERE sync.member = member.id AND community = ? AND mid = ? AND global_time = ?",
+                packet, = self._dispersy.database.execute(u"SELECT packet FROM sync, sync_packet, member WHERE sync.id = sync_packet.sync AND sync.member = member.id AND community = ? AND mid = ? AND global_time = ?",
                                                          (self._community.database_id, buffer(message.authentication.member.mid), message.distribution.global_time)).next()
 
                 self._testclass.assertNotEqual(str(packet), message.packet)
@@ -366,7 +366,7 @@ class DebugNode(object):
                 self._testclass.assertGreater(undone, 0, "Message is not undone")
                 if undone_by:
                     undone, = self._dispersy.database.execute(
-                        u"SELECT packet FROM sync WHERE id = ? ",
+                        u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id WHERE id = ? ",
                         (undone,)).next()
                     self._testclass.assertEqual(str(undone), undone_by.packet)
 
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from ..bloomfilter import BloomFilter
+from ..bloomfilter import BloomFilter, MembershipFilter
 
 
 class TestBloomFilter(TestCase):
@@ -116,3 +116,39 @@ class TestBloomFilter(TestCase):
             self.assertTrue(all(str(i) in bloom for i in xrange(n_capacity)))
             false_positives = sum(str(i) in bloom for i in xrange(n_capacity, n_capacity + 10000))
             self.assertAlmostEqual(1.0 * false_positives / 10000, f_error_rate, delta=0.05)
+
+
+class TestMembershipFilter(TestCase):
+
+    def test_no_false_negatives(self):
+        """
+        Testing that every added key is found.
+        """
+        membership = MembershipFilter(1000)
+        membership.add_keys((member, global_time) for member in xrange(10) for global_time in xrange(100))
+        self.assertTrue(all((member, global_time) in membership for member in xrange(10) for global_time in xrange(100)))
+        self.assertEqual(membership.count, 1000)
+        self.assertFalse(membership.is_full)
+
+        membership.add((10, 0))
+        self.assertTrue(membership.is_full)
+
+    def test_false_positives(self):
+        """
+        Testing false positives.
+        """
+        for f_error_rate, n_capacity in [(0.01, 1000), (0.05, 1000), (0.1, 10000)]:
+            membership = MembershipFilter(n_capacity, f_error_rate)
+            membership.add_keys((1, i) for i in xrange(n_capacity))
+            false_positives = sum((2, i) in membership for i in xrange(10000))
+            self.assertAlmostEqual(1.0 * false_positives / 10000, f_error_rate, delta=0.02)
+
+    def test_clear(self):
+        """
+        Testing MembershipFilter.clear()
+        """
+        membership = MembershipFilter(100)
+        membership.add_keys(xrange(100))
+        membership.clear()
+        self.assertEqual(membership.count, 0)
+        self.assertFalse(any(i in membership for i in xrange(100)))
@@ -0,0 +1,113 @@
+from sqlite3 import OperationalError
+from unittest import TestCase
+
+from twisted.internet.task import Clock
+
+from .dispersytestclass import DispersyTestFunc
+from ..commitscheduler import COMMIT_RETRY_DELAY, CommitScheduler
+
+
+class FakeDatabase(object):
+
+    file_path = u":memory:"
+
+    def __init__(self):
+        self.commits = 0
+        self.postpone = False
+        self.locked = False
+
+    def commit(self):
+        if self.locked:
+            raise OperationalError("database is locked")
+        if self.postpone:
+            return False
+        self.commits += 1
+
+
+class TestCommitScheduler(TestCase):
+
+    def setUp(self):
+        super(TestCommitScheduler, self).setUp()
+        self.database = FakeDatabase()
+        self.scheduler = CommitScheduler(self.database, max_latency=0.05, max_pending=10)
+        self.scheduler._reactor = self.clock = Clock()
+
+    def test_max_latency(self):
+        """
+        Rows from several batches share one commit, made MAX_LATENCY seconds after the first row was stored.
+        """
+        self.scheduler.add(3)
+        self.clock.advance(0.03)
+        self.scheduler.add(2)
+        self.assertEqual(self.database.commits, 0)
+
+        self.clock.advance(0.02)
+        self.assertEqual(self.database.commits, 1)
+        self.assertEqual((self.scheduler.commit_count, self.scheduler.commit_rows), (1, 5))
+        self.assertEqual(self.scheduler.pending, 0)
+        self.assertFalse(self.clock.getDelayedCalls())
+
+    def test_max_pending(self):
+        self.scheduler.add(6)
+        self.scheduler.add(4)
+        self.assertEqual(self.database.commits, 1)
+        self.assertFalse(self.clock.getDelayedCalls())
+
+    def test_commit(self):
+        """
+        An explicit commit includes the waiting rows and cancels the scheduled commit.
+        """
+        self.scheduler.add(3)
+        self.assertTrue(self.scheduler.commit())
+        self.assertEqual((self.database.commits, self.scheduler.commit_rows), (1, 3))
+        self.assertFalse(self.clock.getDelayedCalls())
+
+        # within a 'with database' block the commit is performed by the database itself
+        self.database.postpone = True
+        self.scheduler.add(1)
+        self.assertFalse(self.scheduler.commit())
+        self.assertEqual((self.scheduler.commit_count, self.scheduler.pending), (1, 0))
+
+    def test_commit_failure(self):
+        """
+        The rows of a failed commit remain pending and the commit is retried.
+        """
+        self.database.locked = True
+        self.scheduler.add(3)
+        self.clock.advance(0.05)
+        self.assertEqual((self.scheduler.commit_count, self.scheduler.commit_failures), (0, 1))
+        self.assertEqual(self.scheduler.pending, 3)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+        self.database.locked = False
+        self.scheduler.add(2)
+        self.clock.advance(COMMIT_RETRY_DELAY)
+        self.assertEqual((self.database.commits, self.scheduler.commit_rows), (1, 5))
+        self.assertEqual(self.scheduler.pending, 0)
+        self.assertFalse(self.clock.getDelayedCalls())
+
+
+class TestStoreUpdateForwardCommits(DispersyTestFunc):
+
+    def test_commits(self):
+        """
+        Messages from others are left to the commit scheduler, messages created by my_member are committed at once.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+        scheduler = node._dispersy.commit_scheduler
+        # the test must not depend on the timing of the scheduled commit
+        scheduler._max_latency = 60.0
+
+        pending = scheduler.pending
+        message = other.create_full_sync_text("Message from other", 10)
+        node.give_message(message, other)
+        node.assert_is_stored(message)
+        self.assertEqual(scheduler.pending, pending + 1)
+
+        commit_count = scheduler.commit_count
+        message = node.create_full_sync_text("Message from node", 11)
+        node.call(node._dispersy.store_update_forward, [message], True, True, False)
+        self.assertEqual(scheduler.commit_count, commit_count + 1)
+        self.assertEqual(scheduler.pending, 0)
+        self.assertEqual(node._dispersy.statistics.snapshot()[u"commit_count"], commit_count + 1)
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from ..crypto import ECCrypto
+from ..crypto import ECCrypto, KeyCache
 
 
 class TestLowLevelCrypto(TestCase):
@@ -58,6 +58,38 @@ class TestLowLevelCrypto(TestCase):
             ec_clone = self.crypto.key_from_private_bin(private)
             self.assertTrue(self.crypto.is_valid_signature(ec_clone, data, signature))
 
+    def test_key_cache(self):
+        """
+        Parsing the same binary key twice returns the cached key, invalid keys are never cached.
+        """
+        crypto = ECCrypto(key_cache_size=2)
+        private_cache, public_cache = crypto.key_caches
+        ec = crypto.generate_key(u"very-low")
+        public = crypto.key_to_bin(ec.pub())
+        private = crypto.key_to_bin(ec)
+
+        self.assertIs(crypto.key_from_public_bin(public), crypto.key_from_public_bin(public))
+        self.assertEqual((public_cache.hits, public_cache.misses), (1, 1))
+        self.assertTrue(crypto.is_valid_public_bin(public))
+        self.assertEqual((public_cache.hits, public_cache.misses), (1, 1))
+
+        # a public key is not a valid private key, even when it is cached
+        self.assertFalse(crypto.is_valid_private_bin(public))
+        self.assertTrue(crypto.is_valid_private_bin(private))
+        self.assertTrue(crypto.key_from_private_bin(private).has_secret_key())
+        self.assertEqual(len(private_cache), 1)
+
+        self.assertFalse(crypto.is_valid_public_bin("invalid"))
+        self.assertNotIn("invalid", public_cache)
+
+    def test_key_cache_size(self):
+        cache = KeyCache(size=2)
+        for string in ("a", "b", "a", "c"):
+            cache.get(string, str.upper)
+        # b was used least recently
+        self.assertEqual(sorted(cache._keys), ["a", "c"])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
     def test_performance(self):
         from time import time
         import sys
@@ -1,9 +1,12 @@
 import os
 import shutil
+import sqlite3
 from unittest import TestCase
 from tempfile import mkdtemp
 
-from ..dispersydatabase import DispersyDatabase, DatabaseVersionTooLowError, DatabaseVersionTooHighError
+from ..database import DATABASE_PROFILES
+from ..dispersydatabase import DispersyDatabase, DatabaseVersionTooLowError, DatabaseVersionTooHighError, schema
+from ..tool.sync_schema_benchmark import DOWNGRADE_TO_21
 
 
 class TestDatabase(TestCase):
@@ -37,7 +40,76 @@ class TestDatabase(TestCase):
 
         database = DispersyDatabase(tmp_path)
         database.open()
-        self.assertEqual(database.database_version, 21)
+        self.assertEqual(database.database_version, 22)
+
+    def create_version_21(self, path):
+        """
+        Creates a version 21 database at PATH with five messages, the message with id 6 was removed.
+        """
+        connection = sqlite3.connect(path)
+        connection.executescript(schema)
+        connection.executescript(DOWNGRADE_TO_21)
+        connection.executemany(u"INSERT INTO sync (id, community, member, global_time, meta_message, packet) VALUES (?, 1, 1, ?, 1, ?)",
+                               [(index, index * 10, buffer("packet-%d" % index)) for index in xrange(1, 7)])
+        connection.execute(u"DELETE FROM sync WHERE id = 6")
+        connection.commit()
+        connection.close()
+
+    def test_upgrade_moves_packets(self):
+        """
+        Upgrading to version 22 moves the packets into the sync_packet table.
+        """
+        tmp_path = os.path.join(self.TMP_DATA_DIR, u"dispersy.db")
+        self.create_version_21(tmp_path)
+
+        database = DispersyDatabase(tmp_path)
+        database.open()
+        self.assertEqual(database.database_version, 22)
+        self.assertNotIn(u"packet", [column for _, column, _, _, _, _ in database.execute(u"PRAGMA table_info(sync)")])
+        self.assertEqual(list(database.execute(u"SELECT sync.id, sync.global_time, packet FROM sync "
+                                               u"JOIN sync_packet ON sync_packet.sync = sync.id ORDER BY sync.id")),
+                         [(index, index * 10, buffer("packet-%d" % index)) for index in xrange(1, 6)])
+
+        # the id of the removed message is not used again
+        self.assertEqual(database.execute(u"INSERT INTO sync (community, member, global_time, meta_message) VALUES (1, 1, 70, 1)",
+                                          get_lastrowid=True), 7)
+
+        # removing a row from the sync table removes its packet
+        database.execute(u"DELETE FROM sync WHERE id = 3")
+        self.assertEqual([sync for sync, in database.execute(u"SELECT sync FROM sync_packet ORDER BY sync")], [1, 2, 4, 5])
+        database.close()
+
+    def test_upgrade_interrupted(self):
+        """
+        An interrupted upgrade to version 22 leaves the version 21 database intact and is performed again later.
+        """
+        tmp_path = os.path.join(self.TMP_DATA_DIR, u"dispersy.db")
+        self.create_version_21(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        # fail at the end of the upgrade
+        connection.execute(u"CREATE TRIGGER interrupt BEFORE UPDATE ON option WHEN NEW.value = '22' "
+                           u"BEGIN SELECT RAISE(ABORT, 'interrupted'); END")
+        connection.commit()
+        connection.close()
+
+        database = DispersyDatabase(tmp_path)
+        self.assertRaises(sqlite3.IntegrityError, database.open)
+        database._connection.close()
+
+        connection = sqlite3.connect(tmp_path)
+        self.assertEqual(connection.execute(u"SELECT value FROM option WHERE key = 'database_version'").fetchall(),
+                         [(u"21",)])
+        self.assertEqual(connection.execute(u"SELECT COUNT(*) FROM sync WHERE packet IS NOT NULL").fetchall(), [(5,)])
+        self.assertEqual(connection.execute(u"SELECT name FROM sqlite_master WHERE name IN ('sync_packet', 'sync_new')").fetchall(), [])
+        connection.execute(u"DROP TRIGGER interrupt")
+        connection.commit()
+        connection.close()
+
+        database = DispersyDatabase(tmp_path)
+        database.open()
+        self.assertEqual(database.database_version, 22)
+        self.assertEqual(database.execute(u"SELECT COUNT(*) FROM sync_packet").fetchall(), [(5,)])
+        database.close()
 
     def test_upgrade_version_too_high(self):
         minimum_version_path = os.path.abspath(os.path.join(self.TEST_DATA_DIR, u"dispersy_v1337.db"))
@@ -46,3 +118,36 @@ class TestDatabase(TestCase):
 
         database = DispersyDatabase(tmp_path)
         self.assertRaises(DatabaseVersionTooHighError, database.open)
+
+    def test_default_profile(self):
+        database = DispersyDatabase(os.path.join(self.TMP_DATA_DIR, u"dispersy.db"))
+        database.open()
+        self.assertEqual(database.profile.name, u"default")
+        self.assertEqual((database.settings[u"page_size"], database.settings[u"journal_mode"],
+                          database.settings[u"locking_mode"], database.settings[u"synchronous"]),
+                         (8192, u"WAL", u"EXCLUSIVE", 1))
+        database.close()
+
+    def test_profiles(self):
+        """
+        Opening an existing database with another profile applies that profile.
+        """
+        tmp_path = os.path.join(self.TMP_DATA_DIR, u"dispersy.db")
+
+        database = DispersyDatabase(tmp_path, DATABASE_PROFILES[u"conservative"])
+        database.open()
+        self.assertEqual((database.settings[u"journal_mode"], database.settings[u"locking_mode"],
+                          database.settings[u"synchronous"], database.settings[u"cache_size"]),
+                         (u"WAL", u"NORMAL", 2, -2000))
+        database.execute(u"INSERT INTO option (key, value) VALUES (?, ?)", (u"test", buffer("value")))
+        database.close()
+        # the write-ahead log is truncated when the database is closed
+        self.assertFalse(os.path.exists(tmp_path + u"-wal") and os.path.getsize(tmp_path + u"-wal"))
+
+        database = DispersyDatabase(tmp_path, DATABASE_PROFILES[u"unsynchronized"])
+        database.open()
+        self.assertEqual((database.settings[u"journal_mode"], database.settings[u"synchronous"],
+                          database.settings[u"temp_store"]), (u"MEMORY", 0, 2))
+        self.assertEqual(list(database.execute(u"SELECT value FROM option WHERE key = ?", (u"test",))),
+                         [(buffer("value"),)])
+        database.close()
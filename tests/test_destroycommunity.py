@@ -1,4 +1,7 @@
+from time import sleep
+
 from .dispersytestclass import DispersyTestFunc
+from .. import community
 
 
 class TestDestroyCommunity(DispersyTestFunc):
@@ -22,8 +25,39 @@ class TestDestroyCommunity(DispersyTestFunc):
 
         node.give_message(dmessage, self._mm)
 
+        # the messages are removed in the background
+        for _ in xrange(50):
+            if not node.count_messages(message):
+                break
+            sleep(0.1)
         node.assert_count(message, 0)
 
+    def test_hard_kill_chunks(self):
+        """
+        Test that the messages of a hard killed community are removed in chunks and that the destroy message is kept.
+        """
+        node, = self.create_nodes(1)
+
+        messages = [node.create_full_sync_text("Should be removed %d" % global_time, global_time)
+                    for global_time in xrange(10, 30)]
+        node.give_messages(messages, node)
+        node.assert_count(messages[0], 20)
+
+        chunk_size, community.PURGE_CHUNK_SIZE = community.PURGE_CHUNK_SIZE, 3
+        try:
+            dmessage = self._mm.create_destroy_community(u"hard-kill")
+            node.give_message(dmessage, self._mm)
+
+            for _ in xrange(50):
+                if not node.count_messages(messages[0]):
+                    break
+                sleep(0.1)
+        finally:
+            community.PURGE_CHUNK_SIZE = chunk_size
+
+        node.assert_count(messages[0], 0)
+        node.assert_count(dmessage, 1)
+
     def test_hard_kill_without_permission(self):
         node, other = self.create_nodes(2)
         node.send_identity(other)
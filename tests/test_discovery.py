@@ -1,6 +1,12 @@
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
 from twisted.internet.defer import inlineCallbacks
 from .dispersytestclass import DispersyTestFunc
-from ..discovery.community import DiscoveryCommunity, BOOTSTRAP_FILE_ENVNAME
+from ..candidate import WalkCandidate
+from ..discovery.community import (DiscoveryCommunity, BOOTSTRAP_FILE_ENVNAME, PeerCache, PossibleTasteBuddy,
+                                   PreferenceBits, TasteBuddyIndex, count_bits)
 from ..discovery.bootstrap import _DEFAULT_ADDRESSES
 import os
 import time
@@ -74,3 +80,169 @@ class TestDiscovery(DispersyTestFunc):
 
     def create_nodes(self, *args, **kwargs):
         return super(TestDiscovery, self).create_nodes(*args, community_class=DiscoveryCommunity, **kwargs)
+
+
+class TestTasteBuddyIndex(TestCase):
+
+    def setUp(self):
+        self.candidate = WalkCandidate(("127.0.0.1", 1), False, ("127.0.0.1", 1), ("127.0.0.1", 1), u"unknown")
+
+    def create_possible(self, index, overlap, timestamp=1.0):
+        return PossibleTasteBuddy(overlap, set(), timestamp, str(index) * 20, self.candidate)
+
+    def test_order(self):
+        index = TasteBuddyIndex()
+        possibles = [self.create_possible(i, overlap) for i, overlap in enumerate([3, 1, 4, 2])]
+        for possible in possibles:
+            index.add(possible)
+
+        self.assertEqual([possible.overlap for possible in index], [4, 3, 2, 1])
+        self.assertIs(index.highest(), possibles[2])
+        self.assertIs(index.lowest(), possibles[1])
+
+        possibles[1].overlap = 5
+        index.reorder(possibles[1])
+        self.assertIs(index.pop_highest(), possibles[1])
+        self.assertEqual([possible.overlap for possible in index], [4, 3, 2])
+
+    def test_replace(self):
+        index = TasteBuddyIndex()
+        index.add(self.create_possible(1, 1))
+        replacement = self.create_possible(1, 2)
+        index.add(replacement)
+
+        self.assertEqual(len(index), 1)
+        self.assertIs(index.get_mid("1" * 20), replacement)
+
+    def test_limit(self):
+        index = TasteBuddyIndex(limit=2)
+        for i, overlap in enumerate([2, 1, 3]):
+            index.add(self.create_possible(i, overlap))
+
+        self.assertEqual([possible.overlap for possible in index], [3, 2])
+        self.assertIsNone(index.get_mid("1" * 20))
+
+    def test_expire(self):
+        index = TasteBuddyIndex()
+        old = self.create_possible(1, 1, timestamp=10.0)
+        touched = self.create_possible(2, 1, timestamp=10.0)
+        new = self.create_possible(3, 1, timestamp=30.0)
+        for possible in (old, touched, new):
+            index.add(possible)
+        index.touch(touched, 40.0)
+
+        self.assertEqual(index.expire(20.0), [old])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.expire(35.0), [new])
+        self.assertEqual(index.expire(50.0), [touched])
+        self.assertEqual(len(index), 0)
+
+
+class TestPreferenceBits(TestCase):
+
+    def test_overlap(self):
+        preference_bits = PreferenceBits()
+        mine = preference_bits.get(["a" * 20, "b" * 20, "c" * 20])
+        his = preference_bits.get(["b" * 20, "c" * 20, "d" * 20])
+
+        self.assertEqual(count_bits(mine & his), 2)
+        self.assertEqual(len(preference_bits), 4)
+
+    def test_no_assign(self):
+        preference_bits = PreferenceBits()
+        mine = preference_bits.get(["a" * 20])
+
+        self.assertEqual(preference_bits.get(["a" * 20, "e" * 20], assign=False), mine)
+        self.assertEqual(preference_bits.get(["e" * 20], assign=False), 0)
+        self.assertEqual(len(preference_bits), 1)
+
+
+class TestPeerCache(TestCase):
+
+    class FakeCommunity(object):
+
+        class FakeDispersy(object):
+            _wan_address = ("0.0.0.0", 0)
+
+        _dispersy = FakeDispersy()
+
+        def register_task(self, name, task):
+            class NotStarted(object):
+                def start(self, *args, **kargs):
+                    pass
+            return NotStarted()
+
+        def create_or_update_walkcandidate(self, sock_addr, lan_address, wan_address, tunnel, connection_type):
+            return WalkCandidate(sock_addr, tunnel, lan_address, wan_address, connection_type)
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.filename = os.path.join(self.directory, "peercache.txt")
+        self.community = self.FakeCommunity()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def create_candidate(self, port):
+        return self.community.create_or_update_walkcandidate(("1.2.3.4", port), ("1.2.3.4", port), ("1.2.3.4", port),
+                                                             False, u"public")
+
+    def count_lines(self):
+        with open(self.filename) as fp:
+            return len([line for line in fp if not line.startswith("#")])
+
+    def test_journal(self):
+        cache = PeerCache(self.filename, self.community)
+        candidates = [self.create_candidate(port) for port in (1, 2, 3)]
+        for candidate in candidates:
+            cache.add_or_update_peer(candidate)
+        cache.clean_and_save()
+        self.assertEqual(self.count_lines(), 3)
+
+        # nothing changed, nothing is written
+        cache.clean_and_save()
+        self.assertEqual(self.count_lines(), 3)
+
+        # only the changed peer is appended
+        cache.set_last_checked(candidates[0], 42.0)
+        cache.clean_and_save()
+        self.assertEqual(self.count_lines(), 4)
+
+        loaded = PeerCache(self.filename, self.community)
+        self.assertEqual(len(loaded.walkcandidates), 3)
+        self.assertEqual(loaded.get_peer_info(candidates[0])["last_checked"], 42.0)
+
+    def test_lazy_load(self):
+        cache = PeerCache(self.filename, self.community)
+        cache.add_or_update_peer(self.create_candidate(1))
+        cache.clean_and_save()
+
+        loaded = PeerCache(self.filename, self.community)
+        loaded.clean_and_save()
+        self.assertEqual(self.count_lines(), 1)
+        self.assertEqual(len(loaded.walkcandidates), 1)
+
+    def test_get_peer(self):
+        cache = PeerCache(self.filename, self.community)
+        candidates = [self.create_candidate(port) for port in (1, 2, 3)]
+        for candidate in candidates:
+            cache.add_or_update_peer(candidate)
+        cache.set_last_checked(candidates[0], 10.0)
+        cache.set_last_checked(candidates[1], 5.0)
+        cache.set_last_checked(candidates[2], 20.0)
+        self.assertEqual(cache.get_peer(), candidates[1])
+
+        cache.set_last_checked(candidates[1], 30.0)
+        self.assertEqual(cache.get_peer(), candidates[0])
+
+    def test_limit(self):
+        cache = PeerCache(self.filename, self.community, limit=2)
+        candidates = [self.create_candidate(port) for port in (1, 2, 3)]
+        for candidate in candidates:
+            cache.add_or_update_peer(candidate)
+        cache.walkcandidates[candidates[0]]["last_seen"] = 0.0
+        cache.clean_and_save()
+
+        # the least recently seen peer is removed
+        self.assertEqual(sorted(cache.walkcandidates), sorted(candidates[1:]))
+        self.assertEqual(self.count_lines(), 2)
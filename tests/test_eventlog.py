@@ -0,0 +1,91 @@
+import os
+import threading
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from ..tracker.eventlog import TrackerEventLog
+
+
+class TestTrackerEventLog(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.filename = os.path.join(self.directory, "events.log")
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def read_events(self, filename=None):
+        with open(filename or self.filename) as fp:
+            return [line.split() for line in fp]
+
+    def test_record(self):
+        event_log = TrackerEventLog(self.filename)
+        event_log.record("BANDWIDTH", 1, 2)
+        event_log.record("COMMUNITY", 3, 4, 5)
+        event_log.stop()
+
+        self.assertEqual(self.read_events(), [["BANDWIDTH", "1", "2"], ["COMMUNITY", "3", "4", "5"]])
+
+    def test_timestamps(self):
+        event_log = TrackerEventLog(self.filename, timestamps=True)
+        event_log.record("BANDWIDTH", 1, 2)
+        event_log.stop()
+
+        (timestamp, event, up, down), = self.read_events()
+        self.assertGreater(float(timestamp), 0.0)
+        self.assertEqual([event, up, down], ["BANDWIDTH", "1", "2"])
+
+    def test_stop_waits_for_writer(self):
+        """
+        Events recorded while the writer thread is busy are written when the log is stopped.
+        """
+        event_log = TrackerEventLog(self.filename)
+        event_log.record("BANDWIDTH", 1)
+        records = event_log._take()
+        # the writer thread holds the lock while it writes RECORDS
+        event_log._write_lock.acquire()
+
+        def writer():
+            event_log._write(records)
+            event_log._write_lock.release()
+        timer = threading.Timer(0.1, writer)
+        timer.start()
+
+        event_log.record("BANDWIDTH", 2)
+        event_log.stop()
+        timer.join()
+        self.assertEqual(self.read_events(), [["BANDWIDTH", "1"], ["BANDWIDTH", "2"]])
+
+    def test_sample(self):
+        event_log = TrackerEventLog(self.filename, sample_rates={"REQ_IN2": 3})
+        for i in xrange(9):
+            event_log.record("REQ_IN2", i)
+            event_log.record("BANDWIDTH", i)
+        event_log.stop()
+
+        events = self.read_events()
+        self.assertEqual([fields for fields in events if fields[0] == "REQ_IN2"],
+                         [["REQ_IN2", "0"], ["REQ_IN2", "3"], ["REQ_IN2", "6"]])
+        self.assertEqual(len([fields for fields in events if fields[0] == "BANDWIDTH"]), 9)
+
+    def test_dropped(self):
+        event_log = TrackerEventLog(self.filename, capacity=4)
+        for i in xrange(10):
+            event_log.record("BANDWIDTH", i)
+        self.assertEqual(event_log.dropped, 6)
+        event_log.stop()
+
+        self.assertEqual(self.read_events(), [["BANDWIDTH", str(i)] for i in xrange(4)] + [["DROPPED", "6"]])
+
+    def test_rotate(self):
+        event_log = TrackerEventLog(self.filename, capacity=4, max_bytes=1, backup_count=2)
+        for i in xrange(3):
+            event_log.record("BANDWIDTH", i)
+            event_log._write(event_log._take())
+        event_log.stop()
+
+        self.assertEqual(self.read_events(self.filename + ".1"), [["BANDWIDTH", "2"]])
+        self.assertEqual(self.read_events(self.filename + ".2"), [["BANDWIDTH", "1"]])
+        self.assertFalse(os.path.exists(self.filename + ".3"))
@@ -42,3 +42,24 @@ class TestIdenticalPayload(DispersyTestFunc):
         other.give_message(message, node)
 
         other.assert_is_stored(message)
+
+    def test_drop_identical_in_batch(self):
+        """
+        NODE creates five messages, OTHER receives two of them first and then all five in one batch.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        messages = [node.create_full_sync_text("Message %d" % i, 42 + i) for i in xrange(5)]
+
+        other.give_messages(messages[:2], node)
+        other.give_messages(messages, node)
+
+        other.assert_is_stored(messages=messages)
+        other.assert_count(messages[0], 5)
+
+        # every stored message is in the stored filter
+        stored_filter = other.call(lambda: other.community.stored_filter)
+        member_database_id = other.call(other._dispersy.get_member, mid=node.my_mid).database_id
+        for message in messages:
+            self.assertIn((member_database_id, message.distribution.global_time), stored_filter)
@@ -0,0 +1,107 @@
+from unittest import TestCase
+
+from twisted.internet.task import Clock
+
+from ..candidate import Candidate
+from ..endpoint import IPv8toDispersyAdapter, TUNNEL_PREFIX
+
+
+class FakeIPv8Endpoint(object):
+
+    _port = 7759
+
+    def __init__(self):
+        self.listeners = []
+        self.sent = []
+
+    def get_address(self):
+        return ("127.0.0.1", self._port)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def send(self, sock_addr, data):
+        self.sent.append((sock_addr, data))
+
+
+class FakeDispersy(object):
+
+    class statistics(object):
+        total_down = 0
+        total_up = 0
+        total_send = 0
+
+        @staticmethod
+        def dict_inc(*args):
+            pass
+
+    def __init__(self):
+        self.batches = []
+
+    def get_community(self, *args, **kwargs):
+        raise KeyError()
+
+    def on_incoming_packets(self, packets, cache, timestamp, source):
+        self.batches.append([(candidate.sock_addr, candidate.tunnel, data) for candidate, data in packets])
+
+
+class TestIPv8toDispersyAdapter(TestCase):
+
+    def create_adapter(self, **kwargs):
+        self.ipv8_endpoint = FakeIPv8Endpoint()
+        self.dispersy = FakeDispersy()
+        self.clock = Clock()
+        adapter = IPv8toDispersyAdapter(self.ipv8_endpoint, **kwargs)
+        adapter._reactor = self.clock
+        adapter.open(self.dispersy)
+        return adapter
+
+    def test_batch_per_reactor_iteration(self):
+        adapter = self.create_adapter()
+        packets = [(("1.2.3.4", port), "packet") for port in xrange(1, 6)]
+        for packet in packets:
+            adapter.on_packet(packet)
+        self.assertEqual(self.dispersy.batches, [])
+
+        self.clock.advance(0)
+        self.assertEqual(self.dispersy.batches, [[(sock_addr, False, data) for sock_addr, data in packets]])
+        self.assertFalse(self.clock.getDelayedCalls())
+
+    def test_max_batch_size(self):
+        adapter = self.create_adapter(max_batch_size=3, max_batch_latency=0.5)
+        for port in xrange(1, 6):
+            adapter.on_packet((("1.2.3.4", port), "packet"))
+        # the first three packets are handed over immediately
+        self.assertEqual([len(batch) for batch in self.dispersy.batches], [3])
+
+        self.clock.advance(0.4)
+        self.assertEqual([len(batch) for batch in self.dispersy.batches], [3])
+        self.clock.advance(0.1)
+        self.assertEqual([len(batch) for batch in self.dispersy.batches], [3, 2])
+
+    def test_tunnel_and_handlers(self):
+        adapter = self.create_adapter()
+        handled = []
+        adapter.listen_to("prefix", lambda sock_addr, data: handled.append((sock_addr, data)))
+
+        adapter.on_packet((("1.2.3.4", 1), TUNNEL_PREFIX + "tunneled"))
+        adapter.on_packet((("1.2.3.4", 2), "prefixdata"))
+        self.clock.advance(0)
+
+        self.assertEqual(handled, [(("1.2.3.4", 2), "data")])
+        self.assertEqual(self.dispersy.batches, [[(("1.2.3.4", 1), True, "tunneled")]])
+
+    def test_close(self):
+        adapter = self.create_adapter()
+        adapter.on_packet((("1.2.3.4", 1), "packet"))
+        adapter.close()
+        self.assertFalse(self.clock.getDelayedCalls())
+        self.assertEqual(self.dispersy.batches, [])
+
+    def test_send(self):
+        adapter = self.create_adapter()
+        candidates = [Candidate(("1.2.3.4", 1), False), Candidate(("1.2.3.4", 2), True)]
+        self.assertTrue(adapter.send(candidates, ["a", "b"], prefix="p"))
+        self.assertEqual(self.ipv8_endpoint.sent, [(("1.2.3.4", 1), "pa"), (("1.2.3.4", 1), "pb"),
+                                                   (("1.2.3.4", 2), TUNNEL_PREFIX + "pa"),
+                                                   (("1.2.3.4", 2), TUNNEL_PREFIX + "pb")])
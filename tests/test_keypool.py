@@ -0,0 +1,81 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from twisted.internet.defer import inlineCallbacks
+
+from ..crypto import ECCrypto
+from ..dispersy import Dispersy
+from ..endpoint import ManualEnpoint
+from ..keypool import KeyPool
+from ..util import blocking_call_on_reactor_thread
+
+
+class TestKeyPool(TestCase):
+
+    def setUp(self):
+        super(TestKeyPool, self).setUp()
+        self.crypto = ECCrypto()
+        self.directory = mkdtemp()
+        self.filename = os.path.join(self.directory, "keypool")
+
+    def tearDown(self):
+        super(TestKeyPool, self).tearDown()
+        rmtree(self.directory)
+
+    @blocking_call_on_reactor_thread
+    @inlineCallbacks
+    def test_take(self):
+        pool = KeyPool(self.crypto, (u"very-low", u"curve25519"), size=2)
+        self.assertIsNone(pool.take(u"very-low"))
+        yield pool.start()
+        self.assertEqual((pool.count(u"very-low"), pool.count(u"curve25519")), (2, 2))
+
+        key = pool.take(u"very-low")
+        self.assertTrue(self.crypto.is_valid_private_bin(key))
+        self.assertEqual(pool.count(u"very-low"), 1)
+        # a security level that the pool does not keep
+        self.assertIsNone(pool.take(u"low"))
+
+        # taking a key refills the pool in the background
+        yield pool.refill()
+        self.assertEqual(pool.count(u"very-low"), 2)
+        yield pool.stop()
+
+    @blocking_call_on_reactor_thread
+    @inlineCallbacks
+    def test_file(self):
+        pool = KeyPool(self.crypto, (u"very-low",), size=3, filename=self.filename)
+        yield pool.start()
+        yield pool.stop()
+        # a stopped pool is not refilled
+        key = pool.take(u"very-low")
+        self.assertEqual(pool.count(u"very-low"), 2)
+
+        other = KeyPool(self.crypto, (u"very-low",), size=3, filename=self.filename)
+        self.assertEqual(other.count(u"very-low"), 2)
+        yield other.stop()
+        keys = [other.take(u"very-low") for _ in xrange(2)]
+        self.assertNotIn(key, keys)
+        self.assertTrue(all(self.crypto.is_valid_private_bin(key) for key in keys))
+
+        self.assertEqual(KeyPool(self.crypto, (u"very-low",), filename=self.filename).count(u"very-low"), 0)
+
+    @blocking_call_on_reactor_thread
+    @inlineCallbacks
+    def test_dispersy(self):
+        pool = KeyPool(self.crypto, (u"very-low",), size=1)
+        yield pool.start()
+        key = pool._keys[u"very-low"][0]
+
+        dispersy = Dispersy(ManualEnpoint(0), unicode(self.directory), u":memory:", key_pool=pool)
+        dispersy.start(autoload_discovery=False)
+        try:
+            self.assertEqual(dispersy.get_new_member(u"very-low").private_key.key_to_bin(),
+                             self.crypto.key_from_private_bin(key).key_to_bin())
+            member = yield dispersy.get_new_member_in_thread(u"low")
+            self.assertTrue(member.private_key)
+        finally:
+            yield dispersy.stop()
+        self.assertFalse(pool._refilling)
@@ -0,0 +1,99 @@
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from twisted.internet.defer import inlineCallbacks
+
+from .debugcommunity.community import DebugCommunity
+from .dispersytestclass import DispersyTestFunc
+from ..dispersy import Dispersy
+from ..dispersydatabase import DispersyDatabase
+from ..endpoint import ManualEnpoint
+from ..memberstorage import DatabaseMemberStorage, MemoryMemberStorage
+from ..util import blocking_call_on_reactor_thread
+
+
+class MemberStorageTests(object):
+
+    def create_storage(self):
+        raise NotImplementedError()
+
+    def test_add_get(self):
+        storage = self.create_storage()
+        self.assertIsNone(storage.get("m" * 20))
+
+        first = storage.add("m" * 20)
+        second = storage.add("n" * 20, "public", "private")
+        self.assertNotEqual(first, second)
+
+        self.assertEqual(storage.get("m" * 20), (first, "", ""))
+        self.assertEqual(storage.get("n" * 20), (second, "public", "private"))
+        self.assertEqual(storage.get_by_id(first), ("m" * 20, "", ""))
+        self.assertEqual(storage.get_by_id(second), ("n" * 20, "public", "private"))
+        self.assertIsNone(storage.get_by_id(second + 1))
+
+    def test_get_many(self):
+        storage = self.create_storage()
+        first = storage.add("m" * 20)
+        second = storage.add("n" * 20, "public")
+        self.assertEqual(storage.get_many(["m" * 20, "n" * 20, "o" * 20]),
+                         {"m" * 20: (first, "", ""), "n" * 20: (second, "public", "")})
+        self.assertEqual(storage.get_many([]), {})
+
+    def test_update(self):
+        storage = self.create_storage()
+        database_id = storage.add("m" * 20)
+
+        storage.update(database_id, "public")
+        self.assertEqual(storage.get("m" * 20), (database_id, "public", ""))
+
+        storage.update(database_id, "public", "private")
+        self.assertEqual(storage.get("m" * 20), (database_id, "public", "private"))
+
+        # the private key is kept when it is not given
+        storage.update(database_id, "other")
+        self.assertEqual(storage.get("m" * 20), (database_id, "other", "private"))
+
+
+class TestDatabaseMemberStorage(MemberStorageTests, TestCase):
+
+    def setUp(self):
+        super(TestDatabaseMemberStorage, self).setUp()
+        self.database = DispersyDatabase(u":memory:")
+        self.database.open()
+
+    def tearDown(self):
+        super(TestDatabaseMemberStorage, self).tearDown()
+        self.database.close()
+
+    def create_storage(self):
+        return DatabaseMemberStorage(self.database)
+
+
+class TestMemoryMemberStorage(MemberStorageTests, TestCase):
+
+    def create_storage(self):
+        return MemoryMemberStorage()
+
+
+class TestDispersyMemoryMemberStorage(DispersyTestFunc):
+
+    @blocking_call_on_reactor_thread
+    @inlineCallbacks
+    def test_reload_community(self):
+        """
+        A community must be found again after it was unloaded, while its master member is not in the database.
+        """
+        member_storage = MemoryMemberStorage()
+        dispersy = Dispersy(ManualEnpoint(0), unicode(mkdtemp(suffix="_dispersy_test_session")), u":memory:",
+                            member_storage=member_storage)
+        dispersy.start(autoload_discovery=False)
+        self.dispersy_objects.append(dispersy)
+
+        my_member = dispersy.get_new_member(u"very-low")
+        community = DebugCommunity.init_community(dispersy, dispersy.get_member(mid=self._community.cid), my_member)
+        dispersy.define_auto_load(DebugCommunity, my_member, load=True)
+        self.assertEqual(list(dispersy.database.execute(u"SELECT COUNT(*) FROM member")), [(0,)])
+        self.assertEqual(member_storage.get(my_member.mid)[0], my_member.database_id)
+
+        yield community.unload_community()
+        self.assertEqual(dispersy.get_community(self._community.cid).my_member, my_member)
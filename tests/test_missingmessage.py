@@ -45,3 +45,39 @@ class TestMissingMessage(DispersyTestFunc):
                 batches.append([messages[i], messages[i + 1]])
             return batches
         self._test_with_order(batch)
+
+    def test_duplicate_requests(self):
+        """
+        OTHER requests the same messages twice in one batch, NODE sends each message once.
+        """
+        node, other = self.create_nodes(2)
+        node.send_identity(other)
+
+        messages = [node.create_full_sync_text("Message #%d" % i, i + 10) for i in xrange(4)]
+        node.give_messages(messages, node)
+
+        global_times = [message.distribution.global_time for message in messages]
+        node.give_messages([other.create_missing_message(node.my_member, global_times[:3]),
+                            other.create_missing_message(node.my_member, global_times[1:])], other)
+
+        responses = [response for _, response in other.receive_messages(names=[messages[0].name])]
+        self.assertEqual(sorted(response.distribution.global_time for response in responses), global_times)
+
+    def test_response_limit(self):
+        """
+        NODE stops sending once dispersy_missing_response_limit bytes were sent to OTHER.
+        """
+        node, other = self.create_nodes(2)
+        node.send_identity(other)
+
+        messages = [node.create_full_sync_text("x" * 1000, i + 10) for i in xrange(20)]
+        node.give_messages(messages, node)
+
+        global_times = [message.distribution.global_time for message in messages]
+        node.give_message(other.create_missing_message(node.my_member, global_times), other)
+
+        responses = [response for _, response in other.receive_messages(names=[messages[0].name])]
+        limit = node._community.dispersy_missing_response_limit
+        self.assertLess(len(responses), len(messages))
+        self.assertGreaterEqual(sum(len(response.packet) for response in responses), limit)
+        self.assertLess(sum(len(response.packet) for response in responses[:-1]), limit)
@@ -1,6 +1,8 @@
 from time import time
+from unittest import TestCase
 
 from .dispersytestclass import DispersyTestFunc
+from ..addressvoting import AddressVotes, LanMatcher
 from ..util import call_on_reactor_thread, address_is_lan_without_netifaces
 
 class TestNATDetection(DispersyTestFunc):
@@ -169,3 +171,61 @@ class TestAddressEstimation(DispersyTestFunc):
             self.assertEqual(candidate.wan_address, incorrect_WAN)
 
 
+class TestAddressVotes(TestCase):
+
+    def test_vote(self):
+        votes = AddressVotes()
+        self.assertIsNone(votes.vote(("1.1.1.1", 1), ("2.2.2.2", 1)))
+        self.assertIsNone(votes.vote(("1.1.1.1", 1), ("3.3.3.3", 1)))
+        self.assertEqual(votes.count(("1.1.1.1", 1)), 2)
+
+        # a new vote replaces the previous vote of the same voter
+        self.assertEqual(votes.vote(("1.1.1.1", 2), ("2.2.2.2", 1)), ("1.1.1.1", 1))
+        self.assertEqual(votes.count(("1.1.1.1", 1)), 1)
+        self.assertEqual(votes.get_voters(("1.1.1.1", 2)), frozenset([("2.2.2.2", 1)]))
+        self.assertEqual(len(votes), 2)
+
+        self.assertEqual(votes.unvote(("2.2.2.2", 1)), ("1.1.1.1", 2))
+        self.assertIsNone(votes.unvote(("2.2.2.2", 1)))
+        self.assertEqual(len(votes), 1)
+        self.assertNotIn(("1.1.1.1", 2), votes)
+
+    def test_multiple_host_address(self):
+        votes = AddressVotes()
+        votes.vote(("1.1.1.1", 1), ("2.2.2.2", 1))
+        votes.vote(("1.1.1.1", 1), ("2.2.2.2", 2))
+        self.assertFalse(votes.has_multiple_host_address)
+
+        votes.vote(("1.1.1.1", 1), ("3.3.3.3", 1))
+        self.assertTrue(votes.has_multiple_host_address)
+
+        votes.vote(("1.1.1.1", 2), ("3.3.3.3", 1))
+        self.assertFalse(votes.has_multiple_host_address)
+
+        votes.vote(("1.1.1.1", 2), ("2.2.2.2", 2))
+        self.assertTrue(votes.has_multiple_host_address)
+        votes.unvote(("2.2.2.2", 2))
+        self.assertFalse(votes.has_multiple_host_address)
+
+
+class TestLanMatcher(TestCase):
+
+    def test_subnets(self):
+        class Interface(object):
+
+            def __init__(self, address, netmask):
+                self.address = address
+                self.netmask = netmask
+
+        matcher = LanMatcher.from_interfaces([Interface("10.148.3.254", "255.255.255.0"),
+                                              Interface("192.168.1.5", "255.255.0.0")])
+        self.assertIn("10.148.3.1", matcher)
+        self.assertIn("192.168.42.42", matcher)
+        self.assertNotIn("10.148.4.1", matcher)
+        self.assertNotIn("192.169.1.5", matcher)
+        self.assertNotIn("not-an-address", matcher)
+
+    def test_without_netifaces(self):
+        matcher = LanMatcher.without_netifaces()
+        for address in ("192.168.1.5", "10.42.42.42", "172.31.255.255", "123.123.123.123", "172.32.0.0"):
+            self.assertEqual(address in matcher, address_is_lan_without_netifaces(address), address)
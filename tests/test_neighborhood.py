@@ -134,7 +134,7 @@ class TestNeighborhood(DispersyTestFunc):
         :param nodes: the DebugNodes which should be a part of the community
         """
         # Disallow community walking
-        self._community.cancel_pending_task("take step")
+        self._community.stop_walking()
         self._community.candidates.clear()
 
         # Create the nodes
@@ -0,0 +1,105 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from .dispersytestclass import DispersyTestFunc
+from ..packetcapture import PacketCaptureWriter, get_capture_files, read_batches, read_capture
+from ..tool.replay import Replay
+from ..util import blocking_call_on_reactor_thread
+
+
+class TestPacketCaptureWriter(TestCase):
+
+    def setUp(self):
+        super(TestPacketCaptureWriter, self).setUp()
+        self.directory = mkdtemp()
+        self.filename = os.path.join(self.directory, "capture")
+
+    def tearDown(self):
+        super(TestPacketCaptureWriter, self).tearDown()
+        rmtree(self.directory)
+
+    def test_read_write(self):
+        writer = PacketCaptureWriter(self.filename)
+        writer.write(1.5, [(("1.2.3.4", 1), "a"), (("1.2.3.4", 2), "bb")])
+        writer.write(2.5, [(("5.6.7.8", 3), "ccc")])
+        writer.close()
+        # writing after close is ignored
+        writer.write(3.5, [(("5.6.7.8", 3), "ddd")])
+
+        self.assertEqual(list(read_capture(self.filename)), [(1.5, ("1.2.3.4", 1), "a"),
+                                                              (1.5, ("1.2.3.4", 2), "bb"),
+                                                              (2.5, ("5.6.7.8", 3), "ccc")])
+        self.assertEqual(list(read_batches([self.filename])), [(1.5, [(("1.2.3.4", 1), "a"), (("1.2.3.4", 2), "bb")]),
+                                                               (2.5, [(("5.6.7.8", 3), "ccc")])])
+        self.assertEqual((writer.packet_count, writer.byte_count), (3, 6))
+
+    def test_truncated(self):
+        writer = PacketCaptureWriter(self.filename)
+        writer.write(1.0, [(("1.2.3.4", 1), "a" * 100)])
+        writer.write(2.0, [(("1.2.3.4", 1), "b" * 100)])
+        writer.close()
+        with open(self.filename, "r+b") as f:
+            f.truncate(os.path.getsize(self.filename) - 10)
+        self.assertEqual([data for _, _, data in read_capture(self.filename)], ["a" * 100])
+
+        with open(self.filename, "wb") as f:
+            f.write("not a capture")
+        self.assertRaises(ValueError, list, read_capture(self.filename))
+
+    def test_rotation(self):
+        # every file holds two 100 byte packets
+        writer = PacketCaptureWriter(self.filename, max_file_size=250, max_files=3)
+        for index in xrange(7):
+            writer.write(float(index), [(("1.2.3.4", 1), chr(ord("a") + index) * 100)])
+        writer.close()
+
+        filenames = get_capture_files(self.filename)
+        self.assertEqual(filenames, [self.filename + ".2", self.filename + ".1", self.filename])
+        # the first file, with packets a and b, was removed
+        self.assertEqual([data[0] for filename in filenames for _, _, data in read_capture(filename)],
+                         ["c", "d", "e", "f", "g"])
+
+        # a new capture replaces the old files
+        PacketCaptureWriter(self.filename).close()
+        self.assertEqual(get_capture_files(self.filename), [self.filename])
+
+
+class TestCaptureReplay(DispersyTestFunc):
+
+    def setUp(self):
+        super(TestCaptureReplay, self).setUp()
+        self.directory = mkdtemp()
+        self.filename = os.path.join(self.directory, "capture")
+
+    def tearDown(self):
+        super(TestCaptureReplay, self).tearDown()
+        rmtree(self.directory)
+
+    @blocking_call_on_reactor_thread
+    def replay(self, node):
+        return Replay(node._dispersy, get_capture_files(self.filename)).run()
+
+    def test_capture_and_replay(self):
+        """
+        NODE captures the messages that OTHER gives it, replaying the capture gives the same messages to THIRD.
+        """
+        node, other, third = self.create_nodes(3)
+        other.send_identity(node)
+        other.send_identity(third)
+        messages = [other.create_full_sync_text("Message %d" % i, i + 10) for i in xrange(3)]
+
+        endpoint = node._dispersy.endpoint
+        endpoint.start_capture(self.filename)
+        node.give_messages(messages, other)
+        self.assertEqual(endpoint.capture.packet_count, 3)
+        endpoint.stop_capture()
+        self.assertIsNone(endpoint.capture)
+        node.assert_is_stored(messages=messages)
+
+        third.assert_not_stored(messages=messages)
+        result = self.replay(third)
+        third.assert_is_stored(messages=messages)
+        self.assertEqual((result[u"batches"], result[u"packets"]), (1, 3))
+        self.assertTrue(any(entry[u"entry"].startswith(u"Dispersy.") for entry in result[u"runtime"]))
@@ -0,0 +1,85 @@
+from unittest import TestCase
+
+from ..statistics import RuntimeStatistic, _runtime_statistics, _runtime_statistics_settings
+from ..util import attach_runtime_statistics
+
+
+class Dummy(object):
+
+    file_path = u"dummy.db"
+
+    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {1} [{0.file_path}]")
+    def execute(self, statement):
+        return statement
+
+    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {return_value.name}")
+    def fail(self):
+        raise ValueError()
+
+    @attach_runtime_statistics(u"{function_name} bar={1}, moo={moo} returns={return_value}")
+    def foo(self, bar, moo='milk'):
+        return bar + 40
+
+    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name}", sample_rate=0.5)
+    def sampled(self):
+        pass
+
+
+class TestRuntimeStatistics(TestCase):
+
+    def setUp(self):
+        _runtime_statistics.clear()
+
+    def tearDown(self):
+        _runtime_statistics_settings.configure(True)
+        _runtime_statistics.clear()
+
+    def test_entries(self):
+        dummy = Dummy()
+        dummy.execute(u"SELECT 1")
+        dummy.execute(u"SELECT 1")
+        dummy.execute(u"SELECT {2}")
+        dummy.foo(1, moo="beer")
+        dummy.foo(2)
+        dummy.foo(2)
+
+        self.assertEqual(_runtime_statistics[u"Dummy.execute SELECT 1 [dummy.db]"].count, 2)
+        self.assertEqual(_runtime_statistics[u"Dummy.execute SELECT {2} [dummy.db]"].count, 1)
+        self.assertEqual(_runtime_statistics[u"foo bar=1, moo=beer returns=41"].count, 1)
+        # moo is not given, hence it is not part of kargs
+        self.assertEqual(_runtime_statistics[u"foo bar=2, moo=None returns=42"].count, 2)
+
+    def test_exception(self):
+        self.assertRaises(ValueError, Dummy().fail)
+        self.assertEqual(_runtime_statistics[u"Dummy.fail None"].count, 1)
+
+    def test_histogram(self):
+        dummy = Dummy()
+        for _ in xrange(10):
+            dummy.execute(u"SELECT 1")
+        statistic = _runtime_statistics[u"Dummy.execute SELECT 1 [dummy.db]"]
+        self.assertEqual(sum(samples for _, samples in statistic.histogram), 10)
+        self.assertEqual(statistic.get_dict()["samples"], 10)
+
+    def test_histogram_zero_duration(self):
+        """
+        Calls that take no measurable time are counted in the 0.0 bucket, not in the 1.0 second bucket.
+        """
+        statistic = RuntimeStatistic()
+        statistic.increment(0.0)
+        statistic.increment(0.0)
+        statistic.increment(0.75)
+        self.assertEqual(statistic.histogram, [(0.0, 2), (1.0, 1)])
+
+    def test_disabled(self):
+        _runtime_statistics_settings.configure(False)
+        self.assertEqual(Dummy().execute(u"SELECT 1"), u"SELECT 1")
+        self.assertFalse(_runtime_statistics)
+
+    def test_sampling(self):
+        dummy = Dummy()
+        for _ in xrange(1000):
+            dummy.sampled()
+        statistic = _runtime_statistics[u"Dummy.sampled"]
+        self.assertLess(statistic.samples, 1000)
+        self.assertEqual(statistic.count, statistic.samples * 2.0)
@@ -0,0 +1,136 @@
+import socket
+from time import sleep, time
+from unittest import TestCase, skipUnless
+
+from ..tracker.sharding import (SHARD_STATISTICS_TIMEOUT, ShardedEndpoint, decode_forwarded_packet, decode_statistics,
+                                encode_forwarded_packet, encode_statistics, get_shard)
+from ..endpoint import TUNNEL_PREFIX
+
+
+def get_free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def make_packet(shard, payload="payload"):
+    return "\x00\x01" + chr(0) * 3 + chr(shard) + "c" * 16 + payload
+
+
+class FakeStatistics(object):
+
+    def __init__(self):
+        self.counts = {}
+
+    def dict_inc(self, dictionary, key, value=1):
+        self.counts[key] = self.counts.get(key, 0) + value
+
+
+class FakeDispersy(object):
+
+    def __init__(self):
+        self.statistics = FakeStatistics()
+
+
+class CapturingEndpoint(ShardedEndpoint):
+
+    def __init__(self, *args, **kwargs):
+        super(CapturingEndpoint, self).__init__(*args, **kwargs)
+        self.received = []
+
+    def data_came_in(self, packets, cache=True):
+        self.received.extend(packets)
+
+
+class TestSharding(TestCase):
+
+    def test_get_shard(self):
+        for shard in xrange(4):
+            self.assertEqual(get_shard(make_packet(shard), 4), shard)
+            self.assertEqual(get_shard(TUNNEL_PREFIX + make_packet(shard), 4), shard)
+        # too short to contain a community id
+        self.assertEqual(get_shard("\x00\x01", 4), 0)
+
+    def test_forwarded_packet(self):
+        datagram = encode_forwarded_packet(("1.2.3.4", 5678), make_packet(1))
+        self.assertEqual(decode_forwarded_packet(datagram), (("1.2.3.4", 5678), make_packet(1)))
+
+    def test_statistics(self):
+        self.assertEqual(decode_statistics(encode_statistics(3, (1, 2, 30))), (3, (1, 2, 30)))
+
+
+@skipUnless(hasattr(socket, "SO_REUSEPORT"), "SO_REUSEPORT is not available")
+class TestShardedEndpoint(TestCase):
+
+    def setUp(self):
+        port, forward_port = get_free_port(), get_free_port()
+        self.endpoints = [CapturingEndpoint(port, "127.0.0.1", index, 2, forward_port) for index in xrange(2)]
+        for endpoint in self.endpoints:
+            endpoint.open(FakeDispersy())
+        self.address = ("127.0.0.1", port)
+
+    def tearDown(self):
+        for endpoint in self.endpoints:
+            endpoint.close(1.0)
+
+    def wait_for(self, condition, timeout=5.0):
+        until = time() + timeout
+        while not condition() and time() < until:
+            sleep(0.05)
+        return condition()
+
+    def test_route_by_community(self):
+        """
+        Every packet must end up at the worker that owns its community, regardless of the worker that received it.
+        """
+        clients = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in xrange(8)]
+        try:
+            expected = [[], []]
+            for client in clients:
+                client.bind(("127.0.0.1", 0))
+                for shard in xrange(2):
+                    client.sendto(make_packet(shard), self.address)
+                    expected[shard].append((client.getsockname(), make_packet(shard)))
+
+            self.assertTrue(self.wait_for(lambda: sum(len(endpoint.received) for endpoint in self.endpoints) == 16))
+            for endpoint, packets in zip(self.endpoints, expected):
+                self.assertEqual(sorted(endpoint.received), sorted(packets))
+
+        finally:
+            for client in clients:
+                client.close()
+
+    def test_send_statistics(self):
+        self.endpoints[1].send_statistics((1, 2, 3))
+        self.assertTrue(self.wait_for(lambda: self.endpoints[0].shard_statistics))
+        self.assertEqual(self.endpoints[0].shard_statistics, {1: (1, 2, 3)})
+
+        # statistics of a worker that stopped reporting expire
+        timestamp, values = self.endpoints[0]._shard_statistics[1]
+        self.endpoints[0]._shard_statistics[1] = (timestamp - SHARD_STATISTICS_TIMEOUT, values)
+        self.assertEqual(self.endpoints[0].shard_statistics, {})
+
+    def test_invalid_forwarded_datagrams(self):
+        """
+        Invalid datagrams, and datagrams from other sources, are dropped without stopping the endpoint.
+        """
+        forward_address = self.endpoints[0]._forward_addresses[0]
+        counts = self.endpoints[0]._dispersy.statistics.counts
+        other = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            other.bind(("127.0.0.1", 0))
+            other.sendto(encode_forwarded_packet(("1.2.3.4", 5), make_packet(0)), forward_address)
+            self.assertTrue(self.wait_for(lambda: counts.get(u"shard-forward-unknown-source")))
+        finally:
+            other.close()
+
+        forward = self.endpoints[1]._forward
+        for datagram in ("P", "P\x01", "S", "Sx", "S\x00\x01not numbers", "S\x00\x07", "X"):
+            forward(forward_address, datagram)
+        self.assertTrue(self.wait_for(lambda: counts.get(u"shard-forward-invalid") == 7))
+
+        self.endpoints[1].send_statistics((1, 2, 3))
+        self.assertTrue(self.wait_for(lambda: self.endpoints[0].shard_statistics))
+        self.assertEqual(self.endpoints[0].received, [])
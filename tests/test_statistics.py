@@ -0,0 +1,79 @@
+from threading import Thread
+from unittest import TestCase
+
+from ..statistics import CounterRegistry, MessageStatistics
+
+
+class TestCounterRegistry(TestCase):
+
+    def test_counter(self):
+        registry = CounterRegistry()
+        counter = registry.counter(u"a")
+        self.assertIs(counter, registry.counter(u"a"))
+        counter.increment()
+        counter.increment(41)
+        self.assertEqual(counter.value, 42)
+        self.assertEqual(registry.snapshot(), {u"a": 42})
+
+    def test_threads(self):
+        registry = CounterRegistry()
+        counter = registry.counter(u"a")
+
+        def bump():
+            for _ in xrange(1000):
+                counter.increment()
+                # counters created after the shards exist
+                registry.counter(u"b").increment()
+
+        threads = [Thread(target=bump) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        bump()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(registry.snapshot(), {u"a": 5000, u"b": 5000})
+
+    def test_reset_and_delta(self):
+        registry = CounterRegistry()
+        registry.counter(u"a").increment(2)
+        registry.counter(u"b").increment(3)
+        previous = registry.snapshot()
+        registry.counter(u"a").increment(5)
+        self.assertEqual(CounterRegistry.delta(registry.snapshot(), previous), {u"a": 5})
+
+        registry.reset()
+        self.assertEqual(registry.snapshot(), {u"a": 0, u"b": 0})
+
+
+class TestMessageStatistics(TestCase):
+
+    def test_disabled(self):
+        statistics = MessageStatistics()
+        statistics.enable(False)
+        statistics.increase_count(u"success", u"dispersy-identity", 3)
+        statistics.increase_delay_count(u"send")
+        self.assertEqual(statistics.success_count, 3)
+        self.assertEqual(statistics.delay_send_count, 1)
+        self.assertIsNone(statistics.success_dict)
+
+    def test_enabled(self):
+        statistics = MessageStatistics()
+        statistics.enable(True)
+        counter = statistics.get_counter(u"success", u"dispersy-identity")
+        counter.increment(2)
+        statistics.increase_count(u"drop", u"drop_packet:foo")
+        self.assertEqual(statistics.success_count, 2)
+        self.assertEqual(statistics.success_dict, {u"dispersy-identity": 2})
+        self.assertEqual(statistics.drop_dict, {u"drop_packet:foo": 1})
+
+        statistics.reset()
+        self.assertEqual(statistics.success_count, 0)
+        self.assertEqual(statistics.success_dict, {u"dispersy-identity": 0})
+
+    def test_assign(self):
+        statistics = MessageStatistics()
+        statistics.walk_success_count += 5
+        statistics.walk_success_count += 2
+        self.assertEqual(statistics.walk_success_count, 7)
+        self.assertEqual(statistics.snapshot()[u"walk_success_count"], 7)
@@ -1,4 +1,5 @@
 from .dispersytestclass import DispersyTestFunc
+from ..util import blocking_call_on_reactor_thread
 
 
 class TestSync(DispersyTestFunc):
@@ -220,6 +221,29 @@ class TestSync(DispersyTestFunc):
         for _, message in messages_so_far:
             node.assert_is_stored(message)
 
+    def test_last_9_sync_history(self):
+        """
+        The sync history cache of NODE must follow the LastSyncDistribution messages that are stored and pruned.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        for global_time in [21, 20, 28, 27, 22, 23, 24, 26, 25, 30, 35, 11, 31]:
+            node.give_message(other.create_last_9_test(str(global_time), global_time), other)
+
+        @blocking_call_on_reactor_thread
+        def get_global_times():
+            meta = node._community.get_meta_message(u"last-9-test")
+            member = node._community.get_member(public_key=other.my_member.public_key)
+            stored = [global_time for global_time, in node._dispersy.database.execute(
+                u"SELECT global_time FROM sync WHERE member = ? AND meta_message = ? ORDER BY global_time",
+                (member.database_id, meta.database_id))]
+            return node._community.sync_history.get_global_times(member.database_id, meta), stored
+
+        cached, stored = get_global_times()
+        self.assertEqual(cached, stored)
+        self.assertEqual(cached, [23, 24, 25, 26, 27, 28, 30, 31, 35])
+
     def test_last_1_doublemember(self):
         """
         Normally the LastSyncDistribution policy stores the last N messages for each member that
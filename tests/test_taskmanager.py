@@ -1,4 +1,4 @@
-from ..taskmanager import TaskManager
+from ..taskmanager import TaskManager, CoalescedLoopingCall
 from ..util import blocking_call_on_reactor_thread
 from .dispersytestclass import DispersyTestFunc
 from nose.tools import assert_raises
@@ -99,6 +99,57 @@ class TaskManagerTestFunc(DispersyTestFunc):
         self.assertEquals(42, self.counter)
         self.assertFalse(self.tm.is_pending_task_active("test"))
 
+    @blocking_call_on_reactor_thread
+    def test_fired_deferred_is_removed(self):
+        d = Deferred()
+        self.tm.register_task("test", d)
+        d.callback(None)
+        self.assertNotIn("test", self.tm._pending_tasks)
+
+    @blocking_call_on_reactor_thread
+    def test_fired_call_later_is_removed(self):
+        self.tm.register_task("test", self.tm._reactor.callLater(1, self.count))
+        self.tm._reactor.advance(1)
+        self.assertEquals(1, self.counter)
+        self.assertNotIn("test", self.tm._pending_tasks)
+
+    @blocking_call_on_reactor_thread
+    def test_cancel_removes_inactive_task(self):
+        lc = LoopingCall(self.do_nothing)
+        self.tm.register_task("test", lc)
+        self.tm.cancel_pending_task("test")
+        self.assertNotIn("test", self.tm._pending_tasks)
+
+    @blocking_call_on_reactor_thread
+    def test_coalesced_looping_calls_share_timer(self):
+        clock = self.tm._reactor
+        for name in ("a", "b", "c"):
+            lc = CoalescedLoopingCall(self.count)
+            lc.clock = clock
+            self.tm.register_task(name, lc).start(5, now=False)
+        self.assertEquals(1, len(clock.getDelayedCalls()))
+        clock.advance(5)
+        self.assertEquals(3, self.counter)
+        self.tm.cancel_pending_task("a")
+        clock.advance(5)
+        self.assertEquals(5, self.counter)
+        self.tm.cancel_all_pending_tasks()
+        self.assertFalse(clock.getDelayedCalls())
+
+    @blocking_call_on_reactor_thread
+    def test_coalesced_looping_call_stops_on_exception(self):
+        def fail():
+            raise RuntimeError()
+        lc = CoalescedLoopingCall(fail)
+        lc.clock = self.tm._reactor
+        d = self.tm.register_task("test", lc).start(5, now=False)
+        failures = []
+        d.addErrback(failures.append)
+        self.tm._reactor.advance(5)
+        self.assertEquals(1, len(failures))
+        self.assertFalse(self.tm.is_pending_task_active("test"))
+        self.assertFalse(self.tm._reactor.getDelayedCalls())
+
     def count(self):
         self.counter += 1
 
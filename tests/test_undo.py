@@ -1,4 +1,5 @@
 from .dispersytestclass import DispersyTestFunc
+from .. import community
 
 
 class TestUndo(DispersyTestFunc):
@@ -56,6 +57,30 @@ class TestUndo(DispersyTestFunc):
         node.assert_is_undone(messages=messages)
         node.assert_is_stored(messages=undoes)
 
+    def test_node_undo_other_chunks(self):
+        """
+        NODE receives more undo messages in one batch than are resolved in a single lookup.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        authorize = self._mm.create_authorize([(other.my_member, self._community.get_meta_message(u"full-sync-text"), u"undo")], self._mm.claim_global_time())
+        node.give_message(authorize, self._mm)
+
+        messages = [node.create_full_sync_text("Should undo #%d" % i, i + 10) for i in xrange(10)]
+        node.give_messages(messages, node)
+        node.assert_is_stored(messages=messages)
+
+        chunk_size, community.SYNC_LOOKUP_CHUNK_SIZE = community.SYNC_LOOKUP_CHUNK_SIZE, 3
+        try:
+            undoes = [other.create_undo_other(message, message.distribution.global_time + 100, 1 + i) for i, message in enumerate(messages)]
+            node.give_messages(undoes, other)
+        finally:
+            community.SYNC_LOOKUP_CHUNK_SIZE = chunk_size
+
+        node.assert_is_undone(messages=messages)
+        node.assert_is_stored(messages=undoes)
+
     def test_self_attempt_undo_twice(self):
         """
         NODE generated a message and then undoes it twice. The dispersy core should ensure that
@@ -0,0 +1,152 @@
+from .dispersytestclass import DispersyTestFunc
+from .. import walkerscheduler
+from ..statistics import CommunityStatistics
+from ..util import blocking_call_on_reactor_thread
+from ..walkerscheduler import WalkerScheduler
+
+
+class FakeCommunity(object):
+
+    def __init__(self, priority=0):
+        self.priority = priority
+        self.steps = 0
+        self.statistics = self
+
+        self.walk_step_latencies = []
+
+    def get_walk_priority(self):
+        return self.priority
+
+    def increase_walk_step(self, latency):
+        self.walk_step_latencies.append(latency)
+
+    def take_step(self):
+        self.steps += 1
+
+
+class TestWalkerScheduler(DispersyTestFunc):
+
+    @blocking_call_on_reactor_thread
+    def setUp(self):
+        super(TestWalkerScheduler, self).setUp()
+        self.now = 1000.0
+        self.schedulers = []
+        self._time, walkerscheduler.time = walkerscheduler.time, lambda: self.now
+
+    @blocking_call_on_reactor_thread
+    def tearDown(self):
+        walkerscheduler.time = self._time
+        for scheduler in self.schedulers:
+            scheduler.cancel_all_pending_tasks()
+        super(TestWalkerScheduler, self).tearDown()
+
+    def create_scheduler(self, steps_per_second):
+        scheduler = WalkerScheduler(steps_per_second, 1.0)
+        self.schedulers.append(scheduler)
+        return scheduler
+
+    def tick(self, scheduler, seconds=1.0):
+        self.now += seconds
+        scheduler._tick()
+
+    @blocking_call_on_reactor_thread
+    def test_interval(self):
+        scheduler = self.create_scheduler(10.0)
+        community = FakeCommunity()
+        scheduler.schedule(community, community.take_step, 5.0)
+        self.assertTrue(scheduler.is_pending_task_active("tick"))
+
+        for _ in xrange(10):
+            self.tick(scheduler)
+        # the first step is taken at the first tick, then one every five seconds
+        self.assertEqual(community.steps, 2)
+        self.assertEqual(community.walk_step_latencies, [1.0, 0.0])
+
+        scheduler.unschedule(community)
+        self.assertNotIn(community, scheduler)
+        self.assertFalse(scheduler.is_pending_task_active("tick"))
+        self.tick(scheduler, 10.0)
+        self.assertEqual(community.steps, 2)
+
+    @blocking_call_on_reactor_thread
+    def test_budget(self):
+        """
+        At most steps_per_second steps are taken, the postponed steps are spread over the next ticks.
+        """
+        scheduler = self.create_scheduler(2.0)
+        communities = [FakeCommunity() for _ in xrange(6)]
+        for community in communities:
+            scheduler.schedule(community, community.take_step, 5.0, delay=0.0)
+
+        steps = []
+        for _ in xrange(3):
+            self.tick(scheduler)
+            steps.append(sum(community.steps for community in communities))
+        self.assertEqual(steps, [2, 4, 6])
+        self.assertEqual(sorted(community.walk_step_latencies[0] for community in communities), [1.0, 1.0, 2.0, 2.0, 3.0, 3.0])
+
+    @blocking_call_on_reactor_thread
+    def test_priority(self):
+        """
+        When the budget does not allow all due steps, communities with a lower priority value walk first.
+        """
+        scheduler = self.create_scheduler(1.0)
+        communities = [FakeCommunity(priority) for priority in (3, 1, 2)]
+        for community in communities:
+            scheduler.schedule(community, community.take_step, 5.0, delay=0.0)
+
+        order = []
+        for _ in xrange(3):
+            self.tick(scheduler)
+            order.extend(community.priority for community in communities if community.steps and community.priority not in order)
+        self.assertEqual(order, [1, 2, 3])
+
+    @blocking_call_on_reactor_thread
+    def test_phase(self):
+        """
+        Communities scheduled at the same moment take their steps in different ticks.
+        """
+        scheduler = self.create_scheduler(100.0)
+        communities = [FakeCommunity() for _ in xrange(10)]
+        for community in communities:
+            scheduler.schedule(community, community.take_step, 5.0)
+
+        steps = []
+        for _ in xrange(10):
+            before = sum(community.steps for community in communities)
+            self.tick(scheduler)
+            steps.append(sum(community.steps for community in communities) - before)
+        # every community takes two steps, the steps are spread evenly over the five ticks of one interval
+        self.assertEqual(steps, [2] * 10)
+        self.assertEqual([community.steps for community in communities], [2] * 10)
+
+    @blocking_call_on_reactor_thread
+    def test_reschedule_from_step(self):
+        """
+        A step may replace itself, the way the fast walker switches to normal walking.
+        """
+        scheduler = self.create_scheduler(10.0)
+        community = FakeCommunity()
+
+        def fast_step():
+            community.take_step()
+            scheduler.schedule(community, community.take_step, 5.0, delay=5.0)
+
+        scheduler.schedule(community, fast_step, 1.0)
+        for _ in xrange(11):
+            self.tick(scheduler)
+        # fast step at 1, normal steps at 6 and 11
+        self.assertEqual(community.steps, 3)
+
+    @blocking_call_on_reactor_thread
+    def test_community_statistics(self):
+        scheduler = self.create_scheduler(10.0)
+        community = FakeCommunity()
+        community.statistics = CommunityStatistics(self._community)
+        scheduler.schedule(community, community.take_step, 5.0)
+        self.tick(scheduler, 2.0)
+        self.tick(scheduler, 6.0)
+
+        self.assertEqual(community.statistics.walk_step_count, 2)
+        self.assertEqual(community.statistics.walk_step_latency_max, 2.0)
+        self.assertEqual(community.statistics.walk_step_latency_average, 1.5)
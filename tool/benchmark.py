@@ -0,0 +1,496 @@
+#!/usr/bin/env python2
+
+"""
+In-process multi-node benchmark for the sync and walker hot paths.
+
+Starts N Dispersy instances in one process, each running a DebugCommunity on top of an in-memory database, and
+connects them through a simulated network that adds latency and packet loss.  A workload is then driven through the
+overlay and the results are written as a single JSON document.  Run it as a module from the directory containing the
+dispersy package:
+
+    python -m dispersy.tool.benchmark --nodes 50 --workload full-sync --messages 500
+
+Workloads:
+
+  full-sync  every message is a new full-sync-text created by a random node (flood)
+  last-sync  every message is a new last-9-test created by a random node, older ones are pruned (updates)
+  churn      a full-sync flood while nodes go offline and come back, convergence is measured once churning stops
+
+Reported values include the number of packets delivered per second, the time until every node holds the expected
+messages (bloom-sync convergence), the CPU time used per delivered packet and the memory used per node.
+
+The nodes use in-memory databases unless --database file is given.  SQLite performance profiles can be compared by
+running a sync-heavy workload once for every profile:
+
+    python -m dispersy.tool.benchmark --database file --profile conservative --workload full-sync --messages 2000
+    python -m dispersy.tool.benchmark --database file --profile performance --workload full-sync --messages 2000
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import time
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import deferLater
+
+from ..database import DATABASE_PROFILES, DEFAULT_DATABASE_PROFILE
+from ..dispersy import Dispersy
+from ..endpoint import ManualEnpoint, Endpoint, TUNNEL_PREFIX
+from ..tests.debugcommunity.community import DebugCommunity
+from ..tests.debugcommunity.node import DebugNode
+
+WORKLOADS = (u"full-sync", u"last-sync", u"churn")
+
+
+class SimulatedNetwork(object):
+
+    """
+    Delivers packets between SimulatedEndpoints that live in the same process.
+
+    Each packet is delayed by LATENCY plus up to JITTER seconds and dropped with probability LOSS.  Endpoints that are
+    taken offline neither send nor receive packets.
+    """
+
+    def __init__(self, latency=0.01, jitter=0.0, loss=0.0, seed=None):
+        assert latency >= 0.0, latency
+        assert jitter >= 0.0, jitter
+        assert 0.0 <= loss < 1.0, loss
+        self._latency = latency
+        self._jitter = jitter
+        self._loss = loss
+        self._random = Random(seed)
+        self._endpoints = {}
+        self._offline = set()
+        self._next_port = 10000
+
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        self.packets_delivered = 0
+        self.bytes_delivered = 0
+
+    def claim_port(self):
+        port = self._next_port
+        self._next_port += 1
+        return port
+
+    def attach(self, endpoint):
+        self._endpoints[endpoint.port] = endpoint
+
+    def detach(self, endpoint):
+        self._endpoints.pop(endpoint.port, None)
+        self._offline.discard(endpoint.port)
+
+    def set_online(self, endpoint, online):
+        if online:
+            self._offline.discard(endpoint.port)
+        else:
+            self._offline.add(endpoint.port)
+
+    def is_online(self, endpoint):
+        return endpoint.port not in self._offline
+
+    def send(self, source, sock_addr, data):
+        """
+        Schedules the delivery of DATA from endpoint SOURCE to SOCK_ADDR.
+        """
+        self.packets_sent += 1
+        if source.port in self._offline or (self._loss and self._random.random() < self._loss):
+            self.packets_dropped += 1
+            return
+
+        delay = self._latency + self._random.random() * self._jitter if self._jitter else self._latency
+        reactor.callLater(delay, self._deliver, source.lan_address, sock_addr[1], data)
+
+    def _deliver(self, source_address, port, data):
+        destination = self._endpoints.get(port)
+        if destination is None or port in self._offline:
+            self.packets_dropped += 1
+            return
+
+        self.packets_delivered += 1
+        self.bytes_delivered += len(data)
+        destination.deliver([(source_address, data)])
+
+
+class SimulatedEndpoint(ManualEnpoint):
+
+    """
+    ManualEnpoint that sends and receives through a SimulatedNetwork instead of a UDP socket.
+
+    No socket or thread is used, packets are handed to Dispersy on the reactor thread as soon as the network delivers
+    them.
+    """
+
+    def __init__(self, network):
+        ManualEnpoint.__init__(self, network.claim_port(), ip="127.0.0.1")
+        self._network = network
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def lan_address(self):
+        return self._dispersy.lan_address
+
+    def get_address(self):
+        assert self._dispersy, "Should not be called before open(...)"
+        return (self._ip, self._port)
+
+    def open(self, dispersy):
+        Endpoint.open(self, dispersy)
+        self._network.attach(self)
+        self._running = True
+        return True
+
+    def close(self, timeout=0.0):
+        self._running = False
+        self._network.detach(self)
+        return Endpoint.close(self, timeout)
+
+    def send_packet(self, candidate, packet, prefix=None):
+        assert self._dispersy, "Should not be called before open(...)"
+        assert len(packet) > 0
+
+        packet = (prefix or '') + packet
+
+        if len(packet) > 2 ** 16 - 60:
+            raise RuntimeError("UDP does not support %d byte packets" % len(packet))
+
+        self._dispersy.statistics.total_up += len(packet)
+        self._dispersy.statistics.total_send += 1
+
+        self._network.send(self, candidate.sock_addr, TUNNEL_PREFIX + packet if candidate.tunnel else packet)
+        return True
+
+    def deliver(self, packets):
+        """
+        Called by the network, on the reactor thread, when PACKETS arrive.
+        """
+        if self._running:
+            self._dispersy.statistics.total_down += sum(len(data) for _, data in packets)
+            self.dispersythread_data_came_in(packets, time.time())
+
+
+class BenchmarkNode(DebugNode):
+
+    """
+    DebugNode whose messages are created, stored and forwarded by the node itself.
+    """
+
+    def __init__(self, network, dispersy, c_master_member=None):
+        super(BenchmarkNode, self).__init__(None, dispersy, DebugCommunity, c_master_member)
+        self._network = network
+        self.created = 0
+
+    @property
+    def online(self):
+        return self._network.is_online(self._dispersy.endpoint)
+
+    def set_online(self, online):
+        self._network.set_online(self._dispersy.endpoint, online)
+
+    def publish(self, message):
+        self.created += 1
+        self._dispersy.store_update_forward([message], True, True, True)
+
+    def walk(self, rng):
+        """
+        Sends an introduction-request, including a bloom filter, to a random known candidate.
+
+        DebugCommunity disables the candidate walker and the real walker only revisits a candidate after tens of
+        seconds, hence the benchmark drives the walk itself at a configurable rate.
+        """
+        candidates = self._community.candidates.values()
+        if candidates:
+            self._community.create_introduction_request(rng.choice(candidates), True)
+
+    def count(self, name):
+        meta = self._community.get_meta_message(name)
+        count, = self._dispersy.database.execute(u"SELECT COUNT(*) FROM sync WHERE meta_message = ?",
+                                                 (meta.database_id,)).next()
+        return count
+
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def get_memory_usage():
+    """
+    Returns the resident set size of this process in bytes.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        # ru_maxrss is in bytes on OS X and in kilobytes elsewhere
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class Benchmark(object):
+
+    """
+    Creates the nodes, drives one workload through them and collects the results.
+    """
+
+    def __init__(self, args):
+        self._args = args
+        self._random = Random(args.seed)
+        self._network = SimulatedNetwork(args.latency, args.jitter, args.loss, args.seed)
+        self._nodes = []
+        self._working_directories = []
+        self._offline_until = {}
+        self.result = None
+
+    def create_node(self, central=None):
+        working_directory = unicode(mkdtemp(suffix="_dispersy_benchmark"))
+        self._working_directories.append(working_directory)
+
+        database_filename = u":memory:" if self._args.database == u"memory" else u"dispersy.db"
+        dispersy = Dispersy(SimulatedEndpoint(self._network), working_directory, database_filename,
+                            database_profile=self._args.profile)
+        dispersy.start(autoload_discovery=False)
+        node = BenchmarkNode(self._network, dispersy, central)
+        self._nodes.append(node)
+        return node
+
+    @inlineCallbacks
+    def setup(self):
+        """
+        Creates all nodes and gives every node a few random nodes to walk to.
+
+        Only the master member and the identity of the first node are handed out directly, all other identities
+        are requested (dispersy-missing-identity) when they are needed.
+        """
+        central = self.create_node()
+        for _ in xrange(self._args.nodes - 1):
+            node = self.create_node(central)
+            node.give_packets(central.fetch_packets([u"dispersy-identity", u"dispersy-authorize"],
+                                                    central.community.master_member.mid), central)
+            node.send_identity(central)
+
+        for node in self._nodes:
+            others = [other for other in self._nodes if other is not node]
+            for other in self._random.sample(others, min(self._args.peers, len(others))):
+                address = other.lan_address
+                node.community.create_or_update_walkcandidate(address, address, address, False, u"unknown")
+
+        # process the packets given above
+        yield deferLater(reactor, 0.0, lambda: None)
+
+    @inlineCallbacks
+    def teardown(self):
+        for node in self._nodes:
+            yield node._dispersy.stop()
+        for working_directory in self._working_directories:
+            rmtree(working_directory, ignore_errors=True)
+
+    def step(self, now, churn):
+        """
+        One walker round: when CHURN is True some nodes go offline or come back, then every online node takes a step.
+        """
+        if churn:
+            for node in self._nodes:
+                if node.online:
+                    if self._random.random() < self._args.churn:
+                        node.set_online(False)
+                        self._offline_until[node] = now + self._args.downtime
+                elif now >= self._offline_until.get(node, 0.0):
+                    node.set_online(True)
+
+        for node in self._nodes:
+            if node.online:
+                node.walk(self._random)
+
+    def stop_churn(self):
+        for node in self._nodes:
+            node.set_online(True)
+        self._offline_until.clear()
+
+    def publish(self, index):
+        node = self._random.choice([node for node in self._nodes if node.online] or self._nodes)
+        if self._args.workload == u"last-sync":
+            node.publish(node.create_last_9_test("benchmark %d" % index))
+        else:
+            node.publish(node.create_full_sync_text("benchmark %d" % index))
+
+    def expected(self):
+        """
+        Returns the (meta message name, count) every node must hold once the workload has converged.
+        """
+        if self._args.workload == u"last-sync":
+            history_size = self._nodes[0].community.get_meta_message(u"last-9-test").distribution.history_size
+            return u"last-9-test", sum(min(node.created, history_size) for node in self._nodes)
+        return u"full-sync-text", self._args.messages
+
+    def stored(self):
+        """
+        Returns, for every node, how many of the expected messages it holds.
+        """
+        name, _ = self.expected()
+        return [node.count(name) for node in self._nodes]
+
+    def is_converged(self):
+        _, count = self.expected()
+        return all(stored >= count for stored in self.stored())
+
+    @inlineCallbacks
+    def run(self):
+        args = self._args
+        memory_before = get_memory_usage()
+        setup_start = time.time()
+        yield self.setup()
+        setup_duration = time.time() - setup_start
+        memory_per_node = (get_memory_usage() - memory_before) / float(len(self._nodes))
+
+        packets_before = self._network.packets_delivered
+        bytes_before = self._network.bytes_delivered
+        stored_before = sum(self.stored())
+        cpu_before = get_cpu_time()
+        start = time.time()
+        deadline = start + args.timeout
+
+        # messages are published at RATE per second while the walker takes STEP_INTERVAL steps, nodes churn for at
+        # least CHURN_DURATION seconds.  convergence is measured from the moment both have finished
+        published = 0
+        churning = bool(args.churn)
+        next_step = next_check = start
+        settled_at = converged_at = None
+        while time.time() < deadline:
+            now = time.time()
+            while published < args.messages and (not args.rate or published < (now - start) * args.rate):
+                self.publish(published)
+                published += 1
+
+            if churning and published == args.messages and now - start >= args.churn_duration:
+                self.stop_churn()
+                churning = False
+
+            if now >= next_step:
+                self.step(now, churning)
+                next_step = now + args.step_interval
+
+            if not churning and published == args.messages:
+                if settled_at is None:
+                    settled_at = now
+                if now >= next_check:
+                    if self.is_converged():
+                        converged_at = time.time()
+                        break
+                    next_check = now + args.check_interval
+
+            yield deferLater(reactor, min(args.step_interval, args.check_interval) / 4.0, lambda: None)
+
+        duration = time.time() - start
+        cpu = get_cpu_time() - cpu_before
+        packets = self._network.packets_delivered - packets_before
+        _, count = self.expected()
+        stored = self.stored()
+
+        result = {
+            u"parameters": dict((key, value) for key, value in vars(args).iteritems() if key != "output"),
+            u"platform": {u"python": platform.python_version(), u"system": platform.system()},
+            u"setup_seconds": setup_duration,
+            u"duration_seconds": duration,
+            u"converged": converged_at is not None,
+            u"convergence_seconds": (converged_at - settled_at) if converged_at else None,
+            u"messages_published": published,
+            u"messages_expected_per_node": count,
+            u"messages_stored_min": min(stored),
+            u"messages_stored_avg": sum(stored) / float(len(stored)),
+            u"packets_sent": self._network.packets_sent,
+            u"packets_dropped": self._network.packets_dropped,
+            u"packets_delivered": packets,
+            u"bytes_delivered": self._network.bytes_delivered - bytes_before,
+            u"packets_per_second": packets / duration if duration else 0.0,
+            u"messages_per_second": (sum(stored) - stored_before) / duration if duration else 0.0,
+            u"cpu_seconds": cpu,
+            u"cpu_seconds_per_packet": cpu / packets if packets else None,
+            u"memory_bytes_per_node": memory_per_node,
+            u"walk_attempts": sum(node._dispersy.statistics.walk_attempt_count for node in self._nodes),
+            u"walk_successes": sum(node._dispersy.statistics.walk_success_count for node in self._nodes),
+            u"database_settings": self._nodes[0]._dispersy.database.settings,
+            u"commits": sum(node._dispersy.commit_scheduler.commit_count for node in self._nodes),
+            u"commit_seconds": sum(node._dispersy.commit_scheduler.commit_duration for node in self._nodes),
+        }
+
+        yield self.teardown()
+        result[u"memory_bytes_after"] = get_memory_usage()
+        result[u"wall_seconds"] = time.time() - setup_start
+        self.result = result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=20, help="number of Dispersy instances")
+    parser.add_argument("--workload", choices=WORKLOADS, default=u"full-sync", type=unicode)
+    parser.add_argument("--messages", type=int, default=200, help="number of messages to publish")
+    parser.add_argument("--rate", type=float, default=0.0, help="messages published per second, 0 publishes at once")
+    parser.add_argument("--peers", type=int, default=5, help="number of candidates each node starts with")
+    parser.add_argument("--latency", type=float, default=0.01, help="one-way network latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="additional random latency in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="packet loss probability")
+    parser.add_argument("--churn", type=float, default=None,
+                        help="probability a node goes offline each step (default 0.05 for churn, 0 otherwise)")
+    parser.add_argument("--downtime", type=float, default=2.0, help="seconds an offline node stays offline")
+    parser.add_argument("--churn-duration", type=float, default=10.0,
+                        help="seconds the churn workload churns before it waits for convergence")
+    parser.add_argument("--step-interval", type=float, default=0.1, help="seconds between walker steps")
+    parser.add_argument("--check-interval", type=float, default=0.5, help="seconds between convergence checks")
+    parser.add_argument("--timeout", type=float, default=120.0, help="give up converging after this many seconds")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for the workload and the network")
+    parser.add_argument("--database", choices=(u"memory", u"file"), default=u"memory", type=unicode,
+                        help="use in-memory databases or a database file per node")
+    parser.add_argument("--profile", choices=sorted(DATABASE_PROFILES), default=DEFAULT_DATABASE_PROFILE, type=unicode,
+                        help="the SQLite performance profile")
+    parser.add_argument("--output", default=None, help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.churn is None:
+        args.churn = 0.05 if args.workload == u"churn" else 0.0
+    if args.nodes < 2:
+        parser.error("at least two nodes are required")
+
+    logging.basicConfig(format="%(asctime)-15s [%(levelname)s] %(message)s", level=logging.ERROR)
+
+    benchmark = Benchmark(args)
+    failure = []
+
+    @inlineCallbacks
+    def run():
+        # Dispersy and the TaskManager expect to be used from the reactor thread
+        try:
+            yield benchmark.run()
+        except:
+            failure.append(sys.exc_info())
+            raise
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+
+    if failure:
+        raise failure[0][0], failure[0][1], failure[0][2]
+
+    output = json.dumps(benchmark.result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + os.linesep)
+    else:
+        print output
+
+if __name__ == "__main__":
+    main()
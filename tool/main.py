@@ -9,6 +9,7 @@ import signal
 from twisted.internet import reactor
 from twisted.python.log import addObserver
 
+from ..database import DATABASE_PROFILES, DEFAULT_DATABASE_PROFILE
 from ..dispersy import Dispersy
 from ..endpoint import StandaloneEndpoint
 
@@ -53,6 +54,7 @@ def main_real(setup=None):
     command_line_parser.add_option("--profiler", action="store_true", help="use cProfile on the Dispersy thread", default=False)
     command_line_parser.add_option("--memory-dump", action="store_true", help="use meliae to dump the memory periodically", default=False)
     command_line_parser.add_option("--databasefile", action="store", help="use an alternate databasefile", default=u"dispersy.db")
+    command_line_parser.add_option("--databaseprofile", action="store", type="choice", choices=sorted(DATABASE_PROFILES), help="the SQLite settings to use", default=DEFAULT_DATABASE_PROFILE)
     command_line_parser.add_option("--statedir", action="store", type="string", help="Use an alternate statedir", default=u".")
     command_line_parser.add_option("--ip", action="store", type="string", default="0.0.0.0", help="Dispersy uses this ip")
     command_line_parser.add_option("--port", action="store", type="int", help="Dispersy uses this UDL port", default=12345)
@@ -60,6 +62,7 @@ def main_real(setup=None):
     command_line_parser.add_option("--kargs", action="store", type="string", help="Executes --script with these arguments.  Example 'startingtimestamp=1292333014,endingtimestamp=12923340000'")
     command_line_parser.add_option("--debugstatistics", action="store_true", help="turn on debug statistics", default=False)
     command_line_parser.add_option("--strict", action="store_true", help="Exit on any exception", default=False)
+    command_line_parser.add_option("--capture", action="store", type="string", help="write all incoming packets to this file, see tool/replay.py", default="")
     # swift
     # command_line_parser.add_option("--swiftproc", action="store_true", help="Use swift to tunnel all traffic", default=False)
     # command_line_parser.add_option("--swiftpath", action="store", type="string", default="./swift")
@@ -79,7 +82,8 @@ def main_real(setup=None):
         addObserver(unhandled_error_observer)
 
     # setup
-    dispersy = Dispersy(StandaloneEndpoint(opt.port, opt.ip), unicode(opt.statedir), unicode(opt.databasefile))
+    dispersy = Dispersy(StandaloneEndpoint(opt.port, opt.ip), unicode(opt.statedir), unicode(opt.databasefile),
+                        database_profile=unicode(opt.databaseprofile))
     dispersy.statistics.enable_debug_statistics(opt.debugstatistics)
 
     def signal_handler(sig, frame):
@@ -93,6 +97,9 @@ def main_real(setup=None):
     if not dispersy.start():
         raise RuntimeError("Unable to start Dispersy")
 
+    if opt.capture:
+        dispersy.endpoint.start_capture(opt.capture)
+
     # This has to be scheduled _after_ starting dispersy so the DB is opened by when this is actually executed.
     # register tasks
     reactor.callLater(0, start_script, dispersy, opt)
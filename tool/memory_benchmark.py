@@ -0,0 +1,109 @@
+#!/usr/bin/env python2
+
+"""
+Memory benchmark for decoded messages and walker candidates.
+
+Decodes a number of full-sync-text packets and creates a number of WalkCandidates, keeping all of them alive, and
+reports the bytes used per object.  Two values are given for each: the size of the instance layout (the object, its
+__dict__ if any, and for messages the five policy implementations) and the growth of the resident set size divided by
+the number of objects.  Run it as a module from the directory containing the dispersy package:
+
+    python -m dispersy.tool.memory_benchmark --messages 20000 --candidates 20000
+"""
+
+import argparse
+import gc
+import logging
+import sys
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from twisted.internet import reactor
+
+from ..candidate import LoopbackCandidate, WalkCandidate
+from ..dispersy import Dispersy
+from ..endpoint import ManualEnpoint
+from ..tests.debugcommunity.community import DebugCommunity
+from .benchmark import get_memory_usage
+
+
+def get_layout_size(obj):
+    """
+    Returns the size of OBJ and its __dict__, when it has one, in bytes.
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def get_message_layout_size(message):
+    return get_layout_size(message) + sum(get_layout_size(policy) for policy in (message.authentication,
+                                                                                  message.resolution,
+                                                                                  message.distribution,
+                                                                                  message.destination,
+                                                                                  message.payload))
+
+
+def measure(create, count):
+    """
+    Calls CREATE COUNT times and returns the created objects and the resident set growth per object.
+    """
+    gc.collect()
+    before = get_memory_usage()
+    objects = [create(i) for i in xrange(count)]
+    gc.collect()
+    return objects, float(get_memory_usage() - before) / count
+
+
+def run(args):
+    working_directory = unicode(mkdtemp(suffix="_dispersy_memory_benchmark"))
+    dispersy = Dispersy(ManualEnpoint(0), working_directory, u":memory:")
+    dispersy.start(autoload_discovery=False)
+    try:
+        master_member = dispersy.get_new_member(u"low")
+        my_member = dispersy.get_new_member(u"low")
+        community = DebugCommunity.init_community(dispersy, master_member, my_member)
+        meta = community.get_meta_message(u"full-sync-text")
+        packets = [meta.impl(authentication=(my_member,), distribution=(global_time,),
+                             payload=("message %d" % global_time,)).packet
+                   for global_time in xrange(1, args.messages + 1)]
+        conversion = community.get_conversion_for_packet(packets[0])
+        candidate = LoopbackCandidate()
+        messages, rss = measure(lambda i: conversion.decode_message(candidate, packets[i], verify=False), args.messages)
+        print "%-10s %8d objects %6d bytes layout %8.1f bytes rss" % ("message", len(messages),
+                                                                         get_message_layout_size(messages[0]), rss)
+        del messages
+
+        def create_candidate(i):
+            address = ("10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255), 7759)
+            return WalkCandidate(address, False, address, address, u"unknown")
+        candidates, rss = measure(create_candidate, args.candidates)
+        print "%-10s %8d objects %6d bytes layout %8.1f bytes rss" % ("candidate", len(candidates),
+                                                                         get_layout_size(candidates[0]), rss)
+
+    finally:
+        dispersy.stop()
+        rmtree(working_directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000, help="number of decoded messages to keep")
+    parser.add_argument("--candidates", type=int, default=20000, help="number of candidates to keep")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)-15s [%(levelname)s] %(message)s", level=logging.ERROR)
+
+    def run_and_stop():
+        # Dispersy expects to be used from the reactor thread
+        try:
+            run(args)
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(run_and_stop)
+    reactor.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python2
+
+"""
+Replays captured traffic against a Dispersy instance to profile the decode, check and store pipeline.
+
+Incoming packets are captured with StandaloneEndpoint.start_capture, or the --capture option of tool/main.py.  This
+tool hands the captured packets to a Dispersy instance through a ManualEnpoint, either at the original speed or as
+fast as possible, and writes the attach_runtime_statistics timings of the replay as a single JSON document.  Run it as
+a module from the directory containing the dispersy package:
+
+    python -m dispersy.tool.replay --statedir replay --community module.Class capture.dpcap
+
+Packets are only processed by communities that Dispersy can load, hence the state directory should contain a copy of
+the database of the node that captured the traffic, and every community class that should be profiled must be given
+with --community.  Rotated capture files (capture.dpcap.1, capture.dpcap.2, ...) are replayed oldest first.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
+from twisted.internet.task import deferLater
+
+from ..dispersy import Dispersy
+from ..endpoint import ManualEnpoint
+from ..packetcapture import get_capture_files, read_batches
+from ..statistics import _runtime_statistics
+from .benchmark import get_cpu_time
+
+
+class Replay(object):
+
+    def __init__(self, dispersy, filenames, speed=0.0):
+        """
+        Replays the packets in FILENAMES through the ManualEnpoint of DISPERSY.
+
+        SPEED is the replay speed relative to the original traffic, 0.0 replays as fast as possible.
+        """
+        assert isinstance(dispersy.endpoint, ManualEnpoint), type(dispersy.endpoint)
+        assert speed >= 0.0, speed
+        self._dispersy = dispersy
+        self._filenames = filenames
+        self._speed = speed
+
+    @inlineCallbacks
+    def run(self):
+        """
+        Replays all packets and returns a dictionary with the results.
+
+        The runtime statistics are cleared first, hence they only contain the work caused by the replay.
+        """
+        endpoint = self._dispersy.endpoint
+        _runtime_statistics.clear()
+        statistics_before = self._dispersy.statistics.snapshot()
+
+        packet_count = byte_count = batch_count = 0
+        cpu_before = get_cpu_time()
+        start = time.time()
+        first_timestamp = None
+        for timestamp, packets in read_batches(self._filenames):
+            if first_timestamp is None:
+                first_timestamp = timestamp
+
+            if self._speed:
+                delay = start + (timestamp - first_timestamp) / self._speed - time.time()
+                if delay > 0.0:
+                    yield deferLater(reactor, delay, lambda: None)
+
+            endpoint.process_packets(packets)
+            batch_count += 1
+            packet_count += len(packets)
+            byte_count += sum(len(data) for _, data in packets)
+
+            # the endpoint hands the packets to Dispersy using callFromThread, which runs calls in order
+            processed = Deferred()
+            reactor.callFromThread(processed.callback, None)
+            yield processed
+
+        duration = time.time() - start
+        cpu = get_cpu_time() - cpu_before
+
+        runtime = sorted((statistic.get_dict(entry=entry) for entry, statistic in _runtime_statistics.iteritems()),
+                         key=lambda statistic: statistic["duration"], reverse=True)
+        _, statistics = self._dispersy.statistics.delta(statistics_before)
+
+        returnValue({
+            u"files": self._filenames,
+            u"speed": self._speed,
+            u"batches": batch_count,
+            u"packets": packet_count,
+            u"bytes": byte_count,
+            u"duration_seconds": duration,
+            u"cpu_seconds": cpu,
+            u"packets_per_second": packet_count / duration if duration else 0.0,
+            u"cpu_seconds_per_packet": cpu / packet_count if packet_count else None,
+            u"statistics": statistics,
+            u"runtime": runtime,
+        })
+
+
+def load_class(name):
+    module, class_ = name.strip().rsplit(".", 1)
+    return getattr(__import__(module, fromlist=[class_]), class_)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="the capture file, rotated files are included automatically")
+    parser.add_argument("--statedir", default=u".", help="the Dispersy state directory")
+    parser.add_argument("--databasefile", default=u":memory:", help="the Dispersy database, relative to --statedir")
+    parser.add_argument("--community", action="append", default=[],
+                        help="community class to load, i.e. module.module.class (may be repeated)")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="replay speed relative to the original traffic, 0 replays as fast as possible")
+    parser.add_argument("--sample-rate", type=float, default=1.0, help="fraction of calls that is timed")
+    parser.add_argument("--output", default=None, help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    filenames = get_capture_files(args.capture)
+    if not filenames:
+        parser.error("no capture files found at %s" % args.capture)
+    if args.speed < 0.0:
+        parser.error("the speed can not be negative")
+    if not 0.0 < args.sample_rate <= 1.0:
+        parser.error("the sample rate must be in (0, 1]")
+    try:
+        community_classes = [load_class(name) for name in args.community]
+    except (ImportError, AttributeError, ValueError) as exception:
+        parser.error("invalid --community: %s" % exception)
+
+    logging.basicConfig(format="%(asctime)-15s [%(levelname)s] %(message)s", level=logging.ERROR)
+
+    result = []
+    failure = []
+
+    @inlineCallbacks
+    def run():
+        # Dispersy and the TaskManager expect to be used from the reactor thread
+        dispersy = Dispersy(ManualEnpoint(0), unicode(args.statedir), unicode(args.databasefile))
+        try:
+            dispersy.start(autoload_discovery=False)
+            dispersy.statistics.enable_runtime_statistics(True, args.sample_rate)
+            my_member = dispersy.get_new_member(u"curve25519")
+            for community_class in community_classes:
+                dispersy.define_auto_load(community_class, my_member, load=True)
+
+            result.append((yield Replay(dispersy, filenames, args.speed).run()))
+            yield dispersy.stop()
+        except:
+            failure.append(sys.exc_info())
+            raise
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+
+    if failure:
+        raise failure[0][0], failure[0][1], failure[0][2]
+
+    output = json.dumps(result[0], indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + os.linesep)
+    else:
+        print output
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python2
+
+"""
+Compares the sync table layout of database version 21 with that of version 22.
+
+Version 21 stores the packets in the sync table itself, hence every query that only needs the metadata columns reads
+pages that are mostly filled with packets.  Version 22 moves the packets into the sync_packet table and adds covering
+indexes.  This tool generates a large version 21 database with synthetic messages, times a set of representative
+queries, upgrades a copy of the database using DispersyDatabase, and times the same queries against the upgraded
+database.  The results are written as a single JSON document.  Run it as a module from the directory containing the
+dispersy package:
+
+    python -m dispersy.tool.sync_schema_benchmark --rows 500000 --packet-size 600
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from random import Random
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp
+
+from ..dispersydatabase import DispersyDatabase, schema
+
+# turns a new, current, database into a version 21 database
+DOWNGRADE_TO_21 = u"""
+DROP TRIGGER sync_packet_delete;
+DROP TABLE sync_packet;
+DROP TABLE sync;
+CREATE TABLE sync(
+ id INTEGER PRIMARY KEY AUTOINCREMENT,
+ community INTEGER REFERENCES community(id),
+ member INTEGER REFERENCES member(id),                  -- the creator of the message
+ global_time INTEGER,
+ meta_message INTEGER REFERENCES meta_message(id),
+ undone INTEGER DEFAULT 0,
+ packet BLOB,
+ sequence INTEGER,
+ UNIQUE(community, member, global_time));
+CREATE INDEX sync_meta_message_undone_global_time_index ON sync(meta_message, undone, global_time);
+CREATE INDEX sync_meta_message_member ON sync(meta_message, member);
+UPDATE option SET value = '21' WHERE key = 'database_version';
+"""
+
+COMMUNITY_ID = 1
+# meta message 1 uses sequence numbers, the others do not
+META_MESSAGE_IDS = (1, 2, 3, 4)
+SEQUENCE_META_MESSAGE_ID = 1
+
+# (name, query for version 21, query for version 22).  every query gets the parameters from PARAMETERS[name]
+QUERIES = [
+    (u"count_syncable",
+     u"SELECT COUNT(*) FROM sync WHERE meta_message = ? AND undone = 0",
+     u"SELECT COUNT(*) FROM sync WHERE meta_message = ? AND undone = 0"),
+    (u"sequence_state",
+     u"SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
+     u"SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?"),
+    (u"last_global_time",
+     u"SELECT id, global_time FROM sync WHERE member = ? AND meta_message = ? ORDER BY global_time DESC LIMIT 1",
+     u"SELECT id, global_time FROM sync WHERE member = ? AND meta_message = ? ORDER BY global_time DESC LIMIT 1"),
+    (u"undone_lookup",
+     u"SELECT id, undone FROM sync WHERE community = ? AND member = ? AND global_time = ?",
+     u"SELECT id, undone FROM sync WHERE community = ? AND member = ? AND global_time = ?"),
+    (u"metadata_scan",
+     u"SELECT id, member, global_time FROM sync WHERE community = ? AND undone = 0",
+     u"SELECT id, member, global_time FROM sync WHERE community = ? AND undone = 0"),
+    (u"sync_range_packets",
+     u"SELECT packet FROM sync "
+     u"WHERE meta_message = ? AND undone = 0 AND global_time BETWEEN ? AND ? AND (global_time + 0) % 1 = 0 "
+     u"ORDER BY global_time",
+     u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id "
+     u"WHERE meta_message = ? AND undone = 0 AND global_time BETWEEN ? AND ? AND (global_time + 0) % 1 = 0 "
+     u"ORDER BY global_time"),
+    (u"sequence_packets",
+     u"SELECT packet FROM sync WHERE member = ? AND meta_message = ? AND sequence BETWEEN ? AND ? ORDER BY sequence",
+     u"SELECT packet FROM sync JOIN sync_packet ON sync_packet.sync = sync.id "
+     u"WHERE member = ? AND meta_message = ? AND sequence BETWEEN ? AND ? ORDER BY sequence"),
+]
+
+
+def generate_database(path, rows, members, packet_size, undone_ratio, random):
+    """
+    Creates a version 21 database at PATH containing ROWS messages created by MEMBERS members.
+    """
+    connection = sqlite3.connect(path)
+    connection.executescript(schema)
+    connection.executescript(DOWNGRADE_TO_21)
+    connection.execute(u"INSERT INTO community (id, master, member, classification) VALUES (?, 1, 1, 'Benchmark')",
+                       (COMMUNITY_ID,))
+    connection.executemany(u"INSERT INTO meta_message (id, community, name) VALUES (?, ?, ?)",
+                           [(meta_id, COMMUNITY_ID, u"meta-%d" % meta_id) for meta_id in META_MESSAGE_IDS])
+
+    sequence_numbers = [0] * members
+
+    def generator():
+        for global_time in xrange(1, rows + 1):
+            member = random.randrange(members)
+            meta_id = random.choice(META_MESSAGE_IDS)
+            if meta_id == SEQUENCE_META_MESSAGE_ID:
+                sequence_numbers[member] += 1
+                sequence = sequence_numbers[member]
+            else:
+                sequence = None
+            undone = 1 if random.random() < undone_ratio else 0
+            yield (COMMUNITY_ID, member + 1, global_time, meta_id, undone, buffer(os.urandom(packet_size)), sequence)
+
+    connection.executemany(u"INSERT INTO sync (community, member, global_time, meta_message, undone, packet, sequence) "
+                           u"VALUES (?, ?, ?, ?, ?, ?, ?)", generator())
+    connection.commit()
+    connection.execute(u"ANALYZE")
+    connection.close()
+    return sequence_numbers
+
+
+def make_parameters(rows, members, sequence_numbers, count, random):
+    """
+    Returns a dictionary with COUNT parameter tuples for every query in QUERIES.
+    """
+    def member():
+        return random.randrange(members) + 1
+
+    def sequence_range(member_id):
+        high = max(1, sequence_numbers[member_id - 1])
+        low = random.randint(1, high)
+        return low, min(high, low + 9)
+
+    parameters = {
+        u"count_syncable": [(random.choice(META_MESSAGE_IDS),) for _ in xrange(count)],
+        u"sequence_state": [(member(), SEQUENCE_META_MESSAGE_ID) for _ in xrange(count)],
+        u"last_global_time": [(member(), random.choice(META_MESSAGE_IDS)) for _ in xrange(count)],
+        u"undone_lookup": [(COMMUNITY_ID, member(), random.randint(1, rows)) for _ in xrange(count)],
+        # a full scan of the sync table, repeating it often only makes the benchmark slow
+        u"metadata_scan": [(COMMUNITY_ID,) for _ in xrange(max(1, count // 100))],
+        u"sync_range_packets": [],
+        u"sequence_packets": [],
+    }
+    for _ in xrange(count):
+        low = random.randint(1, rows)
+        parameters[u"sync_range_packets"].append((random.choice(META_MESSAGE_IDS), low, low + 200))
+        member_id = member()
+        parameters[u"sequence_packets"].append((member_id, SEQUENCE_META_MESSAGE_ID) + sequence_range(member_id))
+    return parameters
+
+
+def time_queries(path, version, parameters, cache_size):
+    """
+    Returns a dictionary with the average number of seconds every query in QUERIES takes on the database at PATH.
+    """
+    connection = sqlite3.connect(path)
+    connection.execute(u"PRAGMA cache_size = %d" % cache_size)
+    result = {}
+    for name, query_21, query_22 in QUERIES:
+        query = query_21 if version == 21 else query_22
+        start = time.time()
+        for arguments in parameters[name]:
+            connection.execute(query, arguments).fetchall()
+        result[name] = (time.time() - start) / len(parameters[name])
+    connection.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000, help="number of messages in the sync table")
+    parser.add_argument("--members", type=int, default=1000, help="number of members that created the messages")
+    parser.add_argument("--packet-size", type=int, default=500, help="size of every packet in bytes")
+    parser.add_argument("--undone", type=float, default=0.05, help="fraction of the messages that is undone")
+    parser.add_argument("--queries", type=int, default=1000, help="number of times every query is executed")
+    parser.add_argument("--cache-size", type=int, default=-2000,
+                        help="SQLite cache_size used while timing, negative values are in KiB")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for the generated data")
+    parser.add_argument("--directory", default=None,
+                        help="directory for the generated databases, a temporary directory is used by default")
+    parser.add_argument("--output", default=None, help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.rows < 1 or args.members < 1 or args.queries < 1:
+        parser.error("--rows, --members, and --queries must be positive")
+    if not 0.0 <= args.undone <= 1.0:
+        parser.error("--undone must be in [0, 1]")
+
+    directory = args.directory or mkdtemp(prefix="sync_schema_benchmark")
+    try:
+        random = Random(args.seed)
+        path_21 = os.path.join(directory, u"dispersy_v21.db")
+        path_22 = os.path.join(directory, u"dispersy_v22.db")
+        for path in (path_21, path_22):
+            if os.path.exists(path):
+                os.remove(path)
+
+        start = time.time()
+        sequence_numbers = generate_database(path_21, args.rows, args.members, args.packet_size, args.undone, random)
+        generate_duration = time.time() - start
+        copyfile(path_21, path_22)
+
+        start = time.time()
+        database = DispersyDatabase(path_22)
+        database.open()
+        database.execute(u"ANALYZE")
+        # the pages of the old sync table are reused by SQLite, the upgrade does not return them to the file system
+        freelist_count, = database.execute(u"PRAGMA freelist_count").next()
+        page_size, = database.execute(u"PRAGMA page_size").next()
+        database.close()
+        upgrade_duration = time.time() - start
+
+        parameters = make_parameters(args.rows, args.members, sequence_numbers, args.queries, random)
+        before = time_queries(path_21, 21, parameters, args.cache_size)
+        after = time_queries(path_22, 22, parameters, args.cache_size)
+
+        result = {
+            u"rows": args.rows,
+            u"members": args.members,
+            u"packet_size": args.packet_size,
+            u"queries": args.queries,
+            u"cache_size": args.cache_size,
+            u"generate_seconds": generate_duration,
+            u"upgrade_seconds": upgrade_duration,
+            u"database_bytes": {u"21": os.path.getsize(path_21), u"22": os.path.getsize(path_22),
+                                 u"22_free": freelist_count * page_size},
+            u"query_seconds": dict((name, {u"21": before[name],
+                                           u"22": after[name],
+                                           u"speedup": before[name] / after[name] if after[name] else None})
+                                   for name, _, _ in QUERIES),
+        }
+
+    finally:
+        if not args.directory:
+            rmtree(directory, ignore_errors=True)
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + os.linesep)
+    else:
+        print output
+
+if __name__ == "__main__":
+    main()
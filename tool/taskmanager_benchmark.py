@@ -0,0 +1,74 @@
+#!/usr/bin/env python2
+
+"""
+Microbenchmark for the TaskManager registry.
+
+Registers and cancels (or fires) a large number of short-lived tasks, the way RequestCache and the message
+batching in Community use the TaskManager, and reports the achieved rate.  Run it as a module from the directory
+containing the dispersy package:
+
+    python -m dispersy.tool.taskmanager_benchmark --cycles 100000
+"""
+
+import argparse
+import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+
+from ..taskmanager import TaskManager
+
+
+def register_cancel(task_manager, cycles, outstanding):
+    """
+    Keeps OUTSTANDING DelayedCalls registered while doing CYCLES register/cancel pairs.
+    """
+    for i in xrange(cycles):
+        task_manager.register_task(i, reactor.callLater(10.0, lambda: None))
+        if i >= outstanding:
+            task_manager.cancel_pending_task(i - outstanding)
+
+
+def register_fire(task_manager, cycles, outstanding):
+    """
+    Keeps OUTSTANDING Deferreds registered while doing CYCLES registrations, firing the oldest Deferred instead of
+    cancelling it.
+    """
+    deferreds = {}
+    for i in xrange(cycles):
+        deferreds[i] = task_manager.register_task(i, Deferred())
+        if i >= outstanding:
+            deferreds.pop(i - outstanding).callback(None)
+    for deferred in deferreds.itervalues():
+        deferred.callback(None)
+
+
+def run(name, func, cycles, outstanding):
+    task_manager = TaskManager()
+    start = time.time()
+    func(task_manager, cycles, outstanding)
+    duration = time.time() - start
+    print "%-16s %8d cycles %8.3fs %10.0f cycles/s (%d tasks left)" % (name, cycles, duration, cycles / duration,
+                                                                        len(task_manager._pending_tasks))
+    task_manager.cancel_all_pending_tasks()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cycles", type=int, default=100000, help="number of register/cancel cycles")
+    parser.add_argument("--outstanding", type=int, default=1000, help="number of tasks registered at any time")
+    args = parser.parse_args()
+
+    def benchmark():
+        # the TaskManager expects to be used from the reactor thread
+        try:
+            run("register/cancel", register_cancel, args.cycles, args.outstanding)
+            run("register/fire", register_fire, args.cycles, args.outstanding)
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(benchmark)
+    reactor.run()
+
+if __name__ == "__main__":
+    main()
@@ -17,16 +17,12 @@ class TrackerHardKilledCommunity(HardKilledCommunity):
         self._strikes += 1
         return self._strikes
 
-    def dispersy_on_introduction_request(self, messages):
-        hex_cid = messages[0].community.cid.encode("HEX")
+    def on_introduction_request(self, messages):
+        event_log = self._dispersy.event_log
         for message in messages:
-            host, port = message.candidate.sock_addr
-            print "DESTROY_OUT", hex_cid,
-            message.authentication.member.mid.encode("HEX"),
-            ord(message.conversion.dispersy_version),
-            ord(message.conversion.community_version), host, port
+            event_log.record_candidate("DESTROY_OUT", message)
 
-        return super(TrackerHardKilledCommunity, self).dispersy_on_introduction_request(messages)
+        return super(TrackerHardKilledCommunity, self).on_introduction_request(messages)
 
 
 class TrackerCommunity(Community):
@@ -47,6 +43,10 @@ class TrackerCommunity(Community):
 
         self._walked_stumbled_candidates = self._iter_categories([u'walk', u'stumble'])
 
+        # member database_id:packet pairs containing the dispersy-identity of every member, these are written to the
+        # persistent storage when the community is destroyed
+        self._identity_packets = {}
+
     def initiate_meta_messages(self):
         messages = super(TrackerCommunity, self).initiate_meta_messages()
 
@@ -120,15 +120,11 @@ class TrackerCommunity(Community):
     def dispersy_cleanup_community(self, message):
         # since the trackers use in-memory databases, we need to store the destroy-community
         # message, and all associated proof, separately.
-        host, port = message.candidate.sock_addr
-        print "DESTROY_IN", self._cid.encode("HEX"), message.authentication.member.mid.encode("HEX"),
-        ord(message.conversion.dispersy_version), ord(message.conversion.community_version), host, port
+        self._dispersy.event_log.record_candidate("DESTROY_IN", message)
 
         write = open(self._dispersy.persistent_storage_filename, "a+").write
         write("# received dispersy-destroy-community from %s\n" % (str(message.candidate),))
 
-        identity_id = self._meta_messages[u"dispersy-identity"].database_id
-        execute = self._dispersy.database.execute
         messages = [message]
         stored = set()
         while messages:
@@ -138,40 +134,34 @@ class TrackerCommunity(Community):
                 stored.add(message.packet)
                 write(" ".join((message.name, message.packet.encode("HEX"), "\n")))
 
-                if not message.authentication.member.public_key in stored:
-                    try:
-                        packet, = execute(u"SELECT packet FROM sync WHERE meta_message = ? AND member = ?", (
-                            identity_id, message.authentication.member.database_id)).next()
-                    except StopIteration:
-                        pass
-                    else:
-                        write(" ".join(("dispersy-identity", str(packet).encode("HEX"), "\n")))
+                packet = self._identity_packets.get(message.authentication.member.database_id)
+                if packet and not packet in stored:
+                    stored.add(packet)
+                    write(" ".join(("dispersy-identity", packet.encode("HEX"), "\n")))
 
                 _, proofs = self._timeline.check(message)
                 messages.extend(proofs)
 
         return TrackerHardKilledCommunity
 
+    def on_identity(self, messages):
+        for message in messages:
+            self._identity_packets[message.authentication.member.database_id] = message.packet
+
+        return super(TrackerCommunity, self).on_identity(messages)
+
     def on_introduction_request(self, messages):
         if not self._dispersy._silent:
-            hex_cid = self.cid.encode("HEX")
+            event_log = self._dispersy.event_log
             for message in messages:
-                host, port = message.candidate.sock_addr
-                print "REQ_IN2", hex_cid,
-                message.authentication.member.mid.encode("HEX"),
-                ord(message.conversion.dispersy_version),
-                ord(message.conversion.community_version), host, port
+                event_log.record_candidate("REQ_IN2", message)
 
         return super(TrackerCommunity, self).on_introduction_request(messages)
 
     def on_introduction_response(self, messages):
         if not self._dispersy._silent:
-            hex_cid = self.cid.encode("HEX")
+            event_log = self._dispersy.event_log
             for message in messages:
-                host, port = message.candidate.sock_addr
-                print "RES_IN2", hex_cid,
-                message.authentication.member.mid.encode("HEX"),
-                ord(message.conversion.dispersy_version),
-                ord(message.conversion.community_version), host, port
+                event_log.record_candidate("RES_IN2", message)
 
         return super(TrackerCommunity, self).on_introduction_response(messages)
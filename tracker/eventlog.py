@@ -0,0 +1,200 @@
+"""
+Buffered event log for the tracker.
+
+The tracker records an event for every introduction request and response that it receives.  Writing each of these to
+stdout, from the reactor thread, is too expensive on a busy tracker.  TrackerEventLog stores events in a preallocated
+ring buffer instead.  Periodically the buffered events are handed to a thread that formats and writes them.
+
+Every event is written as one line:
+EVENT FIELD FIELD ...
+
+When TIMESTAMPS is True every line is prefixed with the time at which the event was recorded:
+TIMESTAMP EVENT FIELD FIELD ...
+
+Candidate events (REQ_IN2, RES_IN2, DESTROY_IN, DESTROY_OUT) have the fields:
+HEX(COMMUNITY) HEX(MEMBER) DISPERSY-VERSION OVERLAY-VERSION ADDRESS PORT
+"""
+import logging
+import os
+import sys
+import threading
+from time import time
+
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+
+from ..taskmanager import TaskManager
+
+
+class TrackerEventLog(TaskManager):
+
+    def __init__(self, filename=None, capacity=64 * 1024, flush_interval=1.0, sample_rates=None,
+                 max_bytes=100 * 1024 * 1024, backup_count=10, timestamps=False):
+        """
+        Events are written to FILENAME, or to stdout when FILENAME is None.
+
+        At most CAPACITY events are buffered, events that arrive while the buffer is full are dropped and counted.
+        SAMPLE_RATES is a dictionary with EVENT:N pairs, only one in N of these events is recorded.  FILENAME is
+        rotated once it is larger than MAX_BYTES, keeping BACKUP_COUNT old files.  When TIMESTAMPS is True every line
+        starts with the time at which the event was recorded.
+        """
+        assert filename is None or isinstance(filename, (str, unicode)), type(filename)
+        assert isinstance(capacity, int), type(capacity)
+        assert 0 < capacity, capacity
+        super(TrackerEventLog, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._filename = filename
+        self._flush_interval = flush_interval
+        self._sample_rates = dict(sample_rates or {})
+        self._sample_counters = dict((event, 0) for event in self._sample_rates)
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._timestamps = timestamps
+
+        # ring buffer with (timestamp, event, fields, is_candidate_event) tuples
+        self._buffer = [None] * capacity
+        self._capacity = capacity
+        self._head = 0
+        self._size = 0
+        self._dropped = 0
+
+        # only used while holding _write_lock, by the writer thread or by stop
+        self._file = None
+        self._write_lock = threading.Lock()
+        self._writing = False
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def _sample(self, event):
+        rate = self._sample_rates.get(event)
+        if rate > 1:
+            self._sample_counters[event] += 1
+            return self._sample_counters[event] % rate == 1
+        return True
+
+    def _append(self, record):
+        if self._size == self._capacity:
+            self._dropped += 1
+        else:
+            self._buffer[(self._head + self._size) % self._capacity] = record
+            self._size += 1
+
+    def record(self, event, *fields):
+        """
+        Record EVENT, each of FIELDS is written using str.
+        """
+        if self._sample(event):
+            self._append((time(), event, fields, False))
+
+    def record_candidate(self, event, message):
+        """
+        Record EVENT for MESSAGE that was received from or sent to a candidate.
+
+        Only references to the binary values are buffered, the hex encoding happens in the writer thread.
+        """
+        if self._sample(event):
+            host, port = message.candidate.sock_addr
+            self._append((time(), event, (message.community.cid, message.authentication.member.mid,
+                                          message.conversion.dispersy_version, message.conversion.community_version,
+                                          host, port), True))
+
+    def start(self):
+        self.register_task("flush", LoopingCall(self.flush)).start(self._flush_interval, now=False)
+
+    def stop(self):
+        """
+        Stop flushing periodically and write all buffered events from the calling thread.
+
+        When the writer thread is busy this waits until it is done, hence no events are lost.
+        """
+        self.cancel_all_pending_tasks()
+        with self._write_lock:
+            self._write(self._take())
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+
+    def _take(self):
+        """
+        Remove and return all buffered events.
+        """
+        records = []
+        buffer_, capacity = self._buffer, self._capacity
+        for index in xrange(self._head, self._head + self._size):
+            index %= capacity
+            records.append(buffer_[index])
+            buffer_[index] = None
+        self._head = (self._head + self._size) % capacity
+        self._size = 0
+
+        if self._dropped:
+            records.append((time(), "DROPPED", (self._dropped,), False))
+            self._dropped = 0
+        return records
+
+    def flush(self):
+        # the previous batch is still being written, the events stay buffered until the next flush
+        if self._writing or not self._size:
+            return
+
+        def on_written(result):
+            self._writing = False
+            return result
+
+        self._writing = True
+        deferred = deferToThread(self._locked_write, self._take())
+        deferred.addErrback(lambda failure: self._logger.error("unable to write events: %s", failure.getErrorMessage()))
+        deferred.addBoth(on_written)
+        return deferred
+
+    def _locked_write(self, records):
+        with self._write_lock:
+            self._write(records)
+
+    def _write(self, records):
+        if not records:
+            return
+
+        lines = []
+        for timestamp, event, fields, is_candidate_event in records:
+            if is_candidate_event:
+                cid, mid, dispersy_version, community_version, host, port = fields
+                line = "%s %s %s %d %d %s %d\n" % (event, cid.encode("HEX"), mid.encode("HEX"),
+                                                    ord(dispersy_version), ord(community_version), host, port)
+            else:
+                line = "%s %s\n" % (event, " ".join(str(field) for field in fields))
+            lines.append("%.3f %s" % (timestamp, line) if self._timestamps else line)
+
+        if self._filename is None:
+            sys.stdout.writelines(lines)
+            sys.stdout.flush()
+            return
+
+        if self._file is None:
+            self._file = open(self._filename, "a")
+        self._file.writelines(lines)
+        self._file.flush()
+
+        if self._max_bytes and self._file.tell() > self._max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for index in xrange(self._backup_count - 1, 0, -1):
+            source = "%s.%d" % (self._filename, index)
+            if os.path.exists(source):
+                destination = "%s.%d" % (self._filename, index + 1)
+                if os.path.exists(destination):
+                    os.remove(destination)
+                os.rename(source, destination)
+        if self._backup_count:
+            destination = self._filename + ".1"
+            if os.path.exists(destination):
+                os.remove(destination)
+            os.rename(self._filename, destination)
+        else:
+            os.remove(self._filename)
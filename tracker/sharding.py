@@ -0,0 +1,198 @@
+"""
+Run one tracker as several worker processes.
+
+All workers bind the same public UDP port using SO_REUSEPORT.  The kernel balances incoming packets over the workers by
+source address, while every community must live in exactly one worker.  Therefore each worker forwards the packets for
+communities that it does not own, identified by the community id at packet[2:22], to the owning worker over a loopback
+socket.  The owning worker processes the packet as if it was received directly and replies from the shared public port.
+
+Worker 0 aggregates the statistics that the other workers periodically send to it.
+
+Only datagrams sent from the loopback address of one of the workers are accepted on the forward socket, other
+datagrams, and datagrams that can not be decoded, are dropped.
+"""
+import socket
+import struct
+from time import time
+
+from ..endpoint import StandaloneEndpoint, TUNNEL_PREFIX, TUNNEL_PREFIX_LENGHT
+
+# first byte of every datagram sent between workers
+FORWARD_PACKET = "P"
+FORWARD_STATISTICS = "S"
+
+# loopback ports are FORWARD_PORT_OFFSET above the public port unless specified otherwise
+FORWARD_PORT_OFFSET = 10000
+
+# statistics of a worker that did not report for this many seconds are no longer included in the totals.  the workers
+# report every 300 seconds
+SHARD_STATISTICS_TIMEOUT = 900.0
+
+_address_struct = struct.Struct("!4sH")
+_shard_struct = struct.Struct("!H")
+
+
+def get_shard(data, shard_count):
+    """
+    Returns the index of the worker that owns the community that the packet DATA is addressed to.
+    """
+    if data.startswith(TUNNEL_PREFIX):
+        data = data[TUNNEL_PREFIX_LENGHT:]
+    if len(data) < 22:
+        return 0
+    # the community id is a sha1 digest, its first four bytes are uniformly distributed
+    return struct.unpack_from("!L", data, 2)[0] % shard_count
+
+
+def encode_forwarded_packet(sock_addr, data):
+    host, port = sock_addr
+    return FORWARD_PACKET + _address_struct.pack(socket.inet_aton(host), port) + data
+
+
+def decode_forwarded_packet(datagram):
+    """
+    Returns a (sock_addr, data) tuple for a DATAGRAM made by encode_forwarded_packet.
+    """
+    assert datagram[0] == FORWARD_PACKET, datagram[0]
+    host, port = _address_struct.unpack_from(datagram, 1)
+    return (socket.inet_ntoa(host), port), datagram[1 + _address_struct.size:]
+
+
+def encode_statistics(shard_index, values):
+    return FORWARD_STATISTICS + _shard_struct.pack(shard_index) + " ".join(str(value) for value in values)
+
+
+def decode_statistics(datagram):
+    """
+    Returns a (shard_index, values) tuple for a DATAGRAM made by encode_statistics.
+    """
+    assert datagram[0] == FORWARD_STATISTICS, datagram[0]
+    shard_index, = _shard_struct.unpack_from(datagram, 1)
+    return shard_index, tuple(int(value) for value in datagram[1 + _shard_struct.size:].split())
+
+
+class ShardedEndpoint(StandaloneEndpoint):
+
+    def __init__(self, port, ip="0.0.0.0", shard_index=0, shard_count=1, forward_port=0):
+        """
+        Worker SHARD_INDEX out of SHARD_COUNT workers that all listen at IP:PORT.
+
+        Worker N receives forwarded packets at 127.0.0.1:FORWARD_PORT+N, FORWARD_PORT defaults to
+        PORT+FORWARD_PORT_OFFSET.
+        """
+        assert isinstance(port, int), type(port)
+        assert 0 < port, "the workers must agree on the port"
+        assert 0 <= shard_index < shard_count, (shard_index, shard_count)
+        super(ShardedEndpoint, self).__init__(port, ip)
+        self._shard_index = shard_index
+        self._shard_count = shard_count
+        forward_port = forward_port or port + FORWARD_PORT_OFFSET
+        self._forward_addresses = [("127.0.0.1", forward_port + index) for index in xrange(shard_count)]
+        self._forward_address_set = set(self._forward_addresses)
+        self._forward_socket = None
+        # shard index:(timestamp, statistics values) pairs received by worker 0
+        self._shard_statistics = {}
+
+    @property
+    def shard_index(self):
+        return self._shard_index
+
+    @property
+    def shard_count(self):
+        return self._shard_count
+
+    @property
+    def shard_statistics(self):
+        """
+        Dictionary with the most recent statistics values of the other workers, only filled for worker 0.
+
+        Workers that did not report during the last SHARD_STATISTICS_TIMEOUT seconds are not included.
+        """
+        deadline = time() - SHARD_STATISTICS_TIMEOUT
+        # items() returns a copy, the endpoint thread may update the dictionary meanwhile
+        return dict((shard_index, values)
+                    for shard_index, (timestamp, values) in self._shard_statistics.items()
+                    if timestamp > deadline)
+
+    def open(self, dispersy):
+        self._forward_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._forward_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 870400)
+        self._forward_socket.bind(self._forward_addresses[self._shard_index])
+        self._forward_socket.setblocking(0)
+        return super(ShardedEndpoint, self).open(dispersy)
+
+    def _create_socket(self):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("SO_REUSEPORT is not available on this platform")
+
+        # all workers must share the exact port, hence no fallback to the next port
+        self._logger.debug("Listening at %d as worker %d/%d", self._port, self._shard_index, self._shard_count)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 870400)
+        sock.bind((self._ip, self._port))
+        sock.setblocking(0)
+        return sock
+
+    def close(self, timeout=10.0):
+        result = super(ShardedEndpoint, self).close(timeout)
+        try:
+            self._forward_socket.close()
+        except socket.error as exception:
+            self._logger.exception("%s", exception)
+            result = False
+        return result
+
+    def _read_sockets(self):
+        return [self._socket.fileno(), self._forward_socket.fileno()]
+
+    def _on_readable(self, read_list):
+        packets = []
+
+        if self._socket.fileno() in read_list:
+            shard_count, shard_index = self._shard_count, self._shard_index
+            for sock_addr, data in self._receive(self._socket):
+                shard = get_shard(data, shard_count)
+                if shard == shard_index:
+                    packets.append((sock_addr, data))
+                else:
+                    self._forward(self._forward_addresses[shard], encode_forwarded_packet(sock_addr, data))
+
+        if self._forward_socket.fileno() in read_list:
+            for sock_addr, datagram in self._receive(self._forward_socket):
+                if not sock_addr in self._forward_address_set:
+                    self._dispersy.statistics.dict_inc(u"endpoint_recv", u"shard-forward-unknown-source")
+                    continue
+
+                try:
+                    if datagram[0] == FORWARD_PACKET:
+                        packets.append(decode_forwarded_packet(datagram))
+
+                    elif datagram[0] == FORWARD_STATISTICS:
+                        shard_index, values = decode_statistics(datagram)
+                        if not 0 < shard_index < self._shard_count:
+                            raise ValueError("invalid shard index %d" % shard_index)
+                        self._shard_statistics[shard_index] = (time(), values)
+
+                    else:
+                        raise ValueError("unknown datagram type")
+
+                except (IndexError, struct.error, ValueError):
+                    self._dispersy.statistics.dict_inc(u"endpoint_recv", u"shard-forward-invalid")
+
+        if packets:
+            self._logger.debug('%d came in, %d bytes in total', len(packets), sum(len(packet) for _, packet in packets))
+            self.data_came_in(packets)
+
+    def _forward(self, forward_address, datagram):
+        try:
+            self._forward_socket.sendto(datagram, forward_address)
+        except socket.error:
+            self._dispersy.statistics.dict_inc(u"endpoint_send", u"shard-forward-error")
+
+    def send_statistics(self, values):
+        """
+        Send the integer VALUES to worker 0.
+        """
+        assert self._shard_index != 0, "worker 0 aggregates the statistics"
+        self._forward(self._forward_addresses[0], encode_statistics(self._shard_index, values))
@@ -1,6 +1,10 @@
 """
 Run Dispersy in standalone tracker mode.
 
+All output is written to the event log (--eventlog, stdout when empty), --eventlog-timestamps prefixes each line with
+a timestamp.  The events are buffered and written by a background thread, --eventlog-sample records only one in N
+REQ_IN2 and RES_IN2 events.  With --silent only the DESTROY_IN, DESTROY_OUT, and CLEANED events are written.
+
 Outputs statistics every 300 seconds:
 - BANDWIDTH BYTES-UP BYTES-DOWN
 - COMMUNITY COUNT(OVERLAYS) COUNT(KILLED-OVERLAYS)
@@ -15,8 +19,18 @@ Outputs destroyed communities whenever notified by a candidate:
 - DESTROY_IN HEX(COMMUNITY) hex(MEMBER) DISPERSY-VERSION OVERLAY-VERSION ADDRESS PORT
 - DESTROY_OUT HEX(COMMUNITY) hex(MEMBER) DISPERSY-VERSION OVERLAY-VERSION ADDRESS PORT
 
+Outputs the number of unloaded inactive communities every 180 seconds:
+- CLEANED COUNT(INACTIVE-OVERLAYS) COUNT(OVERLAYS)
+
+Outputs the number of events that did not fit in the buffer:
+- DROPPED COUNT(EVENTS)
+
 Note that there is no output for REQ_IN2 for destroyed overlays.  Instead a DESTROY_OUT is given
 whenever a introduction request is received for a destroyed overlay.
+
+With --workers N the tracker runs as N processes that share the UDP port, each community is handled by exactly one of
+them.  Worker 0 spawns the others and outputs the aggregated BANDWIDTH, COMMUNITY, and CANDIDATE2 statistics.  The
+other workers write their log and event log to files suffixed with their worker index.
 """
 import errno
 import logging
@@ -30,6 +44,7 @@ from twisted.application.service import IServiceMaker, MultiService
 from twisted.conch import manhole_tap
 from twisted.internet import reactor
 from twisted.internet.defer import maybeDeferred, DeferredList
+from twisted.internet.protocol import ProcessProtocol
 from twisted.internet.task import LoopingCall
 from twisted.plugin import IPlugin
 from twisted.python import usage
@@ -46,13 +61,17 @@ from dispersy.discovery.community import DiscoveryCommunity
 from dispersy.dispersy import Dispersy
 from dispersy.endpoint import StandaloneEndpoint
 from dispersy.exception import CommunityNotFoundException
+from dispersy.memberstorage import MemoryMemberStorage
 from dispersy.tool.clean_observers import clean_twisted_observers
 from dispersy.tracker.community import TrackerCommunity, TrackerHardKilledCommunity
+from dispersy.tracker.eventlog import TrackerEventLog
+from dispersy.tracker.sharding import ShardedEndpoint
 
 # Register yappi profiler
 from utils import twistd_yappi
 
 COMMUNITY_CLEANUP_INTERVAL = 180.0
+WORKER_RESPAWN_DELAY = 5.0
 
 if sys.platform == 'win32':
     SOCKET_BLOCK_ERRORCODE = 10035  # WSAEWOULDBLOCK
@@ -65,13 +84,21 @@ clean_twisted_observers()
 
 class TrackerDispersy(Dispersy):
 
-    def __init__(self, endpoint, working_directory, silent=False, crypto=NoVerifyCrypto()):
-        super(TrackerDispersy, self).__init__(endpoint, working_directory, u":memory:", crypto)
+    def __init__(self, endpoint, working_directory, silent=False, crypto=NoVerifyCrypto(), event_log=None):
+        super(TrackerDispersy, self).__init__(endpoint, working_directory, u":memory:", crypto, MemoryMemberStorage())
 
         # location of persistent storage
         self._persistent_storage_filename = os.path.join(working_directory, "persistent-storage.data")
         self._silent = silent
         self._my_member = None
+        self._event_log = event_log or TrackerEventLog()
+
+    @property
+    def event_log(self):
+        """
+        The TrackerEventLog.
+        """
+        return self._event_log
 
     def start(self):
         assert isInIOThread()
@@ -85,17 +112,20 @@ class TrackerDispersy(Dispersy):
             self.define_auto_load(TrackerCommunity, self._my_member)
             self.define_auto_load(TrackerHardKilledCommunity, self._my_member)
 
+            self._event_log.start()
             if not self._silent:
-                self._statistics_looping_call = LoopingCall(self._report_statistics)
-                self._statistics_looping_call.start(300)
+                self.register_task("report statistics", LoopingCall(self._report_statistics)).start(300)
 
             return True
         return False
 
+    def stop(self, timeout=10.0):
+        self._event_log.stop()
+        return super(TrackerDispersy, self).stop(timeout)
+
     def _create_my_member(self):
         # generate a new my-member
-        ec = self.crypto.generate_key(u"very-low")
-        self._my_member = self.get_member(private_key=self.crypto.key_to_bin(ec))
+        self._my_member = self.get_new_member(u"very-low")
 
     @property
     def persistent_storage_filename(self):
@@ -137,32 +167,80 @@ class TrackerDispersy(Dispersy):
 
         now = time()
         inactive = [community for community in self._communities.itervalues() if not is_active(community, now)]
-        print "#cleaned %d/%d communities" % (len(inactive), len(self._communities))
+        self._event_log.record("CLEANED", len(inactive), len(self._communities))
 
         deferred_list = []
         for community in inactive:
             deferred_list.append(maybeDeferred(community.unload_community))
         return DeferredList(deferred_list)
 
-    def _report_statistics(self):
+    def _collect_statistics(self):
+        """
+        Returns the BANDWIDTH, COMMUNITY, and CANDIDATE2 values as one tuple.
+        """
         mapping = {TrackerCommunity: [0,0], TrackerHardKilledCommunity: [0,0], DiscoveryCommunity: [0,0]}
         for community in self._communities.itervalues():
             mapping[type(community)][0] += 1
-            mapping[type(community)][1] += len(list(community.dispersy_yield_verified_candidates())) 
+            mapping[type(community)][1] += len(list(community.dispersy_yield_verified_candidates()))
+
+        return (self._statistics.total_up, self._statistics.total_down,
+                mapping[TrackerCommunity][0], mapping[TrackerHardKilledCommunity][0], mapping[DiscoveryCommunity][0],
+                mapping[TrackerCommunity][1], mapping[TrackerHardKilledCommunity][1], mapping[DiscoveryCommunity][1])
+
+    def _report_statistics(self):
+        statistics = self._collect_statistics()
+        record = self._event_log.record
 
-        print "BANDWIDTH", self._statistics.total_up, self._statistics.total_down
-        print "COMMUNITY", mapping[TrackerCommunity][0], mapping[TrackerHardKilledCommunity][0], mapping[DiscoveryCommunity][0]
-        print "CANDIDATE2", mapping[TrackerCommunity][1], mapping[TrackerHardKilledCommunity][1], mapping[DiscoveryCommunity][1]
+        if isinstance(self._endpoint, ShardedEndpoint) and self._endpoint.shard_index:
+            # worker 0 reports the aggregated statistics
+            self._endpoint.send_statistics(statistics)
+
+        else:
+            if isinstance(self._endpoint, ShardedEndpoint):
+                for values in self._endpoint.shard_statistics.itervalues():
+                    statistics = tuple(a + b for a, b in zip(statistics, values))
+
+            record("BANDWIDTH", *statistics[0:2])
+            record("COMMUNITY", *statistics[2:5])
+            record("CANDIDATE2", *statistics[5:8])
 
         if self._statistics.msg_statistics.outgoing_dict:
             for key, value in self._statistics.msg_statistics.outgoing_dict.iteritems():
-                print "OUTGOING", key, value
+                record("OUTGOING", key, value)
+
+
+class WorkerProcessProtocol(ProcessProtocol):
+
+    """
+    Spawns the tracker worker with ARGS and spawns it again when it exits unexpectedly.
+    """
+
+    def __init__(self, shard_index, args):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._shard_index = shard_index
+        self._args = args
+        self._stopping = False
+
+    def spawn(self):
+        if not self._stopping:
+            reactor.spawnProcess(self, self._args[0], self._args, env=os.environ, childFDs={0: "w", 1: 1, 2: 2})
+
+    def stop(self):
+        self._stopping = True
+        if self.transport and self.transport.pid:
+            self.transport.signalProcess("TERM")
+
+    def processEnded(self, reason):
+        if not self._stopping:
+            self._logger.error("worker %d exited (%s), restarting", self._shard_index, reason.getErrorMessage())
+            reactor.callLater(WORKER_RESPAWN_DELAY, self.spawn)
 
 
 class Options(usage.Options):
     optFlags = [
         ["memory-dump", "d", "use meliae to dump the memory periodically"],
         ["silent"     , "s", "Prevent tracker printing to console"],
+        ["eventlog-timestamps", None, "Prefix every event log line with a timestamp"],
     ]
     optParameters = [
         ["statedir", "s", "."       ,     "Use an alternate statedir"                                    , str],
@@ -171,9 +249,20 @@ class Options(usage.Options):
         ["crypto"  , "c", "ECCrypto",     "The Crypto object type Dispersy is going to use"              , str],
         ["manhole" , "m", 0         ,     "Enable manhole telnet service listening at the specified port", int],
         ["logfile" , "l", "dispersy.log", "Use an alternate dispersy log file name",                       str],
-        ["loglevel", "v", "DEBUG", "Set the logging level (DEBUG, INFO, WARN, ERROR)", str]
+        ["loglevel", "v", "DEBUG", "Set the logging level (DEBUG, INFO, WARN, ERROR)", str],
+        ["eventlog", "e", "", "Write tracker events to this file in the statedir, stdout when empty", str],
+        ["eventlog-sample", "r", 1, "Record one in N REQ_IN2 and RES_IN2 events", int],
+        ["workers", "w", 1, "Run the tracker in N processes that share the port", int],
+        ["forward-port", None, 0, "Workers forward packets to each other starting at this loopback port, port+10000 when 0", int],
+        ["shard-index", None, 0, "The worker index of this process, set by worker 0 when spawning the others", int],
     ]
 
+    def postOptions(self):
+        if self["workers"] < 1:
+            raise usage.UsageError("--workers must be at least 1")
+        if not 0 <= self["shard-index"] < self["workers"]:
+            raise usage.UsageError("--shard-index must be smaller than --workers")
+
 
 class TrackerServiceMaker(object):
     implements(IServiceMaker, IPlugin)
@@ -207,6 +296,21 @@ class TrackerServiceMaker(object):
             tracker_service.addService(manhole)
             manhole.startService()
 
+        def worker_args(shard_index):
+            # twistd options for a worker: stay in the foreground and leave pid and twistd log files to worker 0
+            args = [sys.executable, "-c", "from twisted.scripts.twistd import run; run()", "--nodaemon", "--pidfile=",
+                    "--logfile=%s" % os.path.join(options["statedir"], "twistd.log.%d" % shard_index), self.tapname]
+            for flag in Options.optFlags:
+                if options[flag[0]]:
+                    args.append("--%s" % flag[0])
+            for parameter in Options.optParameters:
+                if parameter[0] not in ("manhole", "shard-index"):
+                    args.append("--%s=%s" % (parameter[0], options[parameter[0]]))
+            args.append("--shard-index=%d" % shard_index)
+            return args
+
+        workers = []
+
         def run():
             # Setup logging
             if not options["loglevel"]:
@@ -215,18 +319,30 @@ class TrackerServiceMaker(object):
             print "Using logging level: %s" % options["loglevel"]
             log_level = getattr(logging, options["loglevel"])
 
+            shard_index = options["shard-index"]
+            suffix = ".%d" % shard_index if shard_index else ""
+
             root = logging.getLogger()
             root.setLevel(log_level)
-            handler = RotatingFileHandler(os.path.join(options["statedir"], options["logfile"]),
+            handler = RotatingFileHandler(os.path.join(options["statedir"], options["logfile"] + suffix),
                                           maxBytes=1024 * 1024 * 100, backupCount=10)
             root.addHandler(handler)
 
             # setup
-            dispersy = TrackerDispersy(StandaloneEndpoint(options["port"],
-                                                          options["ip"]),
+            sample_rate = options["eventlog-sample"]
+            event_log = TrackerEventLog(os.path.join(options["statedir"], options["eventlog"] + suffix) if options["eventlog"] else None,
+                                        sample_rates={"REQ_IN2": sample_rate, "RES_IN2": sample_rate},
+                                        timestamps=bool(options["eventlog-timestamps"]))
+            if options["workers"] > 1:
+                endpoint = ShardedEndpoint(options["port"], options["ip"], shard_index, options["workers"],
+                                           options["forward-port"])
+            else:
+                endpoint = StandaloneEndpoint(options["port"], options["ip"])
+            dispersy = TrackerDispersy(endpoint,
                                        unicode(options["statedir"]),
                                        bool(options["silent"]),
-                                       crypto)
+                                       crypto,
+                                       event_log)
             container[0] = dispersy
             manhole_namespace['dispersy'] = dispersy
 
@@ -235,6 +351,8 @@ class TrackerServiceMaker(object):
                 msg("Received signal '%s' in %s (shutting down)" % (sig, frame))
                 if not self._stopping:
                     self._stopping = True
+                    for worker in workers:
+                        worker.stop()
                     try:
                         dispersy.stop()
                     except Exception, e:
@@ -247,6 +365,12 @@ class TrackerServiceMaker(object):
             if not dispersy.start():
                 raise RuntimeError("Unable to start Dispersy")
 
+            if shard_index == 0:
+                for index in xrange(1, options["workers"]):
+                    worker = WorkerProcessProtocol(index, worker_args(index))
+                    workers.append(worker)
+                    worker.spawn()
+
         # wait forever
         reactor.exitCode = 0
         reactor.callWhenRunning(run)
@@ -5,11 +5,15 @@ import sys
 import traceback
 import warnings
 from cProfile import Profile
+from itertools import count
+from operator import attrgetter
+from random import random
 from socket import inet_aton, error as socket_error
 from thread import get_ident
 from threading import current_thread
 from time import time
 from socket import inet_aton, socket, AF_INET, SOCK_DGRAM
+from string import Formatter
 from struct import unpack_from
 
 from twisted.internet import reactor, defer
@@ -17,7 +21,7 @@ from twisted.internet.task import LoopingCall
 from twisted.python import failure
 from twisted.python.threadable import isInIOThread
 
-from .statistics import _runtime_statistics
+from .statistics import _runtime_statistics, _runtime_statistics_settings
 
 
 logger = logging.getLogger(__name__)
@@ -25,6 +29,9 @@ logger = logging.getLogger(__name__)
 
 MEMORY_DUMP_INTERVAL = float(60 * 60)
 
+# maximum number of distinct entries remembered per attach_runtime_statistics decorator
+RUNTIME_STATISTICS_ENTRY_CACHE_SIZE = 1024
+
 
 #
 # Various decorators
@@ -110,7 +117,97 @@ else:
         return func
 
 
-def attach_runtime_statistics(format_):
+def _compile_runtime_statistics_entry(format_, function_name):
+    """
+    Returns a function(args, kargs, return_value) that returns the FORMAT_ entry for one call.
+
+    FORMAT_ is parsed once.  For every call only the fields are resolved, the resulting values are used to look up
+    previously formatted entries, hence str.format is only called when a new combination of values is seen.
+    """
+    parts = []
+    fields = []
+    auto_index = count()
+    for literal, field_name, format_spec, conversion in Formatter().parse(format_):
+        parts.append(literal.replace(u"{", u"{{").replace(u"}", u"}}"))
+        if field_name is None:
+            continue
+
+        first, rest = field_name._formatter_field_name_split()
+        if first == u"":
+            first = next(auto_index)
+        rest = tuple(rest)
+
+        if first == u"function_name" and not rest and not format_spec and not conversion:
+            parts.append(function_name.replace(u"{", u"{{").replace(u"}", u"}}"))
+            continue
+
+        parts.append(u"{%d%s%s}" % (len(fields),
+                                    u"!" + conversion if conversion else u"",
+                                    u":" + format_spec if format_spec else u""))
+        fields.append((first, rest))
+
+    compiled = u"".join(parts)
+    if not fields:
+        entry = compiled.format()
+        return lambda args, kargs, return_value: entry
+
+    def resolve(first, rest, args, kargs, return_value):
+        try:
+            if isinstance(first, (int, long)):
+                value = args[first]
+            elif first == u"return_value":
+                value = return_value
+            elif first == u"function_name":
+                value = function_name
+            else:
+                value = kargs[first]
+            for is_attribute, key in rest:
+                value = getattr(value, key) if is_attribute else value[key]
+            return value
+        except (AttributeError, LookupError, TypeError):
+            # i.e. return_value.name when FUNC raised an exception
+            return None
+
+    def make_getter(first, rest):
+        if rest and all(is_attribute for is_attribute, _ in rest):
+            path = attrgetter(".".join(key for _, key in rest))
+            if isinstance(first, (int, long)):
+                return lambda args, kargs, return_value: path(args[first])
+            if first == u"return_value":
+                return lambda args, kargs, return_value: path(return_value)
+
+        elif not rest:
+            if isinstance(first, (int, long)):
+                return lambda args, kargs, return_value: args[first]
+            if first == u"return_value":
+                return lambda args, kargs, return_value: return_value
+
+        return lambda args, kargs, return_value: resolve(first, rest, args, kargs, return_value)
+
+    getters = [make_getter(first, rest) for first, rest in fields]
+    cache = {}
+
+    def entry_for(args, kargs, return_value):
+        try:
+            values = tuple([getter(args, kargs, return_value) for getter in getters])
+        except (AttributeError, LookupError, TypeError):
+            values = tuple([resolve(first, rest, args, kargs, return_value) for first, rest in fields])
+
+        try:
+            return cache[values]
+        except KeyError:
+            entry = compiled.format(*values)
+            if len(cache) < RUNTIME_STATISTICS_ENTRY_CACHE_SIZE:
+                cache[values] = entry
+            return entry
+        except TypeError:
+            # unhashable value
+            return compiled.format(*values)
+
+    return entry_for
+
+
+def attach_runtime_statistics(format_, sample_rate=None):
     """
     Keep track of how often and how long a function was called.
 
@@ -135,15 +232,38 @@ def attach_runtime_statistics(format_):
     - 'foo bar=1 moo=milk returns=41' was called once
     - 'foo bar=2 moo=milk returns=42' was called twice
 
+    FORMAT_ is compiled when the function is decorated and formatted entries are reused for fields
+    that resolve to the same (hashable) values.  Fields should therefore resolve to small values,
+    such as names, rather than to objects that are unique for every call.
+
+    The instrumentation can be switched off, or set to measure only a random fraction of the calls,
+    using DispersyStatistics.enable_runtime_statistics.  SAMPLE_RATE overrides that fraction for
+    this function only.  When sampling, count and duration are estimates.
+
     Updated runtime information is available from Dispersy.statistics.runtime after calling
     Dispersy.statistics.update().  Statistics.runtime is a list (in no particular order) containing
-    dictionaries with the keys: count, duration, average, and entry.
+    dictionaries with the keys: count, samples, duration, average, histogram, and entry.
     """
     assert isinstance(format_, basestring), type(format_)
+    assert sample_rate is None or 0.0 < sample_rate <= 1.0, sample_rate
+    settings = _runtime_statistics_settings
 
     def helper(func):
+        entry_for = _compile_runtime_statistics_entry(unicode(format_), unicode(func.__name__))
+
         @functools.wraps(func)
         def wrapper(*args, **kargs):
+            if not settings.enabled:
+                return func(*args, **kargs)
+
+            rate = settings.sample_rate if sample_rate is None else sample_rate
+            if rate < 1.0:
+                if random() >= rate:
+                    return func(*args, **kargs)
+                weight = 1.0 / rate
+            else:
+                weight = 1
+
             return_value = None
             start = time()
             try:
@@ -151,8 +271,7 @@ def attach_runtime_statistics(format_):
                 return return_value
             finally:
                 end = time()
-                entry = format_.format(function_name=func.__name__, return_value=return_value, *args, **kargs)
-                _runtime_statistics[entry].increment(end - start)
+                _runtime_statistics[entry_for(args, kargs, return_value)].increment(end - start, weight)
         return wrapper
     return helper
 
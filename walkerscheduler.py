@@ -0,0 +1,145 @@
+"""
+Schedules the walk steps of all communities.
+
+Instead of every community running its own LoopingCall, each community registers its step function and interval with
+the WalkerScheduler of its Dispersy instance.  A single LoopingCall takes the steps that are due, at most
+WALKER_STEPS_PER_SECOND steps per second on average.  When more steps are due than the budget allows, the communities
+with the lowest Community.get_walk_priority take their step first and the others are postponed to the next tick.
+Because the next step of a community is due one interval after its previous step was taken, steps that were postponed
+remain spread out over time.
+
+Communities that are scheduled at the same moment, e.g. when Dispersy starts, would otherwise take every step in the same
+tick.  Unless an explicit delay is given, the first step of each community is offset by a fraction of its interval.  The
+fractions follow the golden ratio sequence, hence any number of communities is spread evenly over the interval.
+"""
+import logging
+from heapq import heappop, heappush
+from itertools import count
+from time import time
+
+from twisted.internet.task import LoopingCall
+
+from .taskmanager import TaskManager
+
+# seconds between two scheduler runs
+WALKER_TICK_INTERVAL = 0.1
+# maximum number of walk steps per second, over all communities
+WALKER_STEPS_PER_SECOND = 100.0
+# the fractional part of the golden ratio, successive multiples modulo one are spread evenly over [0, 1)
+_PHASE_STEP = 0.6180339887498949
+
+
+class _WalkEntry(object):
+
+    __slots__ = ("community", "step", "interval", "due", "active")
+
+    def __init__(self, community, step, interval, due):
+        self.community = community
+        self.step = step
+        self.interval = interval
+        self.due = due
+        self.active = True
+
+
+class WalkerScheduler(TaskManager):
+
+    def __init__(self, steps_per_second=WALKER_STEPS_PER_SECOND, tick_interval=WALKER_TICK_INTERVAL):
+        assert isinstance(steps_per_second, float), type(steps_per_second)
+        assert steps_per_second > 0.0, steps_per_second
+        assert isinstance(tick_interval, float), type(tick_interval)
+        assert tick_interval > 0.0, tick_interval
+        super(WalkerScheduler, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._tick_interval = tick_interval
+        self._steps_per_tick = steps_per_second * tick_interval
+        # the number of steps that may be taken, grows by _steps_per_tick every tick
+        self._budget = 0.0
+        # community:_WalkEntry pairs
+        self._entries = {}
+        # (due, sequence, _WalkEntry) tuples, entries that are no longer active are skipped
+        self._queue = []
+        self._sequence = count()
+        # the number of the next phase offset
+        self._slots = count()
+
+    @property
+    def steps_per_second(self):
+        return self._steps_per_tick / self._tick_interval
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, community):
+        return community in self._entries
+
+    def schedule(self, community, step, interval, delay=None):
+        """
+        Calls STEP every INTERVAL seconds for COMMUNITY, starting after DELAY seconds.
+
+        When DELAY is None the first step is taken after a phase offset in [0, INTERVAL), spreading the steps of
+        communities that are scheduled together over the ticks.  Replaces the step that was previously scheduled for
+        COMMUNITY, if any.
+        """
+        assert callable(step), step
+        assert interval > 0.0, interval
+        assert delay is None or delay >= 0.0, delay
+        if delay is None:
+            delay = (next(self._slots) * _PHASE_STEP) % 1.0 * interval
+        self._deactivate(community)
+        entry = self._entries[community] = _WalkEntry(community, step, float(interval), time() + delay)
+        heappush(self._queue, (entry.due, next(self._sequence), entry))
+
+        if not self.is_pending_task_active("tick"):
+            self._budget = self._steps_per_tick
+            self.register_task("tick", LoopingCall(self._tick)).start(self._tick_interval, now=False)
+
+    def unschedule(self, community):
+        """
+        Stops taking steps for COMMUNITY.
+        """
+        self._deactivate(community)
+        if not self._entries:
+            self._queue = []
+            self.cancel_pending_task("tick")
+
+    def _deactivate(self, community):
+        entry = self._entries.pop(community, None)
+        if entry:
+            entry.active = False
+
+    def _tick(self):
+        now = time()
+        self._budget = min(self._budget + self._steps_per_tick, max(self._steps_per_tick, 1.0))
+
+        due = []
+        queue = self._queue
+        while queue and queue[0][0] <= now:
+            _, _, entry = heappop(queue)
+            if entry.active:
+                due.append(entry)
+        if not due:
+            return
+
+        steps = min(int(self._budget), len(due))
+        if steps < len(due):
+            due.sort(key=lambda entry: (entry.community.get_walk_priority(), entry.due))
+            for entry in due[steps:]:
+                heappush(queue, (entry.due, next(self._sequence), entry))
+            self._logger.debug("postponing %d walk steps", len(due) - steps)
+        self._budget -= steps
+
+        for entry in due[:steps]:
+            if not entry.active:
+                # unscheduled by a step taken earlier in this tick
+                continue
+
+            # the next step is scheduled before this step is taken, allowing STEP to reschedule or unschedule
+            latency = now - entry.due
+            entry.due = now + entry.interval
+            heappush(queue, (entry.due, next(self._sequence), entry))
+
+            entry.community.statistics.increase_walk_step(latency)
+            try:
+                entry.step()
+            except Exception:
+                self._logger.exception("walk step for %s failed", entry.community)